@@ -3,18 +3,25 @@
 import json
 import sys
 
-from aws_lambda_email import email_handler
-from aws_lambda_sms import sms_handler
+from tracing import trace
 from utils import logger
 
 LOG = logger(__name__)
 
 
-def entrypoint(event, context):
+def entrypoint(event, context, sources=None, email_s3_client=None):
+    """The Lambda handler. sources and email_s3_client are for running it outside Lambda against
+    other forecast sources and S3 endpoints"""
+    # Handlers are imported per route so an sms cold start never loads boto3
     if "queryStringParameters" in event:
-        return sms_handler(event)
+        with trace('sms'):
+            from aws_lambda_sms import sms_handler
+            return sms_handler(event, sources)
     elif event.get("Records", [{}])[0].get("eventSource") == "aws:ses":
-        email_handler(event)  # Don't return anything for ses events
+        with trace('email'):
+            from aws_lambda_email import email_handler
+            # Don't return anything for ses events
+            email_handler(event, sources=sources, s3=email_s3_client)
     else:
         LOG.error('event=unknown_lambda_event, event=%s', event)
         raise Exception("Unknown lambda event")
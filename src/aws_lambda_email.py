@@ -8,19 +8,35 @@ from email.parser import BytesParser
 import boto3
 import botocore
 
-from inreach import is_request_email_from_inreach, send_inreach_response, create_inreach_response
-from interpreter import interpret
+from forecast_archive import S3ArchiveBackend
+from inreach import is_request_email_from_inreach, send_inreach_response, create_inreach_response, \
+    DeliveryLog
+from interpreter import interpret, DEFAULT_SOURCES
+from tracing import span, annotate
 from utils import logger
 
 LOG = logger(__name__)
 EMAIL_S3_BUCKET_NAME = 'avysms-email'
 
+# Segments already sent are recorded next to the received emails, so when SES retries a failed
+# invocation only the segments that were not delivered are sent again
+DELIVERED_S3_PREFIX = 'delivered'
 
-def retreive_email_from_s3(ses_message_id):
-    s3 = boto3.resource('s3')
+S3_CLIENT = None
+
+
+def s3_client():
+    global S3_CLIENT
+    if S3_CLIENT is None:
+        S3_CLIENT = boto3.client('s3')
+    return S3_CLIENT
+
+
+def retreive_email_from_s3(ses_message_id, client=None):
     try:
         key = os.path.join('received', ses_message_id)
-        raw_bytes = s3.Object(EMAIL_S3_BUCKET_NAME, key).get()['Body'].read()
+        response = (client or s3_client()).get_object(Bucket=EMAIL_S3_BUCKET_NAME, Key=key)
+        raw_bytes = response['Body'].read()
         return BytesParser(policy=policy.default).parsebytes(raw_bytes)
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] == "404":
@@ -28,22 +44,29 @@ def retreive_email_from_s3(ses_message_id):
         raise e
 
 
-def email_handler(event, should_reply=True):
+def email_handler(event, should_reply=True, sources=None, s3=None):
+    """Answers an inreach request email. sources and s3, an S3 client, default to the
+    configured forecast sources and the container's client"""
     LOG.info('event=email_handler_invoked, event=%s', event)
 
     ses_message_id = event["Records"][0]["ses"]["mail"]["messageId"]
 
-    request_email = retreive_email_from_s3(ses_message_id)
+    request_email = retreive_email_from_s3(ses_message_id, s3)
     request_body = request_email.get_body(preferencelist='plain').get_content()
 
     if not is_request_email_from_inreach(request_email):
         LOG.warning('event=email_not_from_inreach, from=%s', request_email['From'])
         return
 
-    response_segments = interpret(request_body, joined=False)
+    response_segments = interpret(request_body, False, sources or DEFAULT_SOURCES)
     inreach_response = create_inreach_response(request_email, response_segments)
     if should_reply:
-        send_inreach_response(inreach_response)
+        with span('send_inreach_response', segments=len(response_segments)):
+            delivery_log = DeliveryLog(S3ArchiveBackend(EMAIL_S3_BUCKET_NAME, DELIVERED_S3_PREFIX,
+                                                        s3 or s3_client()))
+            deliveries = send_inreach_response(inreach_response, delivery_log=delivery_log)
+            annotate(attempts=sum(delivery.attempts for delivery in deliveries),
+                     failed=sum(1 for delivery in deliveries if not delivery.delivered))
 
     LOG.info('event=email_handler_success, body=%s', response_segments)
 
@@ -5,7 +5,7 @@ import sys
 
 from twilio.twiml.messaging_response import MessagingResponse
 
-from interpreter import interpret
+from interpreter import interpret, DEFAULT_SOURCES
 from utils import logger, safe
 
 LOG = logger(__name__)
@@ -20,7 +20,7 @@ def segments_to_twiml(segments):
     return response
 
 
-def sms_handler(event):
+def sms_handler(event, sources=None):
     LOG.info('event=sms_handler_invoked, event=%s', event)
 
     # from_number = event["queryStringParameters"].get("From", None)
@@ -31,7 +31,7 @@ def sms_handler(event):
         "headers": {
             "Content-Type": "application/xml"
         },
-        "body": str(segments_to_twiml(interpret(body, joined=False)))
+        "body": str(segments_to_twiml(interpret(body, False, sources or DEFAULT_SOURCES)))
     }
 
     LOG.info('event=sms_handler_success, result=%s', result)
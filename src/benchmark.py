@@ -0,0 +1,232 @@
+#! /usr/bin/env python3
+
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from caic_html_to_forecast import parse_forecast
+from download_caic_html import HttpCache
+from forecast_cache import FORECAST_CACHE
+from forecast_to_segments import forecast_to_segments
+from format_segments import format_segments, reduce_segments, pack_segments
+from inreach import DeliveryLog
+from interpreter import interpret, render_zone, ForecastSources, HELP_TEXT
+from local_stubs import CaicStubServer, TwilioStubServer
+from sms_encoding import count_sms, fits_in_one_sms, fits_in_part
+from subscriptions import Subscription, TwilioProvider, TokenBucket, fan_out, \
+    FANOUT_BATCH_SIZE, FANOUT_MAX_IN_FLIGHT
+from tracing import percentile
+from utils import logger
+
+LOG = logger(__name__)
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+
+FIXTURE_GLOB = os.path.join(ROOT_DIR, "test", "fixtures", "*.html")
+
+BASELINE_PATH = os.path.join(ROOT_DIR, "test", "benchmark_baseline.json")
+
+# A stage regresses when its mean is this many times its baseline mean, and at least this many
+# milliseconds slower so timer noise on the sub-millisecond stages is not reported
+DEFAULT_THRESHOLD = 1.5
+MIN_REGRESSION_MS = 0.1
+
+# Zone ids the fixtures are served as, with a request that interpret maps to each
+ZONE_REQUESTS = [(9, "sangre"), (1, "front"), (2, "vail"), (3, "sawatch"), (4, "aspen")]
+
+
+def measure_memory(function):
+    """Returns (peak_kib, retained_kib) of one call of function"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    retained = sum(s.size_diff for s in after.compare_to(before, 'filename') if s.size_diff > 0)
+    return peak / 1024, retained / 1024
+
+
+def measure_stage(calls, iterations):
+    """Times every call iterations times and measures the memory of the first"""
+    durations = []
+    for _ in range(iterations):
+        for call in calls:
+            start = time.perf_counter()
+            call()
+            durations.append((time.perf_counter() - start) * 1000)
+    peak_kib, retained_kib = measure_memory(calls[0])
+    return {
+        "mean_ms": round(sum(durations) / len(durations), 4),
+        "p95_ms": round(percentile(durations, 0.95), 4),
+        "peak_kib": round(peak_kib, 1),
+        "retained_kib": round(retained_kib, 1),
+        "samples": len(durations),
+    }
+
+
+def cold_interpret(request, sources):
+    FORECAST_CACHE.clear()
+    return interpret(request, False, sources)
+
+
+def run_benchmark(fixture_paths, iterations):
+    pages = []
+    for path in fixture_paths:
+        with open(path, 'r') as f:
+            pages.append(f.read())
+    forecasts = [parse_forecast(html) for html in pages]
+    segments = [forecast_to_segments(forecast) for forecast in forecasts]
+    zone_requests = ZONE_REQUESTS[:len(pages)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            CaicStubServer({z: html for (z, _), html in zip(zone_requests, pages)}) as caic:
+        sources = ForecastSources(caic.url_template, HttpCache(tmp_dir), tmp_dir)
+        if any(cold_interpret(r, sources) == [HELP_TEXT] for _, r in zone_requests):
+            raise Exception("interpret failed against the stubbed CAIC server")
+        stages = {
+            "parse_forecast": [lambda h=h: parse_forecast(h) for h in pages],
+            "forecast_to_segments": [lambda f=f: forecast_to_segments(f) for f in forecasts],
+            "format_segments": [lambda s=s: format_segments(s, joined=False) for s in segments],
+            "interpret": [lambda r=r: cold_interpret(r, sources) for _, r in zone_requests],
+        }
+        return {name: measure_stage(calls, iterations) for name, calls in stages.items()}
+
+
+def compare_packing(fixture_paths):
+    """Returns (name, shipped messages, shipped sms, packed messages, packed sms) for each fixture
+    forecast, for all of them in one multi zone response and for each forecast with its warning
+    descriptions added as blocks too large for one sms. Shipped is the greedy packing unjoined
+    responses used before pack_segments, filling each message up to one 153 septet part. A
+    message too large for one sms is billed as several"""
+    forecasts_segments = []
+    with_descriptions = []
+    for path in fixture_paths:
+        with open(path, 'r') as f:
+            forecast = parse_forecast(f.read())
+        segments = forecast_to_segments(forecast)
+        forecasts_segments.append((os.path.basename(path), segments))
+        if forecast.warnings:
+            with_descriptions.append((os.path.basename(path) + " + warning text",
+                                      segments + [w.description for w in forecast.warnings]))
+    forecasts_segments.append(("all fixtures", [s for _, ss in forecasts_segments for s in ss]))
+    forecasts_segments.extend(with_descriptions)
+
+    results = []
+    for name, segments in forecasts_segments:
+        shipped = reduce_segments(segments, fits_in_part)
+        packed = pack_segments(reduce_segments(segments, lambda text: False), fits_in_one_sms)
+        results.append((name, len(shipped), sum(map(count_sms, shipped)),
+                        len(packed), sum(map(count_sms, packed))))
+    return results
+
+
+def run_fan_out_benchmark(fixture_path, subscribers, max_in_flight=FANOUT_MAX_IN_FLIGHT,
+                          batch_size=FANOUT_BATCH_SIZE, rate=None, delay_seconds=0.0):
+    """Pushes one rendered fixture to subscribers sms subscriptions, half joined and half not,
+    through a local Twilio stub. rate limits messages per second, None does not. Returns a dict of
+    the run's statistics"""
+    with open(fixture_path, 'r') as f:
+        rendered = render_zone(9, f.read())
+    subscriptions = [Subscription(str(i), 9, 'sms', "+1555{:07d}".format(i), joined=i % 2 == 0)
+                     for i in range(subscribers)]
+
+    with TwilioStubServer(delay_seconds=delay_seconds) as twilio:
+        provider = TwilioProvider('AC0', 'token', '+15550000000', twilio.api_url,
+                                  TokenBucket(rate))
+        start = time.perf_counter()
+        result = fan_out(rendered, subscriptions, {'sms': provider}, batch_size, max_in_flight,
+                         push_log=DeliveryLog())
+        seconds = time.perf_counter() - start
+        if len(twilio.messages) != result.messages:
+            raise Exception("stub received {} of {} messages".format(
+                len(twilio.messages), result.messages))
+        max_in_flight_seen = twilio.max_in_flight
+
+    return {
+        "subscribers": subscribers,
+        "delivered": result.delivered,
+        "failed": result.failed,
+        "messages": result.messages,
+        "seconds": round(seconds, 3),
+        "messages_per_second": round(result.messages / max(seconds, 1e-9), 1),
+        "max_in_flight": max_in_flight_seen,
+    }
+
+
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Returns (stage, mean_ms, baseline_mean_ms) for every stage slower than threshold times its
+    baseline"""
+    regressions = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        mean_ms, baseline_mean_ms = result["mean_ms"], baseline[stage]["mean_ms"]
+        slower_ms = mean_ms - baseline_mean_ms
+        if mean_ms > threshold * baseline_mean_ms and slower_ms > MIN_REGRESSION_MS:
+            regressions.append((stage, mean_ms, baseline_mean_ms))
+    return regressions
+
+
+def format_results(results):
+    lines = ["{:<22} {:>9} {:>9} {:>10} {:>12}".format(
+        "stage", "mean ms", "p95 ms", "peak KiB", "retained KiB")]
+    for stage, r in results.items():
+        lines.append("{:<22} {:>9.3f} {:>9.3f} {:>10.1f} {:>12.1f}".format(
+            stage, r["mean_ms"], r["p95_ms"], r["peak_kib"], r["retained_kib"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--iterations", type=int, default=20)
+    parser.add_argument("-b", "--baseline", default=BASELINE_PATH)
+    parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("-u", "--update-baseline", action="store_true")
+    parser.add_argument("-p", "--packing", action="store_true",
+                        help="compare the sms counts of the previously shipped greedy packing "
+                             "and pack_segments instead")
+    parser.add_argument("-f", "--fan-out", type=int, metavar="SUBSCRIBERS",
+                        help="time pushing a forecast to this many subscribers instead")
+    parser.add_argument("--max-in-flight", type=int, default=FANOUT_MAX_IN_FLIGHT)
+    parser.add_argument("--rate", type=float, default=None, help="messages per second limit")
+    parser.add_argument("--delay", type=float, default=0.0,
+                        help="seconds the stub provider takes per message")
+    parser.add_argument("fixtures", nargs="*")
+    args = parser.parse_args()
+
+    fixture_paths = args.fixtures or sorted(glob.glob(FIXTURE_GLOB))
+    if args.fan_out:
+        print(json.dumps(run_fan_out_benchmark(fixture_paths[0], args.fan_out,
+                                               args.max_in_flight, rate=args.rate,
+                                               delay_seconds=args.delay)))
+        sys.exit(0)
+    if args.packing:
+        print("{:<30} {:>16} {:>11} {:>15} {:>11}".format(
+            "forecast", "shipped messages", "shipped sms", "packed messages", "packed sms"))
+        for row in compare_packing(fixture_paths):
+            print("{:<30} {:>16} {:>11} {:>15} {:>11}".format(*row))
+        sys.exit(0)
+
+    results = run_benchmark(fixture_paths, args.iterations)
+    print(format_results(results))
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        sys.exit(0)
+
+    with open(args.baseline, 'r') as f:
+        regressions = find_regressions(results, json.load(f), args.threshold)
+    for stage, mean_ms, baseline_mean_ms in regressions:
+        print("REGRESSION {}: {:.3f} ms, baseline {:.3f} ms".format(
+            stage, mean_ms, baseline_mean_ms))
+    sys.exit(1 if regressions else 0)
@@ -1,33 +1,73 @@
 #! /usr/bin/env python3
 
-import boto3
-import sys
-import datetime
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from download_caic_html import download_html
+from forecast_archive import open_archive
+from interpreter import render_zone
+from rendered_store import publish_rendered, read_rendered, previous_forecast, forecast_changed
+from subscriptions import push_forecast
 from utils import safe, logger
 
-FORECAST_REGION = 'CAIC'
 ZONE_IDS = range(0, 10)
-BUCKET_NAME = 'avysms-forecast'
-S3 = boto3.resource('s3')
+MAX_CONCURRENT_ZONES = int(os.environ.get('AVYSMS_MAX_CONCURRENT_ZONES', 10))
 LOG = logger(__name__)
 
+FORECAST_ARCHIVE = None
+
+
+def forecast_archive():
+    # Kept for the life of the container so warm runs reuse the loaded zone indexes
+    global FORECAST_ARCHIVE
+    if FORECAST_ARCHIVE is None:
+        FORECAST_ARCHIVE = open_archive()
+    return FORECAST_ARCHIVE
+
+
+@safe(log=LOG)
+def publish_rendered_zone(zone_id, html, published):
+    """Renders the zone's responses so interpret can serve them without fetching"""
+    rendered = render_zone(zone_id, html)
+    rendered.previous_forecast = previous_forecast(published, rendered)
+    publish_rendered(rendered)
+    return rendered
+
+
+@safe(log=LOG)
+def push_to_subscribers(rendered):
+    return push_forecast(rendered)
+
 
 @safe(log=LOG)
 def cache_html(zone_id):
-    object_name = os.path.join(FORECAST_REGION, str(zone_id), str(datetime.datetime.now()))
-    LOG.info("event=caching_invoked, object_name=%s", object_name)
+    start = time.perf_counter()
+    LOG.info("event=caching_invoked, zone_id=%s", zone_id)
     html = download_html(zone_id)
-    object = S3.Object(BUCKET_NAME, object_name)
-    object.put(Body=html)
-    LOG.info("event=caching_success, object_name=%s", object_name)
+    digest, _ = forecast_archive().store(zone_id, html)
+    published = read_rendered(zone_id)
+    rendered = publish_rendered_zone(zone_id, html, published)
+    # Pages change on every download for reasons that are not the forecast, so only a new forecast
+    # date or forecast html is pushed. The push log skips whatever a subscriber already got
+    changed = rendered is not None and forecast_changed(published, rendered)
+    if changed:
+        # Rendered once above, then sent to every subscriber of the zone
+        push_to_subscribers(rendered)
+    LOG.info("event=caching_success, zone_id=%s, digest=%s, changed=%s, seconds=%.3f",
+             zone_id, digest, changed, time.perf_counter() - start)
     return html
 
 
-def update_cache():
-    return list(map(cache_html, ZONE_IDS))
+def update_cache(zone_ids=ZONE_IDS, max_workers=MAX_CONCURRENT_ZONES):
+    """Downloads and stores every zone concurrently. A failed zone is logged and returned as None
+    without affecting the other zones"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(cache_html, zone_ids))
+    LOG.info("event=update_cache_complete, zones=%d, failed=%d, seconds=%.3f",
+             len(results), results.count(None), time.perf_counter() - start)
+    return results
 
 
 def lambda_handler(event, context):
@@ -1,16 +1,46 @@
 #! /usr/bin/env python3
 
+import argparse
 import re
 import sys
+import timeit
+from bisect import bisect_left
+from collections import defaultdict
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
 
 from forecast import Forecast, ElevationType, AspectType, ProblemType, LikelihoodType, \
     DangerType, SizeType
-from utils import safe, is_not_None, logger
+from tracing import annotate
+from utils import attempt, is_not_None, logger, ErrorReport
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
 
 LOG = logger(__name__)
 
+PARSER_BACKENDS = ('html.parser', 'lxml', 'regions')
+
+DEFAULT_PARSER_BACKEND = 'regions'
+
+# Tree builder used for the fragments collected by the 'regions' backend
+REGIONS_TREE_BUILDER = 'lxml' if lxml is not None else 'html.parser'
+
+FORECAST_REGION_REGEX = re.compile(
+    r'<div\b[^>]*\bid=["\']avalanche-forecast["\']'
+    r'|<div\b[^>]*\bclass=["\'][^"\']*\bavalanche-warning\b',
+    re.IGNORECASE)
+
+DIV_TAG_REGEX = re.compile(r'<(/?)div\b', re.IGNORECASE)
+
+PROBLEM_TYPE_URL_REGEX = re.compile(r'.*post_id=(\d+).*')
+
+LIKELIHOOD_ID_REGEX = re.compile(r'(\w+)_\d')
+
+DANGER_CLASS_REGEX = re.compile(r'(\w+)_danger_(\w+)')
+
 PROBLEM_TYPE_ID_TO_TYPE = {
     113: ProblemType.StormSlab,
     114: ProblemType.WindSlab,
@@ -61,171 +91,326 @@ SIZE_ID_TO_NAME = {
 }
 
 
-@safe(log=LOG)
-def parse_forecast_date(forecast_root):
-    return forecast_root.find("h2").contents[0].strip()
-
-
-@safe(log=LOG)
-def parse_forecast_description(forecast_root):
-    return "".join(forecast_root.find("div", attrs={"class": "fx-text-area"}).strings) \
+class HtmlIndex(object):
+    """Id, class and tag name lookups over a parsed page, built in a single pass. Tags are numbered
+    in document order so the tags nested inside any indexed tag form a contiguous range"""
+
+    def __init__(self, root):
+        self.size = 0
+        self.ranges = {}
+        self.by_id = {}
+        self.by_class = defaultdict(lambda: ([], []))
+        self.by_name = defaultdict(lambda: ([], []))
+        self.index_tag(root)
+
+    def index_tag(self, tag):
+        position = self.size
+        self.size += 1
+        if tag.get('id') is not None:
+            self.by_id.setdefault(tag['id'], tag)
+        for cls in tag.get_attribute_list('class'):
+            if cls is not None:
+                self.add(self.by_class[cls], position, tag)
+        self.add(self.by_name[tag.name], position, tag)
+        for child in tag.children:
+            if isinstance(child, Tag):
+                self.index_tag(child)
+        self.ranges[id(tag)] = (position + 1, self.size)
+
+    @staticmethod
+    def add(entries, position, tag):
+        entries[0].append(position)
+        entries[1].append(tag)
+
+    def within(self, entries, root):
+        """Returns the indexed tags nested inside root. A missing root raises rather than widening
+        the lookup to the whole page, where unrelated markup could match"""
+        if root is None:
+            raise LookupError("Lookup root not found")
+        start, end = self.ranges[id(root)]
+        return entries[1][bisect_left(entries[0], start):bisect_left(entries[0], end)]
+
+    def find_all_class(self, cls, root, name=None):
+        tags = self.within(self.by_class.get(cls, ([], [])), root)
+        return tags if name is None else [t for t in tags if t.name == name]
+
+    def find_class(self, cls, root, name=None):
+        return next(iter(self.find_all_class(cls, root, name)), None)
+
+    def find_all_name(self, name, root):
+        return self.within(self.by_name.get(name, ([], [])), root)
+
+    def find_name(self, name, root):
+        return next(iter(self.find_all_name(name, root)), None)
+
+    def find_id(self, tag_id):
+        return self.by_id.get(tag_id, None)
+
+    @staticmethod
+    def classes(tag):
+        return tag.get_attribute_list('class')
+
+
+def parse_forecast_date(forecast_root, index=None):
+    index = index or HtmlIndex(forecast_root)
+    return index.find_name("h2", forecast_root).contents[0].strip()
+
+
+def parse_forecast_description(forecast_root, index=None):
+    index = index or HtmlIndex(forecast_root)
+    return "".join(index.find_class("fx-text-area", forecast_root, name="div").strings) \
         .replace("\u00a0", "").strip()
 
 
-@safe(log=LOG)
-def parse_problem_type(problem_root):
-    problem_type_url = problem_root.find("a", attrs={"data-fancybox-type": "iframe"})["href"]
-    problem_type_id = int(re.search(r'.*post_id=(\d+).*', problem_type_url).group(1))
+def parse_problem_type(problem_root, index=None):
+    index = index or HtmlIndex(problem_root)
+    problem_type_link = next(a for a in index.find_all_name("a", problem_root)
+                             if a.get("data-fancybox-type") == "iframe")
+    problem_type_id = int(PROBLEM_TYPE_URL_REGEX.search(problem_type_link["href"]).group(1))
     return PROBLEM_TYPE_ID_TO_TYPE[problem_type_id].name
 
 
-@safe(log=LOG)
-def parse_problem_likelihood(problem_root):
-    likelihood_root = problem_root.find('div', attrs={'class': 'likelihood-graphic'})
-    likelihood_id = likelihood_root.find('div', attrs={'class': 'on'})['id']
-    return PROBLEM_LIKELIHOOD_ID_TO_TYPE[re.search(r'(\w+)_\d', likelihood_id).group(1)].name
+def parse_problem_likelihood(problem_root, index=None):
+    index = index or HtmlIndex(problem_root)
+    likelihood_root = index.find_class('likelihood-graphic', problem_root, name='div')
+    likelihood_id = index.find_class('on', likelihood_root, name='div')['id']
+    return PROBLEM_LIKELIHOOD_ID_TO_TYPE[LIKELIHOOD_ID_REGEX.search(likelihood_id).group(1)].name
 
 
-@safe(log=LOG)
-def parse_problem_size(problem_root):
-    id_regex = re.compile(r"avi_size_\d+")
-    size_root = problem_root.find(id=id_regex)
+def parse_problem_size(problem_root, index=None):
+    index = index or HtmlIndex(problem_root)
+    size_root = index.find_class('size-graphic', problem_root)
     return next(
         filter(
             is_not_None,
             map(
                 lambda cls: SIZE_ID_TO_NAME.get(cls, None),
-                size_root.get_attribute_list("class"))))
+                index.classes(size_root))))
 
 
-@safe(log=LOG)
-def is_elevation_aspect_problematic(rose_root, elevation, aspect):
+def is_elevation_aspect_problematic(rose_root, elevation, aspect, index=None):
+    index = index or HtmlIndex(rose_root)
     elevation_class = ELEVATION_TYPE_TO_PROBLEM_ELEVATION_ID[elevation]
-    id_regex = re.compile(aspect.value + elevation_class + r"_\d+")
-    return 'on' in rose_root.find(id=id_regex).get_attribute_list("class")
+    return 'on' in index.classes(index.find_class(aspect.value + elevation_class, rose_root))
 
 
-@safe(log=LOG)
-def parse_problem_rose(problem_root):
-    rose_root = problem_root.find("div", attrs={"class": "ProblemRose"})
+def unknown_problem_rose():
+    return {elevation.name: {aspect.name: None for aspect in list(AspectType)}
+            for elevation in list(ElevationType)}
 
+
+def parse_problem_rose(problem_root, index=None, report=None):
+    index = index or HtmlIndex(problem_root)
+    rose_root = index.find_class("ProblemRose", problem_root, name="div")
+    if rose_root is None:
+        raise ValueError("Problem rose not found")
+
+    # An aspect that can not be read is left as None, which is reported as possibly problematic
     problem_rose = {elevation.name:
-                    {aspect.name: is_elevation_aspect_problematic(rose_root, elevation, aspect)
+                    {aspect.name: attempt(report, 'problem.rose.aspect', None,
+                                          is_elevation_aspect_problematic,
+                                          rose_root, elevation, aspect, index)
                      for aspect in list(AspectType)}
                     for elevation in list(ElevationType)}
 
     return problem_rose
 
 
-@safe(log=LOG)
-def parse_problem(problem_root):
+def parse_problem(problem_root, index=None, report=None):
+    index = index or HtmlIndex(problem_root)
     return {
-        "problem_type": parse_problem_type(problem_root),
-        "likelyhood": parse_problem_likelihood(problem_root),
-        "size": parse_problem_size(problem_root),
-        "rose": parse_problem_rose(problem_root)
+        "problem_type": attempt(report, 'problem.type', None,
+                                parse_problem_type, problem_root, index),
+        "likelyhood": attempt(report, 'problem.likelihood', None,
+                              parse_problem_likelihood, problem_root, index),
+        "size": attempt(report, 'problem.size', None, parse_problem_size, problem_root, index),
+        "rose": attempt(report, 'problem.rose', unknown_problem_rose(),
+                        parse_problem_rose, problem_root, index, report)
     }
 
 
-@safe(log=LOG)
-def find_problem_root_from_table(table):
-    return table.parent
-
-
-@safe(safe_return_value=[], log=LOG)
-def find_all_problem_roots(forecast_root):
-    tables = forecast_root.find_all("table", attrs={"class": "table-persistent-slab"})
-    problem_roots = map(find_problem_root_from_table, tables)
-    problem_roots = filter(is_not_None, problem_roots)
+def find_all_problem_roots(forecast_root, index=None):
+    index = index or HtmlIndex(forecast_root)
+    tables = index.find_all_class("table-persistent-slab", forecast_root, name="table")
+    problem_roots = filter(is_not_None, (table.parent for table in tables))
     problem_roots = filter(lambda elem: 'display: none' not in str(
         elem.get('style')), problem_roots)
     return list(problem_roots)
 
 
-@safe(safe_return_value=[], log=LOG)
-def parse_all_problems(forecast_root):
-    problems = map(parse_problem, find_all_problem_roots(forecast_root))
+def parse_all_problems(forecast_root, index=None, report=None):
+    index = index or HtmlIndex(forecast_root)
+    problems = map(lambda root: attempt(report, 'problem', None,
+                                        parse_problem, root, index, report),
+                   find_all_problem_roots(forecast_root, index))
     problems = filter(is_not_None, problems)
     return list(problems)
 
 
-@safe(log=LOG)
-def parse_warning_issued_datetime(warning_root):
-    meta_list = list(warning_root.find('div', attrs={'class': 'title'}).strings)
+def parse_warning_meta_list(warning_root, index):
+    return list(index.find_class('title', warning_root, name='div').strings)
+
+
+def parse_warning_issued_datetime(warning_root, index=None):
+    meta_list = parse_warning_meta_list(warning_root, index or HtmlIndex(warning_root))
     issued_index = meta_list.index("Issued:") + 1
     return str(meta_list[issued_index]).strip()
 
 
-@safe(log=LOG)
-def parse_warning_expires_datetime(warning_root):
-    meta_list = list(warning_root.find('div', attrs={'class': 'title'}).strings)
+def parse_warning_expires_datetime(warning_root, index=None):
+    meta_list = parse_warning_meta_list(warning_root, index or HtmlIndex(warning_root))
     expires_index = meta_list.index("Expires:") + 1
     return str(meta_list[expires_index]).strip()
 
 
-@safe(log=LOG)
-def parse_warning_title(warning_root):
-    meta_root = warning_root.find('div', attrs={'class': 'title'})
-    title_root = meta_root.find('strong')
+def parse_warning_title(warning_root, index=None):
+    index = index or HtmlIndex(warning_root)
+    meta_root = index.find_class('title', warning_root, name='div')
+    title_root = index.find_name('strong', meta_root)
     return str(title_root.string)
 
 
-@safe(log=LOG)
-def parse_warning_description(warning_root):
-    content_root = warning_root.find('div', attrs={'class': 'content'})
+def parse_warning_description(warning_root, index=None):
+    index = index or HtmlIndex(warning_root)
+    content_root = index.find_class('content', warning_root, name='div')
     return "\n".join(content_root.strings).replace('\xa0', '')
 
 
-@safe(log=LOG)
-def parse_warning(warning_root):
+def parse_warning(warning_root, index=None, report=None):
+    index = index or HtmlIndex(warning_root)
     return {
-        "issued": parse_warning_issued_datetime(warning_root),
-        "expires": parse_warning_expires_datetime(warning_root),
-        "title": parse_warning_title(warning_root),
-        "description": parse_warning_description(warning_root)
+        "issued": attempt(report, 'warning.issued', None,
+                          parse_warning_issued_datetime, warning_root, index),
+        "expires": attempt(report, 'warning.expires', None,
+                           parse_warning_expires_datetime, warning_root, index),
+        "title": attempt(report, 'warning.title', None, parse_warning_title, warning_root, index),
+        "description": attempt(report, 'warning.description', None,
+                               parse_warning_description, warning_root, index)
     }
 
 
-@safe(safe_return_value=[], log=LOG)
-def parse_all_warnings(html_root):
-    warning_roots = html_root.find_all('div', attrs={'class': 'avalanche-warning'})
-    warnings = map(parse_warning, warning_roots)
+def parse_all_warnings(html_root, index=None, report=None):
+    index = index or HtmlIndex(html_root)
+    warning_roots = index.find_all_class('avalanche-warning', html_root, name='div')
+    warnings = map(lambda root: attempt(report, 'warning', None,
+                                        parse_warning, root, index, report),
+                   warning_roots)
     warnings = filter(is_not_None, warnings)
     return list(warnings)
 
 
-@safe(log=LOG)
-def parse_danger(danger_root):
-    danger_td_class = str(danger_root.find('td', attrs={'class': 'today-text'}).attrs['class'])
-    danger_elevation_id, danger_id = re.search(r'(\w+)_danger_(\w+)', danger_td_class).group(1, 2)
+def parse_danger(danger_root, index=None):
+    index = index or HtmlIndex(danger_root)
+    danger_td = index.find_class('today-text', danger_root, name='td')
+    danger_classes = map(DANGER_CLASS_REGEX.search, index.classes(danger_td))
+    danger_elevation_id, danger_id = next(filter(is_not_None, danger_classes)).group(1, 2)
     return {
         "elevation": DANGER_ELEVATION_ID_TO_NAME[danger_elevation_id].name,
         "danger_type": DANGER_ID_TO_NAME[danger_id].name
     }
 
 
-@safe(safe_return_value=[], log=LOG)
-def parse_all_dangers(forecast_root):
-    danger_roots = forecast_root.find('table', attrs={'class': 'table-treeline'}) \
-                                .find('tbody').find_all('tr')
-    dangers = map(parse_danger, danger_roots)
+def parse_all_dangers(forecast_root, index=None, report=None):
+    index = index or HtmlIndex(forecast_root)
+    table_root = index.find_class('table-treeline', forecast_root, name='table')
+    danger_roots = index.find_all_name('tr', index.find_name('tbody', table_root))
+    dangers = map(lambda root: attempt(report, 'danger', None, parse_danger, root, index),
+                  danger_roots)
     dangers = filter(is_not_None, dangers)
     return list(dangers)
 
 
-def parse_forecast(html, zone=None):
-    html_root = BeautifulSoup(html, 'html.parser')
-    forecast_root = html_root.find(id="avalanche-forecast")
+def find_region_end(html, region_start):
+    depth = 0
+    for match in DIV_TAG_REGEX.finditer(html, region_start):
+        depth += -1 if match.group(1) else 1
+        if depth == 0:
+            tag_end = html.find('>', match.end())
+            return len(html) if tag_end < 0 else tag_end + 1
+    return None
+
+
+def extract_forecast_regions(html):
+    """Collects the #avalanche-forecast and .avalanche-warning divs in a single pass over the page.
+    Returns None when the page does not have the expected layout"""
+    regions = []
+    region_end = 0
+    has_forecast = False
+    for match in FORECAST_REGION_REGEX.finditer(html):
+        if match.start() < region_end:
+            continue  # Nested inside a region that was already collected
+        region_end = find_region_end(html, match.start())
+        if region_end is None:
+            return None
+        has_forecast = has_forecast or 'avalanche-forecast' in match.group(0)
+        regions.append(html[match.start():region_end])
+    return regions if has_forecast else None
+
+
+def build_html_root(html, parser_backend=DEFAULT_PARSER_BACKEND):
+    if parser_backend not in PARSER_BACKENDS:
+        raise ValueError("Unknown parser backend: {}".format(parser_backend))
+    if parser_backend != 'regions':
+        return BeautifulSoup(html, parser_backend)
+
+    html = html.read() if hasattr(html, 'read') else html
+    regions = extract_forecast_regions(html)
+    if regions is None:
+        LOG.warning('event=forecast_regions_not_found, fallback=%s', REGIONS_TREE_BUILDER)
+        return BeautifulSoup(html, REGIONS_TREE_BUILDER)
+    return BeautifulSoup("".join(regions), REGIONS_TREE_BUILDER)
+
+
+def parse_forecast(html, zone=None, parser_backend=DEFAULT_PARSER_BACKEND, report=None):
+    """Parses a forecast page. Fields that can not be parsed are left empty and recorded in
+    report; when no report is given the failures are logged once per site here"""
+    owns_report = report is None
+    report = ErrorReport() if owns_report else report
+    html_root = build_html_root(html, parser_backend)
+    index = HtmlIndex(html_root)
+    forecast_root = index.find_id("avalanche-forecast")
 
     zone = zone.name if zone is not None else None
-    date = parse_forecast_date(forecast_root)
-    description = parse_forecast_description(forecast_root)
-    problems = parse_all_problems(forecast_root)
-    warnings = parse_all_warnings(html_root)
-    dangers = parse_all_dangers(forecast_root)
-
+    date = attempt(report, 'forecast.date', None, parse_forecast_date, forecast_root, index)
+    description = attempt(report, 'forecast.description', None,
+                          parse_forecast_description, forecast_root, index)
+    problems = attempt(report, 'problems', [],
+                       parse_all_problems, forecast_root, index, report)
+    warnings = attempt(report, 'warnings', [], parse_all_warnings, html_root, index, report)
+    dangers = attempt(report, 'dangers', [], parse_all_dangers, forecast_root, index, report)
+
+    if owns_report:
+        report.log(LOG, 'parse_forecast', zone=zone)
+    annotate(degraded_fields=report.degraded_fields)
     return Forecast(zone, date, description, problems, warnings, dangers)
 
 
+def available_parser_backends():
+    return [b for b in PARSER_BACKENDS if b != 'lxml' or lxml is not None]
+
+
+def compare_parser_backends(html, number=20):
+    """Times parse_forecast with every available backend and checks they agree with html.parser"""
+    expected = dict(parse_forecast(html, parser_backend='html.parser'))
+    results = []
+    for parser_backend in available_parser_backends():
+        seconds = timeit.timeit(lambda: parse_forecast(html, parser_backend=parser_backend),
+                                number=number)
+        identical = dict(parse_forecast(html, parser_backend=parser_backend)) == expected
+        results.append((parser_backend, seconds / number * 1000, identical))
+    return results
+
+
 if __name__ == "__main__":
-    print(parse_forecast(sys.stdin).to_json(), end='')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--parser-backend", choices=PARSER_BACKENDS,
+                        default=DEFAULT_PARSER_BACKEND)
+    parser.add_argument("-c", "--compare", action="store_true",
+                        help="print a timing comparison of the parser backends instead")
+    args = parser.parse_args()
+
+    if args.compare:
+        for parser_backend, millis, identical in compare_parser_backends(sys.stdin.read()):
+            print("{:<12} {:8.2f} ms  identical={}".format(parser_backend, millis, identical))
+    else:
+        print(parse_forecast(sys.stdin, parser_backend=args.parser_backend).to_json(), end='')
@@ -1,22 +1,133 @@
 #! /usr/bin/env python3
 
 import argparse
+import json
+import os
+import tempfile
+import time
 
-from utils import logger, requests_session
+from tracing import annotate
+from transport import request
+from utils import logger
 
 LOG = logger(__name__)
 
+CAIC_URL_TEMPLATE = os.environ.get(
+    'AVYSMS_CAIC_URL_TEMPLATE', "https://avalanche.state.co.us/caic/pub_bc_avo.php?zone_id={}")
+
+HTTP_CACHE_DIR = os.environ.get(
+    'AVYSMS_HTTP_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'avysms-http-cache'))
+
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get('AVYSMS_CONNECT_TIMEOUT_SECONDS', 3.05))
+
+READ_TIMEOUT_SECONDS = float(os.environ.get('AVYSMS_READ_TIMEOUT_SECONDS', 10))
+
+# How old a cached page may be and still be served while CAIC is down
+MAX_STALE_SECONDS = int(os.environ.get('AVYSMS_MAX_STALE_SECONDS', 24 * 60 * 60))
+
+
+class HttpCache(object):
+    """Keeps the last response body, its validators and when CAIC last confirmed it for each zone
+    in a local directory, one file per zone so a body is never paired with another's validators.
+    The body is kept even without validators, since it is also served when CAIC is down"""
+
+    def __init__(self, cache_dir=HTTP_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def path(self, zone_id):
+        return os.path.join(self.cache_dir, "{}.json".format(zone_id))
+
+    def load(self, zone_id, url):
+        """Returns (validators, html) for the cached response of url, or (None, None). validators
+        holds the etag, last_modified and fetched_at, the time CAIC last confirmed html"""
+        try:
+            with open(self.path(zone_id), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        if entry.get('url') != url:
+            return None, None
+        html = entry.pop('html')
+        return entry, html
+
+    def store(self, zone_id, url, response, now=None):
+        self.write(zone_id, {
+            'url': url,
+            'etag': response.headers.get('ETag', None),
+            'last_modified': response.headers.get('Last-Modified', None),
+            'fetched_at': time.time() if now is None else now,
+            'html': response.text
+        })
+
+    def confirm(self, zone_id, validators, html, now=None):
+        """Records that CAIC answered not modified, so html is current again"""
+        self.write(zone_id, dict(validators, html=html,
+                                 fetched_at=time.time() if now is None else now))
+
+    def write(self, zone_id, entry):
+        # Write then rename so concurrent readers never see a partial entry and the last writer's
+        # body and validators win together
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.path(zone_id))
+
+
+HTTP_CACHE = HttpCache()
+
+
+def conditional_headers(validators):
+    headers = {}
+    if validators is not None and validators.get('etag') is not None:
+        headers['If-None-Match'] = validators['etag']
+    if validators is not None and validators.get('last_modified') is not None:
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def download_html(zone_id, url_template=None, http_cache=HTTP_CACHE,
+                  timeout=(CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS),
+                  max_stale_seconds=MAX_STALE_SECONDS):
+    url = (url_template or CAIC_URL_TEMPLATE).format(zone_id)
+    validators, cached_html = http_cache.load(zone_id, url) if http_cache else (None, None)
+    LOG.info('event=downloading_forecast, url=%s, conditional=%s', url, validators is not None)
+
+    try:
+        response = request('caic', 'GET', url, headers=conditional_headers(validators),
+                           timeout=timeout)
+        if response.status_code >= 500:
+            response.raise_for_status()
+    except Exception as e:
+        # CAIC is down or the breaker is open: a stale forecast beats no forecast, up to a point
+        if cached_html is None:
+            raise
+        age_seconds = int(time.time() - validators.get('fetched_at', 0))
+        if age_seconds > max_stale_seconds:
+            LOG.warning('event=cached_forecast_too_old, url=%s, age_seconds=%s, error=%s',
+                        url, age_seconds, repr(e))
+            raise
+        LOG.warning('event=serving_cached_forecast, url=%s, age_seconds=%s, error=%s',
+                    url, age_seconds, repr(e))
+        annotate(cache_hit=True, stale=True, stale_age_seconds=age_seconds)
+        return cached_html
+
+    if response.status_code == 304 and cached_html is not None:
+        LOG.info('event=forecast_not_modified, url=%s', url)
+        annotate(cache_hit=True)
+        http_cache.confirm(zone_id, validators, cached_html)
+        return cached_html
 
-def download_html(zone_id):
-    url = "https://avalanche.state.co.us/caic/pub_bc_avo.php?zone_id={}".format(zone_id)
-    LOG.info('event=downloading_forecast, url=%s', url)
-    response = requests_session().get(url)
     response.raise_for_status()
+    annotate(cache_hit=False)
+    if http_cache:
+        http_cache.store(zone_id, url, response)
     return response.text
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-z", "--zone-id", type=int, default=9)
+    parser.add_argument("-n", "--no-cache", action="store_true")
     args = parser.parse_args()
-    print(download_html(args.zone_id))
+    print(download_html(args.zone_id, http_cache=None if args.no_cache else HTTP_CACHE))
@@ -1,3 +1,4 @@
+import datetime
 from enum import Enum
 
 from utils import Data
@@ -70,21 +71,156 @@ class Zone(Enum):
     SangreDeCristo = "SangreDeCristo"
 
 
+def enum_codes(enum_type):
+    """Maps member names to the member's position in the enum, which is its compact code"""
+    return {member.name: code for code, member in enumerate(enum_type)}
+
+
+def enum_names(enum_type):
+    return [member.name for member in enum_type]
+
+
+def encode_name(codes, name):
+    return None if name is None else codes[name]
+
+
+def decode_name(names, code):
+    return None if code is None else names[code]
+
+
+ELEVATION_CODES, ELEVATION_NAMES = enum_codes(ElevationType), enum_names(ElevationType)
+ASPECT_CODES, ASPECT_NAMES = enum_codes(AspectType), enum_names(AspectType)
+LIKELIHOOD_CODES, LIKELIHOOD_NAMES = enum_codes(LikelihoodType), enum_names(LikelihoodType)
+SIZE_CODES, SIZE_NAMES = enum_codes(SizeType), enum_names(SizeType)
+DANGER_CODES, DANGER_NAMES = enum_codes(DangerType), enum_names(DangerType)
+PROBLEM_TYPE_CODES, PROBLEM_TYPE_NAMES = enum_codes(ProblemType), enum_names(ProblemType)
+
+ROSE_BITS = len(ELEVATION_NAMES) * len(ASPECT_NAMES)
+
+
+def forecast_day(date):
+    """Parses CAIC's "Sun, Mar 17, 2019 at 7:39 AM" into the date the forecast is for"""
+    return datetime.datetime.strptime(date.split(" at ")[0].strip(), "%a, %b %d, %Y").date()
+
+
+def rose_bit(elevation_code, aspect_code):
+    return 1 << (elevation_code * len(ASPECT_NAMES) + aspect_code)
+
+
+def encode_rose(rose):
+    """Packs a {elevation: {aspect: bool}} rose into (mask, unknown_mask) of 24 bits each. Aspects
+    that could not be parsed are None in the rose and set in the unknown mask"""
+    if rose is None:
+        return None, None
+    mask, unknown_mask = 0, 0
+    for elevation, aspects in rose.items():
+        elevation_code = ELEVATION_CODES[elevation]
+        for aspect, problematic in (aspects or {}).items():
+            bit = rose_bit(elevation_code, ASPECT_CODES[aspect])
+            if problematic is None:
+                unknown_mask |= bit
+            elif problematic:
+                mask |= bit
+    return mask, unknown_mask
+
+
+def decode_rose(mask, unknown_mask):
+    if mask is None:
+        return None
+    return {elevation: {aspect: None if unknown_mask & rose_bit(e, a)
+                        else bool(mask & rose_bit(e, a))
+                        for a, aspect in enumerate(ASPECT_NAMES)}
+            for e, elevation in enumerate(ELEVATION_NAMES)}
+
+
 class Danger(Data):
+    __slots__ = ('elevation_code', 'danger_code')
+    FIELDS = ('elevation', 'danger_type')
+
     def __init__(self, elevation, danger_type):
         self.elevation = elevation
         self.danger_type = danger_type
 
+    @property
+    def elevation(self):
+        return decode_name(ELEVATION_NAMES, self.elevation_code)
+
+    @elevation.setter
+    def elevation(self, elevation):
+        self.elevation_code = encode_name(ELEVATION_CODES, elevation)
+
+    @property
+    def danger_type(self):
+        return decode_name(DANGER_NAMES, self.danger_code)
+
+    @danger_type.setter
+    def danger_type(self, danger_type):
+        self.danger_code = encode_name(DANGER_CODES, danger_type)
+
 
 class Problem(Data):
+    __slots__ = ('rose_mask', 'rose_unknown_mask', 'problem_type_code', 'size_code',
+                 'likelyhood_code')
+    FIELDS = ('rose', 'problem_type', 'size', 'likelyhood')
+
     def __init__(self, rose, problem_type, size, likelyhood):
         self.rose = rose
         self.problem_type = problem_type
         self.size = size
         self.likelyhood = likelyhood
 
+    @property
+    def rose(self):
+        return decode_rose(self.rose_mask, self.rose_unknown_mask)
+
+    @rose.setter
+    def rose(self, rose):
+        self.rose_mask, self.rose_unknown_mask = encode_rose(rose)
+
+    def is_problematic(self, elevation, aspect):
+        """Returns whether the elevation and aspect names are in the rose, or None if unknown"""
+        if self.rose_mask is None:
+            return None
+        bit = rose_bit(ELEVATION_CODES[elevation], ASPECT_CODES[aspect])
+        return None if self.rose_unknown_mask & bit else bool(self.rose_mask & bit)
+
+    def aspects(self, elevation, include_unknown=True):
+        """Returns the aspect names of the elevation that are problematic, in compass order"""
+        if self.rose_mask is None:
+            return []
+        elevation_mask = self.rose_mask | (self.rose_unknown_mask if include_unknown else 0)
+        elevation_mask >>= ELEVATION_CODES[elevation] * len(ASPECT_NAMES)
+        return [aspect for a, aspect in enumerate(ASPECT_NAMES) if elevation_mask & (1 << a)]
+
+    @property
+    def problem_type(self):
+        return decode_name(PROBLEM_TYPE_NAMES, self.problem_type_code)
+
+    @problem_type.setter
+    def problem_type(self, problem_type):
+        self.problem_type_code = encode_name(PROBLEM_TYPE_CODES, problem_type)
+
+    @property
+    def size(self):
+        return decode_name(SIZE_NAMES, self.size_code)
+
+    @size.setter
+    def size(self, size):
+        self.size_code = encode_name(SIZE_CODES, size)
+
+    @property
+    def likelyhood(self):
+        return decode_name(LIKELIHOOD_NAMES, self.likelyhood_code)
+
+    @likelyhood.setter
+    def likelyhood(self, likelyhood):
+        self.likelyhood_code = encode_name(LIKELIHOOD_CODES, likelyhood)
+
 
 class Warning(Data):
+    __slots__ = ('issued', 'expires', 'title', 'description')
+    FIELDS = __slots__
+
     def __init__(self, issued, expires, title, description):
         self.issued = issued
         self.expires = expires
@@ -93,6 +229,9 @@ class Warning(Data):
 
 
 class Forecast(Data):
+    __slots__ = ('zone', 'date', 'description', 'dangers', 'problems', 'warnings')
+    FIELDS = __slots__
+
     def __init__(self, zone=None, date=None, description=None, problems=[],
                  warnings=[], dangers=[]):
         self.zone = zone
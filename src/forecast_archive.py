@@ -0,0 +1,197 @@
+#! /usr/bin/env python3
+
+import argparse
+import bisect
+import gzip
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from utils import logger
+
+LOG = logger(__name__)
+
+# Either s3://bucket/prefix or a local directory
+ARCHIVE_STORE = os.environ.get('AVYSMS_ARCHIVE_STORE', 's3://avysms-forecast/archive')
+
+
+def blob_key(digest):
+    return "blobs/{}/{}.html.gz".format(digest[:2], digest)
+
+
+def index_key(zone_id):
+    return "index/{}.json".format(zone_id)
+
+
+def content_digest(html):
+    """Digest of the page's forecast content, so pages that only differ in ads and timestamps
+    share one"""
+    from forecast_cache import forecast_html_key  # Loads bs4, kept off the sms path
+    return forecast_html_key(html)[1]
+
+
+def compress(html):
+    # mtime=0 so the same page always compresses to the same bytes
+    return gzip.compress(html.encode('utf-8'), compresslevel=9, mtime=0)
+
+
+def decompress(body):
+    return gzip.decompress(body).decode('utf-8')
+
+
+class LocalArchiveBackend(object):
+    def __init__(self, root):
+        self.root = root
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.root, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.root, key))
+
+    def put(self, key, body, content_type):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent readers never see a partial object
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+
+class S3ArchiveBackend(object):
+    def __init__(self, bucket, prefix, client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client
+
+    def s3_client(self):
+        if self.client is None:
+            import boto3
+            self.client = boto3.client('s3')
+        return self.client
+
+    def get(self, key):
+        import botocore
+        try:
+            response = self.s3_client().get_object(Bucket=self.bucket,
+                                                   Key=os.path.join(self.prefix, key))
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return response['Body'].read()
+
+    def exists(self, key):
+        import botocore
+        try:
+            self.s3_client().head_object(Bucket=self.bucket, Key=os.path.join(self.prefix, key))
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def put(self, key, body, content_type):
+        self.s3_client().put_object(Bucket=self.bucket, Key=os.path.join(self.prefix, key),
+                                    Body=body, ContentType=content_type)
+
+
+def archive_backend(store):
+    if store.startswith('s3://'):
+        bucket, _, prefix = store[len('s3://'):].partition('/')
+        return S3ArchiveBackend(bucket, prefix)
+    return LocalArchiveBackend(store)
+
+
+class ForecastArchive(object):
+    """Stores each distinct forecast once, gzipped and named by its content_digest, with an index
+    per zone of [timestamp, digest] pairs recording when the zone's forecast changed. The raw page
+    that first had the content is what is stored. Unchanged forecasts cost one index read and no
+    writes.
+
+    Storing reads, modifies and writes the zone's index object, so only one cacher may store at a
+    time. A second concurrent run could drop the other's entry. Within a run each zone is stored
+    by one thread"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def index(self, zone_id):
+        """Returns the zone's [timestamp, digest] entries, oldest first"""
+        with self.lock:
+            entries = self.indexes.get(zone_id, None)
+        if entries is None:
+            body = self.backend.get(index_key(zone_id))
+            entries = json.loads(body.decode('utf-8'))['entries'] if body is not None else []
+            with self.lock:
+                self.indexes[zone_id] = entries
+        return entries
+
+    def store(self, zone_id, html, timestamp=None):
+        """Archives the page. Returns (digest, changed) where changed is False when the page's
+        forecast content is the same as the zone's latest archived page's"""
+        timestamp = int(time.time()) if timestamp is None else int(timestamp)
+        digest = content_digest(html)
+        entries = self.index(zone_id)
+        if len(entries) > 0 and entries[-1][1] == digest:
+            LOG.info('event=archive_unchanged, zone_id=%s, digest=%s', zone_id, digest)
+            return digest, False
+
+        known = any(entry_digest == digest for _, entry_digest in entries)
+        if not known and not self.backend.exists(blob_key(digest)):
+            body = compress(html)
+            self.backend.put(blob_key(digest), body, 'application/gzip')
+            LOG.info('event=archived_blob, digest=%s, html_bytes=%d, compressed_bytes=%d',
+                     digest, len(html), len(body))
+
+        entries = entries + [[timestamp, digest]]
+        body = json.dumps({'zone_id': zone_id, 'entries': entries}, separators=(',', ':'))
+        self.backend.put(index_key(zone_id), body.encode('utf-8'), 'application/json')
+        with self.lock:
+            self.indexes[zone_id] = entries
+        LOG.info('event=archived_forecast, zone_id=%s, digest=%s, versions=%d',
+                 zone_id, digest, len(entries))
+        return digest, True
+
+    def load(self, digest):
+        body = self.backend.get(blob_key(digest))
+        return decompress(body) if body is not None else None
+
+    def digest_at(self, zone_id, timestamp):
+        """Returns the digest of the page the zone had at timestamp, or None before the first"""
+        entries = self.index(zone_id)
+        position = bisect.bisect_right([entry[0] for entry in entries], timestamp)
+        return entries[position - 1][1] if position > 0 else None
+
+    def latest(self, zone_id):
+        entries = self.index(zone_id)
+        return self.load(entries[-1][1]) if len(entries) > 0 else None
+
+
+def open_archive(store=None):
+    return ForecastArchive(archive_backend(store or ARCHIVE_STORE))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--store", default=ARCHIVE_STORE)
+    parser.add_argument("-z", "--zone-id", type=int, default=9)
+    parser.add_argument("-l", "--latest", action="store_true", help="print the latest page")
+    args = parser.parse_args()
+
+    archive = open_archive(args.store)
+    if args.latest:
+        sys.stdout.write(archive.latest(args.zone_id) or "")
+    else:
+        for timestamp, digest in archive.index(args.zone_id):
+            print(timestamp, digest)
@@ -0,0 +1,95 @@
+#! /usr/bin/env python3
+
+import argparse
+import copy
+import hashlib
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+from caic_html_to_forecast import parse_forecast, extract_forecast_regions
+from tracing import annotate
+from utils import logger
+
+LOG = logger(__name__)
+
+MAX_CACHED_FORECASTS = 32
+
+# Scripts and comments inside the forecast regions carry ads and render timestamps
+IGNORED_HTML_REGEX = re.compile(r'<script\b.*?</script\s*>|<!--.*?-->', re.IGNORECASE | re.DOTALL)
+
+
+def forecast_html_key(html, zone=None):
+    regions = extract_forecast_regions(html)
+    relevant_html = "".join(regions) if regions is not None else html
+    relevant_html = IGNORED_HTML_REGEX.sub("", relevant_html)
+    digest = hashlib.sha1(relevant_html.encode('utf-8')).hexdigest()
+    return (zone.name if zone is not None else None, digest)
+
+
+class ForecastCache(object):
+    """Bounded LRU of parsed forecasts keyed by a hash of the forecast-relevant html"""
+
+    def __init__(self, max_entries=MAX_CACHED_FORECASTS):
+        self.max_entries = max_entries
+        self.forecasts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            forecast = self.forecasts.get(key, None)
+            if forecast is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.forecasts.move_to_end(key)
+            return copy.deepcopy(forecast)
+
+    def put(self, key, forecast):
+        with self.lock:
+            self.forecasts[key] = copy.deepcopy(forecast)
+            self.forecasts.move_to_end(key)
+            while len(self.forecasts) > self.max_entries:
+                self.forecasts.popitem(last=False)
+
+    def parse(self, html, zone=None):
+        html = html.read() if hasattr(html, 'read') else html
+        key = forecast_html_key(html, zone)
+        forecast = self.get(key)
+        if forecast is not None:
+            LOG.info('event=forecast_cache_hit, key=%s, hits=%d, misses=%d',
+                     key, self.hits, self.misses)
+            annotate(cache_hit=True)
+            return forecast
+
+        annotate(cache_hit=False)
+        forecast = parse_forecast(html, zone)
+        self.put(key, forecast)
+        return forecast
+
+    def clear(self):
+        with self.lock:
+            self.forecasts.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+FORECAST_CACHE = ForecastCache()
+
+
+def parse_forecast_cached(html, zone=None):
+    return FORECAST_CACHE.parse(html, zone)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prints the cache key digest of each page. Pages "
+                                                 "with the same digest parse to the same forecast")
+    parser.add_argument("pages", nargs='*', help="html files, stdin when none are given")
+    args = parser.parse_args()
+
+    for path in args.pages or ['-']:
+        with (sys.stdin if path == '-' else open(path, 'r')) as f:
+            print(forecast_html_key(f.read())[1], path)
@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+
+import argparse
+import sys
+
+from forecast import Forecast, ELEVATION_NAMES
+from utils import logger, Data
+
+LOG = logger(__name__)
+
+
+class ForecastDiff(Data):
+    """What changed from one forecast of a zone to the next. danger_changes are
+    {elevation, before, after}, problem_changes are {problem_type, field, before, after} for the
+    likelihood and size of problems in both forecasts, rose_changes are
+    {problem_type, elevation, gained, lost} and the added problems and new warnings are the plain
+    forecast entries"""
+
+    def __init__(self, zone, before_date, after_date, danger_changes=(), problems_added=(),
+                 problems_removed=(), rose_changes=(), new_warnings=(), problem_changes=()):
+        self.zone = zone
+        self.before_date = before_date
+        self.after_date = after_date
+        self.danger_changes = list(danger_changes)
+        self.problems_added = list(problems_added)
+        self.problems_removed = list(problems_removed)
+        self.problem_changes = list(problem_changes)
+        self.rose_changes = list(rose_changes)
+        self.new_warnings = list(new_warnings)
+
+    def is_empty(self):
+        return not (self.danger_changes or self.problems_added or self.problems_removed or
+                    self.problem_changes or self.rose_changes or self.new_warnings)
+
+
+def dangers_by_elevation(forecast):
+    return {danger.elevation: danger.danger_type for danger in forecast.dangers}
+
+
+def problems_by_type(forecast):
+    return {problem.problem_type: problem for problem in forecast.problems}
+
+
+def warning_key(warning):
+    return (warning.title, warning.issued)
+
+
+def diff_forecasts(before, after):
+    """Compares two forecasts of the same zone. Aspects whose state could not be parsed count as
+    problematic, the same way the full forecast reports them"""
+    before_dangers, after_dangers = dangers_by_elevation(before), dangers_by_elevation(after)
+    danger_changes = [{'elevation': elevation, 'before': before_dangers.get(elevation),
+                       'after': after_dangers.get(elevation)}
+                      for elevation in ELEVATION_NAMES
+                      if before_dangers.get(elevation) != after_dangers.get(elevation)]
+
+    before_problems, after_problems = problems_by_type(before), problems_by_type(after)
+    problems_added = [problem for problem in after.problems
+                      if problem.problem_type not in before_problems]
+    problems_removed = [problem_type for problem_type in before_problems
+                        if problem_type not in after_problems]
+
+    problem_changes, rose_changes = [], []
+    for problem in after.problems:
+        previous = before_problems.get(problem.problem_type)
+        if previous is None:
+            continue
+        for field, was, now in [('likelihood', previous.likelyhood, problem.likelyhood),
+                                ('size', previous.size, problem.size)]:
+            if was != now:
+                problem_changes.append({'problem_type': problem.problem_type, 'field': field,
+                                        'before': was, 'after': now})
+        for elevation in ELEVATION_NAMES:
+            was, now = previous.aspects(elevation), problem.aspects(elevation)
+            gained = [aspect for aspect in now if aspect not in was]
+            lost = [aspect for aspect in was if aspect not in now]
+            if gained or lost:
+                rose_changes.append({'problem_type': problem.problem_type,
+                                     'elevation': elevation, 'gained': gained, 'lost': lost})
+
+    before_warnings = set(map(warning_key, before.warnings))
+    new_warnings = [warning for warning in after.warnings
+                    if warning_key(warning) not in before_warnings]
+
+    return ForecastDiff(after.zone, before.date, after.date, danger_changes, problems_added,
+                        problems_removed, rose_changes, new_warnings, problem_changes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diffs two forecast json files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    with open(args.before, 'r') as before, open(args.after, 'r') as after:
+        diff = diff_forecasts(Forecast.from_json(before.read()), Forecast.from_json(after.read()))
+    from forecast_to_segments import diff_to_segments
+    sys.stdout.write("\n\n".join(diff_to_segments(diff)) + "\n")
@@ -0,0 +1,208 @@
+#! /usr/bin/env python3
+
+import argparse
+import json
+import os
+import sys
+
+from forecast import Zone, enum_names, rose_bit, forecast_day, ELEVATION_CODES, ELEVATION_NAMES, \
+    ASPECT_NAMES, DANGER_CODES, DANGER_NAMES, PROBLEM_TYPE_CODES, PROBLEM_TYPE_NAMES
+from utils import logger
+
+try:
+    import numpy as np
+except ImportError:  # Only the offline history tools need numpy, the Lambdas never load it
+    np = None
+
+LOG = logger(__name__)
+
+ZONE_NAMES = enum_names(Zone)
+
+ZONE_CODES = {name: code for code, name in enumerate(ZONE_NAMES)}
+
+# Values of the problems array
+ABSENT, PROBLEMATIC, UNKNOWN = 0, 1, 2
+
+# Value of the dangers array for a day or elevation without a rating
+MISSING = -1
+
+ARRAY_NAMES = ('observed', 'problems', 'dangers')
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("forecast_history needs numpy, pip install numpy")
+
+
+class ForecastHistory(object):
+    """Forecasts as arrays over zone x day. observed[zone, day] says whether there is a forecast,
+    problems[zone, day, problem type, elevation, aspect] holds ABSENT, PROBLEMATIC or UNKNOWN and
+    dangers[zone, day, elevation] the danger code or MISSING"""
+
+    def __init__(self, days, observed, problems, dangers):
+        require_numpy()
+        self.days = days
+        self.observed = observed
+        self.problems = problems
+        self.dangers = dangers
+
+    @classmethod
+    def from_forecasts(cls, forecasts):
+        """Builds the arrays from parsed forecasts. When a zone has several forecasts for a day
+        the last one wins"""
+        require_numpy()
+        forecasts = [f for f in forecasts if f.zone in ZONE_CODES and f.date is not None]
+        days = sorted(set(forecast_day(f.date) for f in forecasts))
+        day_codes = {day: code for code, day in enumerate(days)}
+        shape = (len(ZONE_NAMES), len(days))
+
+        observed = np.zeros(shape, dtype=bool)
+        problems = np.zeros(shape + (len(PROBLEM_TYPE_NAMES), len(ELEVATION_NAMES),
+                                     len(ASPECT_NAMES)), dtype=np.uint8)
+        dangers = np.full(shape + (len(ELEVATION_NAMES),), MISSING, dtype=np.int8)
+        for forecast in forecasts:
+            z, d = ZONE_CODES[forecast.zone], day_codes[forecast_day(forecast.date)]
+            observed[z, d] = True
+            problems[z, d] = ABSENT
+            dangers[z, d] = MISSING
+            for problem in forecast.problems:
+                if problem.problem_type_code is None or problem.rose_mask is None:
+                    continue
+                problems[z, d, problem.problem_type_code] = rose_array(problem)
+            for danger in forecast.dangers:
+                if danger.elevation_code is not None and danger.danger_code is not None:
+                    dangers[z, d, danger.elevation_code] = danger.danger_code
+
+        days = np.array(days, dtype='datetime64[D]')
+        return cls(days, observed, problems, dangers)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'days.npy'), self.days)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'axes.json'), 'w') as f:
+            json.dump({'zones': ZONE_NAMES, 'problem_types': PROBLEM_TYPE_NAMES,
+                       'elevations': ELEVATION_NAMES, 'aspects': ASPECT_NAMES,
+                       'dangers': DANGER_NAMES}, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Opens saved arrays. With mmap the arrays are memory mapped, so a query only reads the
+        pages it touches"""
+        require_numpy()
+        with open(os.path.join(directory, 'axes.json'), 'r') as f:
+            axes = json.load(f)
+        if axes['zones'] != ZONE_NAMES or axes['problem_types'] != PROBLEM_TYPE_NAMES:
+            raise ValueError("History in {} was saved with different axes".format(directory))
+        mmap_mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+                  for name in ('days',) + ARRAY_NAMES}
+        return cls(**arrays)
+
+    def day_range(self, start=None, end=None):
+        """Returns the slice of the day axis from start to end inclusive"""
+        first = 0 if start is None else np.searchsorted(self.days, np.datetime64(start, 'D'))
+        last = len(self.days) if end is None else \
+            np.searchsorted(self.days, np.datetime64(end, 'D'), side='right')
+        return slice(int(first), int(last))
+
+    def days_at_or_above(self, zone, elevation, danger, start=None, end=None):
+        """Counts the days the zone's rating at elevation was danger or higher"""
+        ratings = self.dangers[ZONE_CODES[zone], self.day_range(start, end),
+                               ELEVATION_CODES[elevation]]
+        return int(np.count_nonzero(ratings >= DANGER_CODES[danger]))
+
+    def problem_days(self, problem_type, start=None, end=None, include_unknown=False):
+        """Returns {zone: days with the problem on any elevation and aspect}"""
+        problems = self.problems[:, self.day_range(start, end), PROBLEM_TYPE_CODES[problem_type]]
+        present = present_mask(problems, include_unknown).any(axis=(2, 3))
+        return dict(zip(ZONE_NAMES, np.count_nonzero(present, axis=1).tolist()))
+
+    def persistent_aspects(self, zone, problem_type, start=None, end=None,
+                           include_unknown=False):
+        """Returns {elevation: [aspects]} that had the problem on every forecast day in the
+        range. Days without a forecast are ignored"""
+        days = self.day_range(start, end)
+        z = ZONE_CODES[zone]
+        observed = self.observed[z, days]
+        if not observed.any():
+            return {elevation: [] for elevation in ELEVATION_NAMES}
+        problems = self.problems[z, days, PROBLEM_TYPE_CODES[problem_type]][observed]
+        every_day = present_mask(problems, include_unknown).all(axis=0)
+        return {elevation: [aspect for a, aspect in enumerate(ASPECT_NAMES) if every_day[e, a]]
+                for e, elevation in enumerate(ELEVATION_NAMES)}
+
+    def danger_series(self, zone, elevation, start=None, end=None):
+        """Returns [(day, danger name)] for the days the zone has a forecast"""
+        days = self.day_range(start, end)
+        z = ZONE_CODES[zone]
+        ratings = self.dangers[z, days, ELEVATION_CODES[elevation]]
+        return [(day.item(), DANGER_NAMES[code] if code != MISSING else None)
+                for day, code, seen in zip(self.days[days], ratings, self.observed[z, days])
+                if seen]
+
+
+def rose_array(problem):
+    """Unpacks a problem's rose masks into an elevation x aspect array of problem values"""
+    bits = np.array([[rose_bit(e, a) for a in range(len(ASPECT_NAMES))]
+                     for e in range(len(ELEVATION_NAMES))], dtype=np.int64)
+    rose = np.where(bits & problem.rose_mask, PROBLEMATIC, ABSENT)
+    return np.where(bits & problem.rose_unknown_mask, UNKNOWN, rose)
+
+
+def present_mask(problems, include_unknown):
+    if include_unknown:
+        return problems != ABSENT
+    return problems == PROBLEMATIC
+
+
+def forecasts_from_snapshots(snapshots, archive_store=None):
+    """Parses reparse_archive snapshots one after another into forecasts"""
+    from caic_html_to_forecast import parse_forecast
+    from interpreter import CAIC_ZONES_IDS_TO_ZONES
+    from reparse_archive import init_worker, read_snapshot
+    init_worker(archive_store)
+    for _, zone_id, _, kind, source in snapshots:
+        yield parse_forecast(read_snapshot(kind, source), CAIC_ZONES_IDS_TO_ZONES.get(zone_id))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds and queries the forecast history arrays")
+    parser.add_argument("-d", "--directory", required=True, help="where the arrays are saved")
+    subparsers = parser.add_subparsers(dest="command")
+    build = subparsers.add_parser("build")
+    build.add_argument("-l", "--legacy", help="directory of CAIC/<zone>/<timestamp> snapshots")
+    build.add_argument("-a", "--archive", help="forecast archive store")
+    above = subparsers.add_parser("days-above")
+    above.add_argument("zone", choices=ZONE_NAMES)
+    above.add_argument("elevation", choices=ELEVATION_NAMES)
+    above.add_argument("danger", choices=DANGER_NAMES)
+    persistent = subparsers.add_parser("persistent-aspects")
+    persistent.add_argument("zone", choices=ZONE_NAMES)
+    persistent.add_argument("problem_type", choices=PROBLEM_TYPE_NAMES)
+    for subparser in (above, persistent):
+        subparser.add_argument("--start")
+        subparser.add_argument("--end")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from forecast_archive import open_archive
+        from reparse_archive import legacy_snapshots, archive_snapshots
+        snapshots = legacy_snapshots(args.legacy) if args.legacy else []
+        if args.archive:
+            snapshots += archive_snapshots(open_archive(args.archive), range(len(ZONE_NAMES)))
+        history = ForecastHistory.from_forecasts(forecasts_from_snapshots(snapshots, args.archive))
+        history.save(args.directory)
+        LOG.info('event=history_saved, days=%d, directory=%s', len(history.days), args.directory)
+    elif args.command == "days-above":
+        history = ForecastHistory.load(args.directory)
+        print(history.days_at_or_above(args.zone, args.elevation, args.danger,
+                                       args.start, args.end))
+    elif args.command == "persistent-aspects":
+        history = ForecastHistory.load(args.directory)
+        json.dump(history.persistent_aspects(args.zone, args.problem_type, args.start, args.end),
+                  sys.stdout)
+        print()
+    else:
+        parser.print_help()
@@ -1,13 +1,13 @@
 #! /usr/bin/env python3
 
 import argparse
+import json
 import sys
 
-import jsonpickle
-
 from forecast import Forecast, LikelihoodType, ProblemType, ElevationType, AspectType, \
     Zone, DangerType, SizeType
-from utils import is_not_None, safe, logger
+from tracing import annotate
+from utils import attempt, is_not_None, safe, logger, ErrorReport
 
 LOG = logger(__name__)
 
@@ -41,6 +41,17 @@ SIZE_TO_TEXT = {
     SizeType.Historic.name: "historic",
 }
 
+# Sizes in changes keep the whole range, since "small to large" -> "large" is a change
+SIZE_RANGE_TO_TEXT = {
+    SizeType.Small.name: "small",
+    SizeType.SmallToLarge.name: "small to large",
+    SizeType.Large.name: "large",
+    SizeType.LargeToVeryLarge.name: "large to very large",
+    SizeType.VeryLarge.name: "very large",
+    SizeType.VeryLargeToHistoric.name: "very large to historic",
+    SizeType.Historic.name: "historic",
+}
+
 PROBLEM_TYPE_TO_TEXT = {
     ProblemType.PersistentSlab.name: "persistent slab",
     ProblemType.DeepPersistentSlab.name: "deep persistent slab",
@@ -84,7 +95,6 @@ DANGER_TYPE_TO_TEXT = {
 }
 
 
-@safe(safe_return_value="Unknown", log=LOG)
 def convert_problem_rose_elevation_aspect_to_text(problem_rose_elevation):
     aspect_entries = list(problem_rose_elevation.items())
     aspect_entries.sort(key=lambda e: ASPECT_ORDER[e[0]])
@@ -97,29 +107,30 @@ def convert_problem_rose_elevation_aspect_to_text(problem_rose_elevation):
         return " ".join(aspect_entries)
 
 
-@safe(safe_return_value="Error", log=LOG)
 def convert_problem_rose_elevation_name_to_text(elevation):
     return ELEVATIONS_TO_TEXT[elevation]
 
 
-@safe(safe_return_value="Error retrieving forecast elevation data", log=LOG)
-def convert_problem_rose_elevation_to_text(elevation, problem_rose_elevation):
-    aspect_text = convert_problem_rose_elevation_aspect_to_text(problem_rose_elevation)
-    elevation_name = convert_problem_rose_elevation_name_to_text(elevation)
+def convert_problem_rose_elevation_to_text(elevation, problem_rose_elevation, report=None):
+    aspect_text = attempt(report, 'rose.aspects', "Unknown",
+                          convert_problem_rose_elevation_aspect_to_text, problem_rose_elevation)
+    elevation_name = attempt(report, 'rose.elevation_name', "Error",
+                             convert_problem_rose_elevation_name_to_text, elevation)
     return "  " + elevation_name + ": " + aspect_text
 
 
-@safe(safe_return_value="", log=LOG)
-def convert_problem_rose_to_text(problem_rose):
+def convert_problem_rose_to_text(problem_rose, report=None):
     elevation_entries = list(problem_rose.items())
     elevation_entries.sort(key=lambda e: ELEVATION_ORDER[e[0]])
-    elevation_entries = map(lambda e: convert_problem_rose_elevation_to_text(*e), elevation_entries)
+    elevation_entries = map(lambda e: attempt(report, 'rose.elevation',
+                                              "Error retrieving forecast elevation data",
+                                              convert_problem_rose_elevation_to_text, *e, report),
+                            elevation_entries)
     elevation_entries = filter(is_not_None, elevation_entries)
     return "\n".join(elevation_entries)
 
 
-@safe(safe_return_value="Error retrieving forecast problems", log=LOG)
-def convert_problem_to_text(problem):
+def convert_problem_to_text(problem, report=None):
     return "".join([
         " ".join(filter(is_not_None, [
             LIKELYHOOD_TO_TEXT.get(problem.likelyhood, None),
@@ -129,11 +140,10 @@ def convert_problem_to_text(problem):
         PROBLEM_TYPE_TO_TEXT.get(problem.problem_type, "unknown"),
         " avalanche problem",
         "\n",
-        convert_problem_rose_to_text(problem.rose)
+        attempt(report, 'rose', "", convert_problem_rose_to_text, problem.rose, report)
     ])
 
 
-@safe(safe_return_value="Avalanche warning in effect", log=LOG)
 def convert_warning_title_to_text(warning):
     warning_title = "Avalanche warning"
     if warning.title is not None:
@@ -144,12 +154,10 @@ def convert_warning_title_to_text(warning):
     return warning_title + " " + expires
 
 
-@safe(log=LOG)
 def convert_warning_to_text(warning):
     return convert_warning_title_to_text(warning)
 
 
-@safe(log=LOG)
 def convert_danger_to_text(danger):
     return "".join([
         "  ",
@@ -159,16 +167,14 @@ def convert_danger_to_text(danger):
     ])
 
 
-@safe(log=LOG)
-def convert_all_dangers_to_text(dangers):
+def convert_all_dangers_to_text(dangers, report=None):
     dangers.sort(key=lambda d: ELEVATION_ORDER[d.elevation])
     return "\n".join(filter(is_not_None, [
         "Avalanche dangers",
-        *map(convert_danger_to_text, dangers)
+        *[attempt(report, 'danger', None, convert_danger_to_text, d) for d in dangers]
     ]))
 
 
-@safe(safe_return_value="Avalanche Forecast", log=LOG)
 def convert_header_to_text(forecast):
     return " - ".join(filter(is_not_None, [
         ZONE_TO_TEXT.get(forecast.zone, None),
@@ -176,21 +182,102 @@ def convert_header_to_text(forecast):
 
 
 @safe(log=LOG)
-def forecast_to_segments(forecast):
+def forecast_to_segments(forecast, report=None):
+    """Formats each part of the forecast as a segment. Parts that fail are replaced with a
+    placeholder or left out and recorded in report; without a report they are logged here"""
+    owns_report = report is None
+    report = ErrorReport() if owns_report else report
     segments = [
-        convert_header_to_text(forecast),
-        convert_all_dangers_to_text(forecast.dangers),
-        *[convert_problem_to_text(p) for p in forecast.problems],
-        *[convert_warning_to_text(w) for w in forecast.warnings],
+        attempt(report, 'header', "Avalanche Forecast", convert_header_to_text, forecast),
+        attempt(report, 'dangers', None, convert_all_dangers_to_text, forecast.dangers, report),
+        *[attempt(report, 'problem', "Error retrieving forecast problems",
+                  convert_problem_to_text, p, report) for p in forecast.problems],
+        *[attempt(report, 'warning', "Avalanche warning in effect",
+                  convert_warning_to_text, w) for w in forecast.warnings],
     ]
 
+    if owns_report:
+        report.log(LOG, 'forecast_to_segments', zone=forecast.zone)
+    annotate(degraded_fields=report.degraded_fields)
     segments = filter(lambda s: s is not None, segments)
     return list(segments)
 
 
+def convert_danger_change_to_text(change):
+    return "".join([
+        "  ",
+        ELEVATIONS_TO_TEXT[change['elevation']],
+        ": ",
+        DANGER_TYPE_TO_TEXT.get(change['before'], "None"),
+        " -> ",
+        DANGER_TYPE_TO_TEXT.get(change['after'], "None")
+    ])
+
+
+def convert_problem_change_to_text(change):
+    to_text = LIKELYHOOD_TO_TEXT if change['field'] == 'likelihood' else SIZE_RANGE_TO_TEXT
+    return to_text.get(change['before'], "unknown") + " -> " + \
+        to_text.get(change['after'], "unknown")
+
+
+def convert_aspect_changes_to_text(sign, aspects):
+    if len(aspects) == len(ASPECT_ORDER):
+        return [" " + sign + "all"]
+    return [" " + sign + aspect for aspect in aspects]
+
+
+def convert_rose_change_to_text(change):
+    return "".join([
+        "  ",
+        ELEVATIONS_TO_TEXT[change['elevation']],
+        ":",
+        *convert_aspect_changes_to_text("+", change['gained']),
+        *convert_aspect_changes_to_text("-", change['lost'])
+    ])
+
+
+def convert_problem_changes_to_text(problem_type, problem_changes, rose_changes):
+    """One segment per continuing problem: its likelihood and size changes on the first line,
+    e.g. "Wind slab: possible -> likely", then the aspects it gained and lost"""
+    title = PROBLEM_TYPE_TO_TEXT.get(problem_type, "unknown").capitalize()
+    if len(problem_changes) > 0:
+        title += ": " + ", ".join(map(convert_problem_change_to_text, problem_changes))
+    else:
+        title += " aspects"
+    return "\n".join([title, *map(convert_rose_change_to_text, rose_changes)])
+
+
+@safe(log=LOG)
+def diff_to_segments(diff):
+    """Formats a ForecastDiff as segments: a header, then one segment per kind of change"""
+    since = "since " + str(diff.before_date).split(" at ")[0]
+    header = convert_header_to_text(Forecast(diff.zone, diff.after_date))
+    if diff.is_empty():
+        return [header + "\nNo changes " + since]
+
+    segments = [header + "\nChanges " + since]
+    if len(diff.danger_changes) > 0:
+        segments.append("\n".join(["Danger changes",
+                                   *map(convert_danger_change_to_text, diff.danger_changes)]))
+    segments.extend("New: " + convert_problem_to_text(p) for p in diff.problems_added)
+    if len(diff.problems_removed) > 0:
+        segments.append("Ended: " + ", ".join(PROBLEM_TYPE_TO_TEXT.get(problem_type, "unknown")
+                                              for problem_type in diff.problems_removed))
+    problem_types = []
+    for change in diff.problem_changes + diff.rose_changes:
+        if change['problem_type'] not in problem_types:
+            problem_types.append(change['problem_type'])
+    for problem_type in problem_types:
+        segments.append(convert_problem_changes_to_text(
+            problem_type, [c for c in diff.problem_changes if c['problem_type'] == problem_type],
+            [c for c in diff.rose_changes if c['problem_type'] == problem_type]))
+    segments.extend(map(convert_warning_to_text, diff.new_warnings))
+    return segments
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     args = parser.parse_args()
 
     forecast = Forecast.from_json(sys.stdin)
-    print(jsonpickle.encode(forecast_to_segments(forecast)), end='')
+    print(json.dumps(forecast_to_segments(forecast)), end='')
@@ -1,34 +1,31 @@
 #! /usr/bin/env python3
 
 import argparse
+import json
 import sys
 from functools import reduce
 
-import jsonpickle
-
-from utils import safe, logger
+from sms_encoding import to_sms_text, fits_in_part, fits_in_one_sms, part_capacity, count_sms, \
+    message_size, truncate
+from utils import safe, logger, is_not_None
 
 MAX_SEGMENTS = 10
 
-MAX_SGEMENT_CHARS = 153
-
-# List of valid characters to send via sms # https://en.wikipedia.org/wiki/GSM_03.38
-GSM_CHARSET = ("@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
-               "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ`¿abcdefghijklmnopqrstuvwxyzäöñüà")
-
 LOG = logger(__name__)
 
 
 @safe(log=LOG)
-def filter_non_gsm_chars(text):
-    return "".join(filter(lambda c: c in GSM_CHARSET, text))
+def to_sms_charset(text):
+    """Transliterates text to the GSM-7 alphabet, or keeps it for UCS-2 when that would drop
+    characters"""
+    return to_sms_text(text)
 
 
-def segment_reducer(new_segments, current_segment):
+def segment_reducer(new_segments, current_segment, fits=fits_in_part):
     join_str = "\n\n"
     if len(new_segments) == 0:
         new_segments.append(current_segment)
-    elif len(current_segment) + len(new_segments[-1]) + len(join_str) < MAX_SGEMENT_CHARS:
+    elif fits(join_str.join([new_segments[-1], current_segment])):
         new_segments[-1] = join_str.join([new_segments[-1], current_segment])
     else:
         new_segments.append(current_segment)
@@ -36,39 +33,103 @@ def segment_reducer(new_segments, current_segment):
 
 
 @safe(log=LOG)
-def reduce_segments(segments):
-    join_str = "\n\n"
-    segments = map(filter_non_gsm_chars, segments)
-    segments = reduce(segment_reducer, segments, [])
+def reduce_segments(segments, fits=fits_in_part):
+    """Greedy packing, kept to compare pack_segments against"""
+    segments = map(to_sms_charset, segments)
+    segments = reduce(lambda new, current: segment_reducer(new, current, fits), segments, [])
     segments = list(segments)
 
     return segments
 
 
+def split_oversized_block(block, fits):
+    """Splits a block that does not fit in a message into (separator, piece) pairs. Lines that fit
+    stay whole, longer lines are split into words and words that are still too long are cut"""
+    pieces = []
+    for line_number, line in enumerate(block.split("\n")):
+        separator = "\n" if line_number > 0 else "\n\n"
+        if fits(line):
+            pieces.append((separator, line))
+            continue
+        for word in line.split(" "):
+            while not fits(word):
+                cut = max(i for i in range(1, len(word) + 1) if fits(word[:i]))
+                pieces.append((separator, word[:cut]))
+                separator, word = "", word[cut:]
+            pieces.append((separator, word))
+            separator = " "
+    return pieces
+
+
+def pack_segments(blocks, fits=fits_in_part):
+    """Packs blocks, in order, into the fewest messages that fit. Blocks that fit in one message
+    are never split. Ties are broken by fewest messages that start mid block and then by the most
+    even fill, so the last message is not left nearly empty"""
+    pieces = []
+    for block in blocks:
+        pieces.extend(split_oversized_block(block, fits) if not fits(block) else [("\n\n", block)])
+
+    # best[i] is (messages, mid block breaks, squared slack, start of last message) for pieces[:i]
+    best = [(0, 0, 0, 0)] + [None] * len(pieces)
+    for end in range(1, len(pieces) + 1):
+        text = ""
+        for start in range(end - 1, -1, -1):
+            text = pieces[start][1] + (pieces[start + 1][0] + text if start + 1 < end else "")
+            if not fits(text):
+                break
+            if best[start] is None:
+                continue
+            _, size, _, capacity = message_size(text)
+            mid_block = 1 if start > 0 and pieces[start][0] != "\n\n" else 0
+            cost = (best[start][0] + 1, best[start][1] + mid_block,
+                    best[start][2] + (capacity - size) ** 2, start)
+            if best[end] is None or cost[:3] < best[end][:3]:
+                best[end] = cost
+
+    messages = []
+    end = len(pieces)
+    while end > 0:
+        start = best[end][3]
+        message = pieces[start][1]
+        for separator, piece in pieces[start + 1:end]:
+            message += separator + piece
+        messages.append(message)
+        end = start
+    return messages[::-1]
+
+
 def join_segments(segments):
+    """Joins the segments into one message of at most MAX_SEGMENTS parts. An escaped character is
+    never split between parts, so a part may hold one unit less and the size is cut further until
+    the message fits"""
     text = "\n\n".join(segments)
-    max_chars = MAX_SEGMENTS * MAX_SGEMENT_CHARS
-    if len(text) > max_chars:
-        pad = "..."
-        text = text[0:max_chars - len(pad)] + pad
-    return [text]
+    size = MAX_SEGMENTS * part_capacity(text)
+    joined = truncate(text, size)
+    while count_sms(joined) > MAX_SEGMENTS:
+        size -= 1
+        joined = truncate(text, size)
+    return [joined]
 
 
-def log_warning_for_large_segment(segments, segment_warn_length):
+def log_warning_for_large_segment(segments, max_parts):
     for s in segments:
-        if len(s) > segment_warn_length:
-            LOG.warning("event=segment_too_large, segmentSize=%d", len(s))
+        if count_sms(s) > max_parts:
+            encoding, size, _, _ = message_size(s)
+            LOG.warning("event=segment_too_large, segmentSize=%d, encoding=%s", size, encoding)
 
 
 def format_segments(segments, joined):
-    segment_warn_length = MAX_SGEMENT_CHARS
-    segments = reduce_segments(segments)
+    # Unjoined segments are sent as separate messages, so each may fill a whole single sms
+    max_parts = 1
+    segments = list(filter(is_not_None, map(to_sms_charset, segments)))
 
     if joined:
-        segment_warn_length = MAX_SEGMENTS * MAX_SGEMENT_CHARS
+        max_parts = MAX_SEGMENTS
         segments = join_segments(segments)
+    else:
+        segments = pack_segments(segments, fits_in_one_sms)
 
-    log_warning_for_large_segment(segments, segment_warn_length)
+    log_warning_for_large_segment(segments, max_parts)
 
     return segments
 
@@ -79,7 +140,7 @@ if __name__ == "__main__":
     parser.add_argument("-j", "--joined", action="store_true")
     args = parser.parse_args()
 
-    segments = jsonpickle.decode(sys.stdin.read())
+    segments = json.loads(sys.stdin.read())
     segments = format_segments(segments, args.joined)
     segments = segments if args.raw else "\n\n".join(segments)
 
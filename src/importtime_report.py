@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+
+from utils import logger
+
+LOG = logger(__name__)
+
+SRC_DIR = os.path.dirname(os.path.realpath(__file__))
+
+SANGRE_FIXTURE = os.path.join(SRC_DIR, "..", "test", "fixtures", "sangre.html")
+
+ROUTE_BUCKET = 'avysms-importtime'
+
+ROUTES = {
+    'import': "import aws_lambda",
+    'sms_help': ("import aws_lambda; "
+                 "aws_lambda.entrypoint({'queryStringParameters': {'Body': 'help'}}, None)"),
+    # Answered from the rendered store, read from the S3 stub with the credentials Lambda has in
+    # its environment, like most forecast requests are
+    'sms_forecast': ("import os, aws_lambda, interpreter, rendered_store, s3_reader; "
+                     "store = 's3://" + ROUTE_BUCKET + "/rendered'; "
+                     "rendered_store.BACKENDS[('read', store)] = s3_reader.SignedS3Reader("
+                     "'" + ROUTE_BUCKET + "', 'rendered', s3_reader.environment_credentials(), "
+                     "'us-west-2', os.environ['IMPORTTIME_S3_ENDPOINT_URL']); "
+                     "response = aws_lambda.entrypoint("
+                     "{'queryStringParameters': {'Body': 'sangre'}}, None, "
+                     "interpreter.ForecastSources(rendered_store=store)); "
+                     "assert 'Sangre' in response['body'], response"),
+}
+
+DEFAULT_FORBIDDEN_MODULES = ['boto3', 'botocore', 'bs4']
+
+
+@contextmanager
+def route_environment():
+    """Serves a rendered sangre forecast from an S3 stub and yields the environment the routes run
+    in, with throwaway credentials since the stub ignores them"""
+    from interpreter import render_zone
+    from local_stubs import S3StubServer
+    with open(SANGRE_FIXTURE, 'r') as f:
+        rendered = render_zone(9, f.read())
+    body = json.dumps(dict(rendered)).encode('utf-8')
+    with S3StubServer({(ROUTE_BUCKET, 'rendered/9.json'): body}) as s3:
+        yield dict(os.environ, AWS_ACCESS_KEY_ID='importtime', AWS_SECRET_ACCESS_KEY='importtime',
+                   AWS_SESSION_TOKEN='', AWS_REGION='us-west-2',
+                   IMPORTTIME_S3_ENDPOINT_URL=s3.endpoint_url)
+
+
+def measure_imports(statement, env=None):
+    """Runs statement in a fresh interpreter under python -X importtime. Returns a dict of module
+    name to (self_us, cumulative_us, depth) for every module it imported"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            cwd=SRC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True, env=env)
+    imports = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return imports
+
+
+def top_level_total_us(imports):
+    # The top level modules' cumulative times already include everything they imported
+    return sum(cumulative for _, cumulative, depth in imports.values() if depth == 0)
+
+
+def report(route, imports, forbidden_modules, top=10):
+    lines = ["route={} modules={} total_ms={:.1f}".format(
+        route, len(imports), top_level_total_us(imports) / 1000)]
+    slowest = sorted(imports.items(), key=lambda i: i[1][1], reverse=True)[:top]
+    for name, (self_us, cumulative_us, _) in slowest:
+        lines.append("  {:<40} self_ms={:7.1f} cumulative_ms={:7.1f}".format(
+            name, self_us / 1000, cumulative_us / 1000))
+    forbidden = [m for m in forbidden_modules if m in imports]
+    if forbidden:
+        lines.append("  forbidden modules imported: " + ", ".join(forbidden))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--route", choices=sorted(ROUTES), action="append")
+    parser.add_argument("-b", "--budget-ms", type=float, default=None,
+                        help="fail when a route's imports take longer than this")
+    parser.add_argument("-f", "--forbid", nargs="*", default=DEFAULT_FORBIDDEN_MODULES,
+                        help="fail when a route imports any of these modules")
+    parser.add_argument("-n", "--top", type=int, default=10)
+    args = parser.parse_args()
+
+    failed = False
+    with route_environment() as env:
+        for route in args.route or sorted(ROUTES):
+            imports = measure_imports(ROUTES[route], env)
+            print(report(route, imports, args.forbid, args.top))
+            over_budget = args.budget_ms is not None and \
+                top_level_total_us(imports) / 1000 > args.budget_ms
+            failed = failed or over_budget or any(m in imports for m in args.forbid)
+    sys.exit(1 if failed else 0)
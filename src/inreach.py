@@ -1,11 +1,18 @@
 #! /usr/bin/env python3
 
+import hashlib
+import os
+import random
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from bs4 import BeautifulSoup
 from urllib.parse import unquote
 
-from utils import safe, logger, Data, requests_session
+from transport import request, CircuitOpenError
+from utils import safe, logger, Data
 
 
 class InReachResponse(Data):
@@ -26,6 +33,79 @@ REPLY_ADDRESS_REGEX = re.compile(r"adr=([^&]+)")
 
 BASE_URL_REGEX = re.compile(r"^https?://[^?]+")
 
+# Segments are posted one at a time so they arrive in order. More in flight lets a retrying
+# segment be overtaken by the ones after it
+INREACH_MAX_IN_FLIGHT = int(os.environ.get('AVYSMS_INREACH_MAX_IN_FLIGHT', 1))
+
+INREACH_MAX_ATTEMPTS = int(os.environ.get('AVYSMS_INREACH_MAX_ATTEMPTS', 4))
+
+INREACH_BACKOFF_BASE_SECONDS = float(os.environ.get('AVYSMS_INREACH_BACKOFF_BASE_SECONDS', 0.5))
+
+INREACH_BACKOFF_MAX_SECONDS = float(os.environ.get('AVYSMS_INREACH_BACKOFF_MAX_SECONDS', 8))
+
+INREACH_TIMEOUT_SECONDS = (3.05, float(os.environ.get('AVYSMS_INREACH_READ_TIMEOUT_SECONDS', 15)))
+
+# Statuses that say the reply was refused before it was processed. Other server errors may come
+# after the message went out, and every reply is a paid message, so those are not retried
+INREACH_RETRY_STATUSES = (429, 503)
+
+
+class SegmentDelivery(Data):
+    def __init__(self, index, delivered, attempts, latency_ms, status=None, skipped=False):
+        self.index = index
+        self.delivered = delivered
+        self.attempts = attempts
+        self.latency_ms = latency_ms
+        self.status = status
+        self.skipped = skipped
+
+
+class DeliveryLog(object):
+    """Remembers which segments of a reply were already accepted, keyed by the Guid of the
+    conversation, the segment index and the segment text, so a retried handler does not send
+    the same segment twice. With a backend, one of the forecast_archive backends, every delivery
+    is also stored as an empty object so the log outlives the process"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.delivered = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(guid, index, response_segment):
+        digest = hashlib.sha1(response_segment.encode('utf-8')).hexdigest()
+        return "{}/{}-{}".format(guid, index, digest)
+
+    def was_delivered(self, guid, index, response_segment):
+        key = self.key(guid, index, response_segment)
+        with self.lock:
+            if key in self.delivered:
+                return True
+        if self.backend is None:
+            return False
+        try:
+            return self.backend.exists(key)
+        except Exception as e:
+            LOG.error('event=delivery_log_read_failed, key=%s, error=%s', key, repr(e))
+            return False
+
+    def record(self, guid, index, response_segment):
+        key = self.key(guid, index, response_segment)
+        with self.lock:
+            self.delivered.add(key)
+        if self.backend is not None:
+            try:
+                self.backend.put(key, b"", 'text/plain')
+            except Exception as e:
+                LOG.error('event=delivery_log_write_failed, key=%s, error=%s', key, repr(e))
+
+    def clear(self):
+        with self.lock:
+            self.delivered.clear()
+
+
+DELIVERY_LOG = DeliveryLog()
+
 
 def extract_guuid_from_reply_url(reply_url):
     groups = GUID_GROUP_REGEX.search(reply_url)
@@ -66,8 +146,23 @@ def is_inreach_response_successful(response):
     return response.json()['Success'] is True
 
 
-@safe(log=LOG)
-def send_inreach_response_segment(base_url, reply_address, guid, response_segment):
+def never_sent(error):
+    """Whether a failed post certainly did not reach the server: the breaker was open or the
+    connection was never made. A read timeout or a dropped connection may come after the server
+    took the message"""
+    import requests
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+    if isinstance(error, (CircuitOpenError, requests.exceptions.ConnectTimeout)):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if len(error.args) > 0 else None
+    return isinstance(error, requests.exceptions.ConnectionError) and \
+        isinstance(reason, (ConnectTimeoutError, NewConnectionError))
+
+
+def send_inreach_response_segment(base_url, reply_address, guid, response_segment,
+                                  timeout=INREACH_TIMEOUT_SECONDS):
+    """Posts one segment. Returns (success, status, retryable). Only failures that certainly
+    did not send the segment are retryable, so a retry never sends a paid message twice"""
     payload = {
         "ReplyAddress": reply_address,
         "ReplyMessage": response_segment,
@@ -75,27 +170,77 @@ def send_inreach_response_segment(base_url, reply_address, guid, response_segmen
     }
     LOG.info('event=sending_inreach_response_segment, base_url=%s, payload=%s', base_url, payload)
 
-    response = requests_session().post(base_url, data=payload)
+    try:
+        response = request('inreach', 'POST', base_url, data=payload, timeout=timeout)
+    except Exception as e:
+        LOG.warning('event=send_inreach_response_segment_error, error=%s', repr(e))
+        return False, None, never_sent(e)
 
     if is_inreach_response_successful(response):
         LOG.info('event=sent_inreach_response_segment')
-    else:
-        response_str = " ".join([str(response.status_code), response.reason, response.text])
-        LOG.error('event=send_inreach_response_segment_failed, response=%s', response_str)
-
-
-def send_inreach_response(inreach_response):
+        return True, response.status_code, False
+
+    response_str = " ".join([str(response.status_code), response.reason, response.text])
+    LOG.error('event=send_inreach_response_segment_failed, response=%s', response_str)
+    # A reply without Success was answered and not sent, so it is safe to send again
+    retryable = response.status_code < 400 or response.status_code in INREACH_RETRY_STATUSES
+    return False, response.status_code, retryable
+
+
+def backoff_seconds(attempt, base=INREACH_BACKOFF_BASE_SECONDS, cap=INREACH_BACKOFF_MAX_SECONDS):
+    """Full jitter: a uniform delay up to the capped exponential backoff for the attempt"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def deliver_segment(base_url, inreach_response, index, max_attempts=INREACH_MAX_ATTEMPTS,
+                    delivery_log=DELIVERY_LOG, backoff=backoff_seconds, sleep=time.sleep,
+                    timeout=INREACH_TIMEOUT_SECONDS):
+    response_segment = inreach_response.response_segments[index]
+    guid = inreach_response.guid
+    if delivery_log.was_delivered(guid, index, response_segment):
+        LOG.info('event=inreach_segment_already_delivered, guid=%s, index=%s', guid, index)
+        return SegmentDelivery(index, True, 0, 0.0, skipped=True)
+
+    start = time.perf_counter()
+    attempt, status = 0, None
+    while attempt < max_attempts:
+        attempt += 1
+        success, status, retryable = send_inreach_response_segment(
+            base_url, inreach_response.reply_address, guid, response_segment, timeout)
+        if success:
+            delivery_log.record(guid, index, response_segment)
+            break
+        if not retryable or attempt == max_attempts:
+            break
+        sleep(backoff(attempt))
+
+    latency_ms = (time.perf_counter() - start) * 1000
+    return SegmentDelivery(index, success, attempt, latency_ms, status)
+
+
+def send_inreach_response(inreach_response, max_in_flight=INREACH_MAX_IN_FLIGHT, **kwargs):
+    """Sends every segment with at most max_in_flight posts outstanding. Segments are started in
+    order and a retrying segment keeps its slot, so with the default of one they arrive in order
+    and otherwise at most max_in_flight - 1 later segments can overtake it. Returns a
+    SegmentDelivery per segment"""
     base_url = extract_base_url_from_reply_url(inreach_response.reply_url)
-
-    for response_segment in inreach_response.response_segments:
-        send_inreach_response_segment(**{
-            "base_url": base_url,
-            "reply_address": inreach_response.reply_address,
-            "guid": inreach_response.guid,
-            "response_segment": response_segment
-        })
-
-    LOG.info('event=sent_inreach_response')
+    indices = range(len(inreach_response.response_segments))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        deliveries = list(executor.map(
+            lambda index: deliver_segment(base_url, inreach_response, index, **kwargs), indices))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    failed = [delivery.index for delivery in deliveries if not delivery.delivered]
+    LOG.info('event=sent_inreach_response, segments=%s, failed=%s, attempts=%s, '
+             'max_segment_ms=%.1f, total_ms=%.1f',
+             len(deliveries), failed, sum(delivery.attempts for delivery in deliveries),
+             max([delivery.latency_ms for delivery in deliveries], default=0.0), elapsed_ms)
+    if len(failed) > 0:
+        LOG.error('event=inreach_response_incomplete, guid=%s, failed=%s',
+                  inreach_response.guid, failed)
+    return deliveries
 
 
 @safe(safe_return_value=False, log=LOG)
@@ -1,14 +1,22 @@
 #! /usr/bin/env python3
 
 import argparse
+import re
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from forecast import Zone
+from forecast_diff import diff_forecasts
 from utils import safe, logger
-from download_caic_html import download_html
-from caic_html_to_forecast import parse_forecast
-from forecast_to_segments import forecast_to_segments
-from format_segments import format_segments
+from download_caic_html import download_html, HTTP_CACHE
+from forecast_to_segments import forecast_to_segments, diff_to_segments
+from format_segments import format_segments, MAX_SEGMENTS
+from rendered_store import read_rendered, RenderedForecast
+from serialization import to_compact, from_compact_json
+from sms_encoding import count_sms
+from tracing import trace, span, annotate, bind
+from zone_matcher import ZoneMatcher
 
 LOG = logger(__name__)
 
@@ -27,8 +35,10 @@ CAIC_ZONE_NAMES = [
 
 CAIC_ZONE_MATCHES_TO_IDS = [
     ("steam", 0),
+    ("steamboat", 0),
     ("flat", 0),
     ("front", 1),
+    ("front range", 1),
     ("vail", 2),
     ("summit", 2),
     ("sawatch", 3),
@@ -59,28 +69,188 @@ CAIC_ZONES_IDS_TO_ZONES = {
     9: Zone.SangreDeCristo
 }
 
+ZONE_MATCHER = ZoneMatcher(CAIC_ZONE_MATCHES_TO_IDS)
+
+# More zones than this in one request would not fit the segment budget
+MAX_ZONES_PER_REQUEST = 3
+
+CHANGES_KEYWORD_REGEX = re.compile(r"\bchange[sd]?\b", re.IGNORECASE)
+
 HELP_TEXT = "\n".join([
     "This is an automated service for avalanche forecasts.",
-    "Reply with one of the available regions to receive the latest forecast.",
+    "Reply with one or more of the available regions to receive the latest forecast.",
+    "Add \"changes\" to only receive what changed since the previous forecast.",
     "",
     *CAIC_ZONE_NAMES,
 ])
 
 
+class ForecastSources(object):
+    """Where zones are answered from: the CAIC url template and http cache used for downloads, and
+    the rendered store. None url_template and rendered_store use the configured defaults"""
+
+    def __init__(self, url_template=None, http_cache=HTTP_CACHE, rendered_store=None):
+        self.url_template = url_template
+        self.http_cache = http_cache
+        self.rendered_store = rendered_store
+
+
+DEFAULT_SOURCES = ForecastSources()
+
+
+def render_zone(zone_id, html):
+    """Runs the parse and format pipeline on a downloaded page, for both joined and unjoined
+    responses"""
+    # Loads bs4, only needed off the fast path
+    from forecast_cache import parse_forecast_cached, forecast_html_key
+    zone = CAIC_ZONES_IDS_TO_ZONES.get(zone_id, None)
+    with span('parse_forecast', zone_id, html_bytes=len(html.encode('utf-8'))):
+        forecast = parse_forecast_cached(html, zone)
+    with span('forecast_to_segments', zone_id):
+        segments = forecast_to_segments(forecast)
+        annotate(segments=len(segments))
+    with span('format_segments', zone_id):
+        joined_segments = format_segments(segments, joined=True)
+        unjoined_segments = format_segments(segments, joined=False)
+        annotate(segments=len(unjoined_segments))
+    return RenderedForecast(
+        zone_id=zone_id,
+        rendered_at=time.time(),
+        forecast_date=forecast.date,
+        joined=joined_segments,
+        unjoined=unjoined_segments,
+        forecast=to_compact(forecast),
+        html_key=forecast_html_key(html, zone)[1])
+
+
+def changes_segments(rendered, joined):
+    with span('diff_forecasts', rendered.zone_id):
+        diff = diff_forecasts(from_compact_json(rendered.previous_forecast),
+                              from_compact_json(rendered.forecast))
+        segments = format_segments(diff_to_segments(diff), joined)
+        annotate(segments=len(segments))
+    return segments
+
+
+def interpret_zone(zone_id, joined, changes=False, sources=DEFAULT_SOURCES):
+    """Answers from the rendered store when it is fresh, otherwise downloads and renders the zone.
+    With changes only the difference to the previous forecast is returned, when it is known"""
+    with span('read_rendered', zone_id):
+        rendered = read_rendered(zone_id, sources.rendered_store)
+        annotate(cache_hit=rendered is not None and not rendered.is_stale())
+    if rendered is not None and not rendered.is_stale():
+        if changes and rendered.forecast is not None and rendered.previous_forecast is not None:
+            return changes_segments(rendered, joined)
+        return rendered.segments(joined)
+
+    LOG.info("event=rendered_forecast_unavailable, zone_id=%s, stale=%s",
+             zone_id, rendered is not None)
+    with span('download_html', zone_id):
+        html = download_html(zone_id, sources.url_template, sources.http_cache)
+        annotate(html_bytes=len(html.encode('utf-8')))
+    return render_zone(zone_id, html).segments(joined)
+
+
+def zone_unavailable_segments(zone_id):
+    return ["Unable to retrieve the {} forecast".format(CAIC_ZONE_NAMES[zone_id])]
+
+
+def zone_truncated_segment(zone_id):
+    return "{} forecast shortened, request it alone for the rest".format(
+        CAIC_ZONE_NAMES[zone_id])
+
+
+def zone_left_out_segment(zone_id):
+    return "{} forecast left out, request it alone".format(CAIC_ZONE_NAMES[zone_id])
+
+
+def fits_segment_budget(segments, joined):
+    if joined:
+        return count_sms("\n\n".join(segments)) <= MAX_SEGMENTS
+    return len(format_segments(segments, joined)) <= MAX_SEGMENTS
+
+
+def share_segment_budget(zone_ids, zone_segments, joined):
+    """Drops segments from the end of the longest zone until every zone fits in one response. A
+    shortened zone keeps its first segment and says it was shortened. When the first segments
+    alone do not fit, the last zones are left out, each with a notice, down to the first zone"""
+    kept = [list(segments) for segments in zone_segments]
+    truncated = set()
+    left_out = set()
+
+    def notices(i):
+        if i in left_out:
+            return [zone_left_out_segment(zone_ids[i])]
+        return [zone_truncated_segment(zone_ids[i])] if i in truncated else []
+
+    def flatten():
+        return [segment for i, segments in enumerate(kept) for segment in segments + notices(i)]
+    while not fits_segment_budget(flatten(), joined):
+        longest = max(range(len(kept)), key=lambda i: (len(kept[i]), i))
+        if len(kept[longest]) > 1:
+            kept[longest].pop()
+            truncated.add(longest)
+            continue
+        answered = [i for i in range(len(kept)) if len(kept[i]) > 0]
+        if len(answered) <= 1:
+            break
+        kept[answered[-1]] = []
+        left_out.add(answered[-1])
+    if truncated or left_out:
+        LOG.info("event=zones_truncated, zone_ids=%s, left_out_zone_ids=%s",
+                 [zone_ids[i] for i in sorted(truncated - left_out)],
+                 [zone_ids[i] for i in sorted(left_out)])
+    return flatten()
+
+
+@safe(log=LOG)
+def interpret_zone_unjoined(zone_id, changes=False, sources=DEFAULT_SOURCES):
+    return interpret_zone(zone_id, False, changes, sources)
+
+
+def interpret_zones(zone_ids, joined, changes=False, sources=DEFAULT_SOURCES):
+    """Fetches the zones concurrently and packs their forecasts, in request order, into the segment
+    budget of one response, shortening the longest ones to fit. A zone that fails is reported in
+    the response instead of failing the others"""
+    with ThreadPoolExecutor(max_workers=len(zone_ids)) as executor:
+        zone_segments = list(executor.map(bind(interpret_zone_unjoined), zone_ids,
+                                          [changes] * len(zone_ids),
+                                          [sources] * len(zone_ids)))
+    if all(segments is None for segments in zone_segments):
+        raise Exception("Unable to retrieve any of zones {}".format(zone_ids))
+
+    zone_segments = [unjoined if unjoined is not None else zone_unavailable_segments(zone_id)
+                     for zone_id, unjoined in zip(zone_ids, zone_segments)]
+    with span('format_segments'):
+        segments = share_segment_budget(zone_ids, zone_segments, joined)
+        segments = format_segments(segments, joined)
+        annotate(segments=len(segments))
+    return segments
+
+
 @safe(safe_return_value=[HELP_TEXT], log=LOG)
-def interpret(request, joined):
-    request = request.lower()
-
-    for zone_name, zone_id in CAIC_ZONE_MATCHES_TO_IDS:
-        if request.startswith(zone_name):
-            zone = CAIC_ZONES_IDS_TO_ZONES.get(zone_id, None)
-            html = download_html(zone_id)
-            forecast = parse_forecast(html, zone)
-            segments = forecast_to_segments(forecast)
-            return format_segments(segments, joined)
-
-    LOG.warning("event=unknown_request, request=%s", request)
-    return [HELP_TEXT]
+def interpret(request, joined, sources=DEFAULT_SOURCES):
+    with trace('interpret'), span('interpret'):
+        changes = CHANGES_KEYWORD_REGEX.search(request) is not None
+        request = CHANGES_KEYWORD_REGEX.sub(" ", request)
+        with span('match_zones'):
+            matches = ZONE_MATCHER.rank(request)
+            # Only exact matches add zones, a spelling correction is a guess worth one answer
+            matches = matches[:1] + [m for m in matches[1:] if m.distance == 0]
+            matches = matches[:MAX_ZONES_PER_REQUEST]
+            matches = sorted(matches, key=lambda m: m.position)
+            annotate(zones=len(matches))
+        for match in matches:
+            LOG.info("event=matched_zone, zone_id=%s, alias=%s, distance=%d",
+                     match.zone_id, match.alias, match.distance)
+
+        if len(matches) == 1:
+            return interpret_zone(matches[0].zone_id, joined, changes, sources)
+        elif len(matches) > 1:
+            return interpret_zones([m.zone_id for m in matches], joined, changes, sources)
+
+        LOG.warning("event=unknown_request, request=%s", request)
+        return [HELP_TEXT]
 
 
 if __name__ == "__main__":
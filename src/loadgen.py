@@ -0,0 +1,275 @@
+#! /usr/bin/env python3
+
+import argparse
+import glob
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from email.message import EmailMessage
+
+import aws_lambda_email
+from aws_lambda import entrypoint
+from download_caic_html import HttpCache
+from forecast_cache import FORECAST_CACHE
+from interpreter import render_zone, ForecastSources
+from local_stubs import CaicStubServer, InReachStubServer, S3StubServer, read_fixture_pages
+from rendered_store import publish_rendered
+from server import Server, make_app_server, twilio_signature
+from tracing import trace, aggregate, format_aggregate, percentile
+from utils import logger
+
+LOG = logger(__name__)
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+
+FIXTURE_GLOB = os.path.join(ROOT_DIR, "test", "fixtures", "*.html")
+
+# Both server routes are authenticated, the load test signs its requests with these
+LOAD_TWILIO_AUTH_TOKEN = "load-twilio-token"
+
+LOAD_SES_TOKEN = "load-ses-token"
+
+# What people text in, weighted towards single zones like a busy morning is
+REQUEST_BODIES = ["sangre", "front range", "vail summit", "aspen", "sawatch", "gunnison",
+                  "grand mesa", "northern san juan", "southern san juan", "steamboat",
+                  "sangre changes", "front range vail", "aspen gunnison sawatch", "hello"]
+
+
+def sms_event(body):
+    return {"queryStringParameters": {"Body": body, "From": "+15550000000"}}
+
+
+def ses_event(message_id):
+    return {"Records": [{"eventSource": "aws:ses", "ses": {"mail": {"messageId": message_id}}}]}
+
+
+def inreach_email(body, reply_url):
+    """Builds a request email like the ones inReach devices send, with the reply link in the html
+    part"""
+    message = EmailMessage()
+    message['From'] = "no.reply.inreach@garmin.com"
+    message['To'] = "forecast@avysms.com"
+    message['Subject'] = "inReach message from Avysms Load"
+    message.set_content(body)
+    message.add_alternative('<html><body><p>{}</p><a href="{}">Reply</a></body></html>'.format(
+        body, reply_url.replace('&', '&amp;')), subtype='html')
+    return message.as_bytes()
+
+
+def synthetic_events(count, email_fraction, s3=None, inreach=None, seed=0):
+    """Returns count (route, event) pairs. Email requests are stored in the s3 stub, each with its
+    own conversation on the inreach stub so no reply is mistaken for a resend"""
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        body = rng.choice(REQUEST_BODIES)
+        if rng.random() < email_fraction:
+            message_id = uuid.uuid4().hex
+            reply_url = "{}/inreach/textmessage/txtmsg?extId={}&adr=load%40avysms.com".format(
+                inreach.base_url, uuid.uuid4())
+            s3.put_object(aws_lambda_email.EMAIL_S3_BUCKET_NAME,
+                          "received/{}".format(message_id), inreach_email(body, reply_url))
+            events.append(('email', ses_event(message_id)))
+        else:
+            events.append(('sms', sms_event(body)))
+    return events
+
+
+class Recorder(object):
+    """Collects the latency and outcome of each request and the span records of their traces"""
+
+    def __init__(self):
+        self.samples = []
+        self.records = []
+        self.lock = threading.Lock()
+
+    def sample(self, route, latency_ms, ok):
+        with self.lock:
+            self.samples.append((route, latency_ms, ok))
+
+    def sink(self, records):
+        with self.lock:
+            self.records.extend(records)
+
+
+def entrypoint_sender(recorder, sources, email_s3_client):
+    def send(route, event):
+        with trace(route, sink=recorder.sink):
+            result = entrypoint(event, None, sources, email_s3_client)
+        return route != 'sms' or result['statusCode'] == 200
+    return send
+
+
+class TracedApp(object):
+    """Runs each server request in a trace that reports to the recorder. The server's own trace
+    inside entrypoint joins it"""
+
+    def __init__(self, app, recorder):
+        self.app = app
+        self.recorder = recorder
+
+    def __call__(self, environ, start_response):
+        route = 'sms' if environ.get('PATH_INFO') == '/sms' else 'email'
+        with trace(route, sink=self.recorder.sink):
+            return self.app(environ, start_response)
+
+
+def server_sender(base_url, twilio_auth_token=LOAD_TWILIO_AUTH_TOKEN, ses_token=LOAD_SES_TOKEN):
+    """Posts sms the way Twilio does, signed, and SES events with the relay's token"""
+    import requests
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=256)
+    session.mount('http://', adapter)
+
+    def send(route, event):
+        if route == 'sms':
+            form = event["queryStringParameters"]
+            signature = twilio_signature(twilio_auth_token, base_url + "/sms", form.items())
+            response = session.post(base_url + "/sms", data=form,
+                                    headers={'X-Twilio-Signature': signature})
+        else:
+            response = session.post(base_url + "/ses", json=event,
+                                    headers={'X-Avysms-Token': ses_token})
+        return response.status_code == 200
+    return send
+
+
+def run_load(send, events, rate, max_in_flight, recorder):
+    """Starts events at a fixed rate regardless of how fast they finish. Latency is measured from
+    when a request was due to start, so time spent waiting for a free worker counts too"""
+    def timed(route, event, due):
+        try:
+            ok = send(route, event)
+        except Exception as e:
+            LOG.error('event=load_request_failed, route=%s, error=%s', route, repr(e))
+            ok = False
+        recorder.sample(route, (time.perf_counter() - due) * 1000, ok)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for i, (route, event) in enumerate(events):
+            due = start + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(timed, route, event, due)
+    return time.perf_counter() - start
+
+
+def latency_summary(samples):
+    latencies = [latency_ms for _, latency_ms, _ in samples]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, _, ok in samples if not ok),
+        "error_rate": round(sum(1 for _, _, ok in samples if not ok) / max(len(samples), 1), 4),
+        "p50_ms": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99), 3) if latencies else None,
+    }
+
+
+def summarize(recorder, seconds, rate):
+    report = latency_summary(recorder.samples)
+    report["target_rate"] = rate
+    report["seconds"] = round(seconds, 3)
+    report["throughput"] = round(len(recorder.samples) / max(seconds, 1e-9), 1)
+    report["routes"] = {route: latency_summary([s for s in recorder.samples if s[0] == route])
+                        for route in sorted(set(s[0] for s in recorder.samples))}
+    report["stages"] = {"/".join(group): stats for group, stats in
+                        sorted(aggregate(recorder.records, ('route', 'stage')).items())}
+    report["failed_spans"] = sum(1 for record in recorder.records if record.get('error'))
+    return report
+
+
+def stub_s3_client(endpoint_url):
+    """A boto3 client for the s3 stub, with throwaway credentials since the stub ignores them"""
+    import boto3
+    from botocore.config import Config
+    return boto3.client('s3', endpoint_url=endpoint_url, aws_access_key_id='load',
+                        aws_secret_access_key='load', region_name='us-west-2',
+                        config=Config(s3={'addressing_style': 'path'}))
+
+
+def prerender(pages, store):
+    """Publishes every zone to the rendered store the way the cacher would have"""
+    for zone_id, html in pages.items():
+        publish_rendered(render_zone(zone_id, html), store)
+
+
+def load_test(fixture_paths, requests_count, rate, target='entrypoint', email_fraction=0.1,
+              max_in_flight=64, cold=False, seed=0):
+    """Replays synthetic sms and email requests against entrypoint, or the server mode on a local
+    port, with CAIC, S3 and inReach served by local stubs. Returns the report dict"""
+    pages = read_fixture_pages(fixture_paths)
+    recorder = Recorder()
+    with ExitStack() as stack:
+        tmp_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        caic = stack.enter_context(CaicStubServer(pages))
+        s3 = stack.enter_context(S3StubServer())
+        inreach = stack.enter_context(InReachStubServer())
+        sources = ForecastSources(caic.url_template, HttpCache(tmp_dir), tmp_dir)
+        email_s3_client = stub_s3_client(s3.endpoint_url)
+        FORECAST_CACHE.clear()
+        if not cold:
+            prerender(pages, tmp_dir)
+        events = synthetic_events(requests_count, email_fraction, s3, inreach, seed)
+
+        if target == 'server':
+            httpd = make_app_server('127.0.0.1', 0, TracedApp(
+                Server(max_in_flight, sources=sources, email_s3_client=email_s3_client,
+                       twilio_auth_token=LOAD_TWILIO_AUTH_TOKEN, ses_token=LOAD_SES_TOKEN,
+                       public_url=''), recorder))
+            threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True).start()
+            stack.callback(httpd.server_close)
+            stack.callback(httpd.shutdown)
+            send = server_sender("http://127.0.0.1:{}".format(httpd.server_port))
+        else:
+            send = entrypoint_sender(recorder, sources, email_s3_client)
+
+        LOG.info('event=load_started, target=%s, requests=%d, rate=%s', target,
+                 requests_count, rate)
+        seconds = run_load(send, events, rate, max_in_flight, recorder)
+    return summarize(recorder, seconds, rate)
+
+
+def format_report(report):
+    lines = ["{} requests in {:.2f} s, {:.1f}/s (target {}/s), error rate {:.2%}".format(
+        report["requests"], report["seconds"], report["throughput"], report["target_rate"],
+        report["error_rate"])]
+    lines.append("{:<10} {:>8} {:>7} {:>10} {:>10} {:>10}".format(
+        "route", "requests", "errors", "p50_ms", "p95_ms", "p99_ms"))
+    for route, stats in [("all", report)] + sorted(report["routes"].items()):
+        lines.append("{:<10} {:>8} {:>7} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            route, stats["requests"], stats["errors"], stats["p50_ms"], stats["p95_ms"],
+            stats["p99_ms"]))
+    stages = {tuple(group.split("/")): stats for group, stats in report["stages"].items()}
+    lines.append("")
+    lines.append(format_aggregate(stages, ('route', 'stage')))
+    if report["failed_spans"] > 0:
+        lines.append("{} spans failed".format(report["failed_spans"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays synthetic sms and email requests at a "
+                                                 "fixed rate against local stubs")
+    parser.add_argument("-n", "--requests", type=int, default=500)
+    parser.add_argument("-r", "--rate", type=float, default=50, help="requests started a second")
+    parser.add_argument("-t", "--target", choices=('entrypoint', 'server'), default='entrypoint')
+    parser.add_argument("-e", "--email-fraction", type=float, default=0.1)
+    parser.add_argument("-c", "--max-in-flight", type=int, default=64)
+    parser.add_argument("--cold", action="store_true",
+                        help="leave the rendered store empty so every zone is downloaded")
+    parser.add_argument("--json", action="store_true", help="print the report as json")
+    parser.add_argument("fixtures", nargs="*")
+    args = parser.parse_args()
+
+    report = load_test(args.fixtures or sorted(glob.glob(FIXTURE_GLOB)), args.requests, args.rate,
+                       args.target, args.email_fraction, args.max_in_flight, args.cold)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
@@ -0,0 +1,243 @@
+#! /usr/bin/env python3
+
+import abc
+import argparse
+import hashlib
+import json
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+from utils import logger
+
+LOG = logger(__name__)
+
+
+class StubServer(abc.ABC):
+    """Runs a local http server on a background thread. Subclasses implement handle(request)"""
+
+    def __init__(self, port=0):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.dispatch(self)
+
+            def do_POST(self):
+                stub.dispatch(self)
+
+            def do_PUT(self):
+                stub.dispatch(self)
+
+            def do_HEAD(self):
+                stub.dispatch(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.requests = []
+        self.statuses = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def dispatch(self, request):
+        with self.lock:
+            self.requests.append((request.command, request.path, dict(request.headers)))
+        self.handle(request)
+
+    @abc.abstractmethod
+    def handle(self, request):
+        pass
+
+    def respond(self, request, status, body=b"", headers=None):
+        with self.lock:
+            self.statuses.append(status)
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        request.send_response(status)
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        if request.command != 'HEAD':
+            request.wfile.write(body)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,),
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class CaicStubServer(StubServer):
+    """Serves forecast pages for pub_bc_avo.php?zone_id=N with ETag/Last-Modified validators,
+    unless validators is False"""
+
+    def __init__(self, pages, port=0, validators=True):
+        super().__init__(port)
+        self.pages = dict(pages)
+        self.validators = validators
+        self.last_modified = formatdate(usegmt=True)
+
+    @property
+    def url_template(self):
+        return self.base_url + "/caic/pub_bc_avo.php?zone_id={}"
+
+    def set_page(self, zone_id, html):
+        with self.lock:
+            self.pages[zone_id] = html
+            self.last_modified = formatdate(usegmt=True)
+
+    def handle(self, request):
+        url = urlparse(request.path)
+        zone_id = int(parse_qs(url.query).get('zone_id', ['-1'])[0])
+        html = self.pages.get(zone_id, None)
+        if url.path != '/caic/pub_bc_avo.php' or html is None:
+            return self.respond(request, 404)
+
+        body = html.encode('utf-8')
+        headers = {'Content-Type': 'text/html; charset=UTF-8'}
+        if self.validators:
+            headers['ETag'] = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            headers['Last-Modified'] = self.last_modified
+        if self.validators and request.headers.get('If-None-Match') == headers['ETag']:
+            return self.respond(request, 304, headers=headers)
+        self.respond(request, 200, body, headers)
+
+
+class InReachStubServer(StubServer):
+    """Accepts replies posted to textmessage/txtmsg the way the inReach explore site does.
+    failures is a list of statuses returned, in order, before requests start succeeding and
+    delay_seconds slows every reply down"""
+
+    def __init__(self, failures=(), delay_seconds=0.0, port=0):
+        super().__init__(port)
+        self.failures = list(failures)
+        self.delay_seconds = delay_seconds
+        self.messages = []
+
+    @property
+    def reply_url(self):
+        return self.base_url + "/textmessage/txtmsg?extId=00000000-0000-0000-0000-000000000000" \
+            "&adr=test%40avysms.com"
+
+    def handle(self, request):
+        length = int(request.headers.get('Content-Length', 0))
+        form = parse_qs(request.rfile.read(length).decode('utf-8'))
+        if request.command != 'POST' or \
+                not urlparse(request.path).path.endswith('/textmessage/txtmsg'):
+            return self.respond(request, 404)
+
+        time.sleep(self.delay_seconds)
+        with self.lock:
+            status = self.failures.pop(0) if len(self.failures) > 0 else 200
+            if status == 200:
+                self.messages.append((form['Guid'][0], form['ReplyMessage'][0]))
+        body = json.dumps({"Success": status == 200})
+        self.respond(request, status, body, {'Content-Type': 'application/json'})
+
+
+class TwilioStubServer(StubServer):
+    """Accepts sms posted to the Twilio messages api. failures and delay_seconds work like they do
+    for InReachStubServer. max_in_flight records the most requests that were handled at once"""
+
+    def __init__(self, failures=(), delay_seconds=0.0, port=0):
+        super().__init__(port)
+        self.failures = list(failures)
+        self.delay_seconds = delay_seconds
+        self.messages = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def api_url(self):
+        return self.base_url
+
+    def handle(self, request):
+        length = int(request.headers.get('Content-Length', 0))
+        form = parse_qs(request.rfile.read(length).decode('utf-8'))
+        path = urlparse(request.path).path
+        if request.command != 'POST' or not path.endswith('/Messages.json'):
+            return self.respond(request, 404)
+
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay_seconds)
+            with self.lock:
+                status = self.failures.pop(0) if len(self.failures) > 0 else 201
+                if status == 201:
+                    self.messages.append((form['To'][0], form['Body'][0]))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        body = json.dumps({"status": "queued"} if status == 201 else {"code": status})
+        self.respond(request, status, body, {'Content-Type': 'application/json'})
+
+
+class S3StubServer(StubServer):
+    """Serves path style S3 GetObject, HeadObject and PutObject requests, /bucket/key, for clients
+    created with endpoint_url pointing here. Requests are not authenticated"""
+
+    def __init__(self, objects=None, port=0):
+        super().__init__(port)
+        self.objects = dict(objects or {})
+
+    @property
+    def endpoint_url(self):
+        return self.base_url
+
+    def put_object(self, bucket, key, body):
+        with self.lock:
+            self.objects[(bucket, key)] = body
+
+    def handle(self, request):
+        bucket, _, key = unquote(urlparse(request.path).path).lstrip('/').partition('/')
+        if request.command == 'PUT':
+            length = int(request.headers.get('Content-Length', 0))
+            self.put_object(bucket, key, request.rfile.read(length))
+            return self.respond(request, 200, headers={'ETag': '"stub"'})
+        with self.lock:
+            body = self.objects.get((bucket, key), None)
+        if request.command not in ('GET', 'HEAD') or body is None:
+            error = "<Error><Code>NoSuchKey</Code><Key>{}</Key></Error>".format(key)
+            return self.respond(request, 404, error, {'Content-Type': 'application/xml'})
+        self.respond(request, 200, body, {'Content-Type': 'application/octet-stream'})
+
+
+def read_fixture_pages(fixture_paths):
+    """Maps zone ids to fixture html, cycling through the fixtures for all ten zones"""
+    fixtures = []
+    for path in fixture_paths:
+        with open(path, 'r') as f:
+            fixtures.append(f.read())
+    return {zone_id: fixtures[zone_id % len(fixtures)] for zone_id in range(0, 10)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--port", type=int, default=8081)
+    parser.add_argument("fixtures", nargs='+')
+    args = parser.parse_args()
+
+    server = CaicStubServer(read_fixture_pages(args.fixtures), args.port)
+    LOG.info('event=caic_stub_started, url_template=%s', server.url_template)
+    server.server.serve_forever()
@@ -0,0 +1,150 @@
+#! /usr/bin/env python3
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from forecast import forecast_day
+from forecast_archive import LocalArchiveBackend, S3ArchiveBackend
+from s3_reader import SignedS3Reader, environment_credentials, environment_region
+from utils import safe, logger, Data
+
+LOG = logger(__name__)
+
+# Either s3://bucket/prefix or a local directory
+RENDERED_STORE = os.environ.get('AVYSMS_RENDERED_STORE', 's3://avysms-forecast/rendered')
+
+MAX_RENDERED_AGE_SECONDS = int(os.environ.get('AVYSMS_MAX_RENDERED_AGE_SECONDS', 2 * 60 * 60))
+
+# The cacher's writes. Reads on the request path use the s3 transport policy
+S3_CONNECT_TIMEOUT_SECONDS = 1
+
+S3_READ_TIMEOUT_SECONDS = 1.5
+
+
+class RenderedForecast(Data):
+    """The responses for a zone, with the compact forecast they came from and the compact form of
+    the zone's previous forecast, for answering what changed. html_key is the digest of the
+    forecast html the responses were rendered from, see forecast_cache.forecast_html_key"""
+
+    def __init__(self, zone_id, rendered_at, forecast_date, joined, unjoined, forecast=None,
+                 previous_forecast=None, html_key=None):
+        self.zone_id = zone_id
+        self.rendered_at = rendered_at
+        self.forecast_date = forecast_date
+        self.joined = joined
+        self.unjoined = unjoined
+        self.forecast = forecast
+        self.previous_forecast = previous_forecast
+        self.html_key = html_key
+
+    def segments(self, joined):
+        return list(self.joined if joined else self.unjoined)
+
+    def is_stale(self, now=None, max_age_seconds=MAX_RENDERED_AGE_SECONDS):
+        now = time.time() if now is None else now
+        return now - self.rendered_at > max_age_seconds
+
+
+def same_forecast_day(date, other_date):
+    try:
+        return forecast_day(date) == forecast_day(other_date)
+    except (AttributeError, ValueError):
+        # A date CAIC formatted some other way can only be compared as it is
+        return date == other_date
+
+
+def previous_forecast(published, rendered):
+    """Picks the forecast rendered should be compared against: the published one when rendered is
+    a newer day's forecast, otherwise the one the published forecast was compared against. So
+    updates during a day, which carry a later time, are still compared to the day before"""
+    if published is None:
+        return None
+    if not same_forecast_day(published.forecast_date, rendered.forecast_date):
+        return published.forecast
+    return published.previous_forecast
+
+
+def forecast_changed(published, rendered):
+    """Whether rendered is a different forecast from the published one: CAIC gave it another date,
+    or its forecast html differs once the ads and timestamps are ignored"""
+    if published is None or published.html_key is None:
+        return True
+    return published.forecast_date != rendered.forecast_date or \
+        published.html_key != rendered.html_key
+
+
+def rendered_key(zone_id):
+    return "{}.json".format(zone_id)
+
+
+def split_s3_location(store):
+    bucket, _, prefix = store[len('s3://'):].partition('/')
+    return bucket, prefix
+
+
+BACKENDS = {}
+
+BACKENDS_LOCK = threading.Lock()
+
+
+def store_backend(store):
+    """Returns the backend of store, kept for the life of the container so the S3 client and its
+    connections are reused across requests"""
+    with BACKENDS_LOCK:
+        if store not in BACKENDS:
+            if store.startswith('s3://'):
+                BACKENDS[store] = S3ArchiveBackend(*split_s3_location(store),
+                                                   client=rendered_s3_client())
+            else:
+                BACKENDS[store] = LocalArchiveBackend(store)
+        return BACKENDS[store]
+
+
+def read_backend(store):
+    """Returns the backend rendered forecasts are read through. With credentials in the
+    environment, as in Lambda, S3 is read with signed requests, which keeps boto3 and its imports
+    off every forecast sms"""
+    credentials = environment_credentials() if store.startswith('s3://') else None
+    if credentials is None:
+        return store_backend(store)
+    with BACKENDS_LOCK:
+        if ('read', store) not in BACKENDS:
+            BACKENDS[('read', store)] = SignedS3Reader(*split_s3_location(store), credentials,
+                                                       environment_region())
+        return BACKENDS[('read', store)]
+
+
+def rendered_s3_client():
+    # Deferred so requests answered without the store, like help texts, never load boto3
+    import boto3
+    from botocore.config import Config
+    return boto3.client('s3', config=Config(connect_timeout=S3_CONNECT_TIMEOUT_SECONDS,
+                                            read_timeout=S3_READ_TIMEOUT_SECONDS,
+                                            retries={'max_attempts': 2}))
+
+
+@safe(log=LOG)
+def read_rendered(zone_id, store=None):
+    body = read_backend(store or RENDERED_STORE).get(rendered_key(zone_id))
+    if body is None:
+        return None
+    return RenderedForecast(**json.loads(body.decode('utf-8')))
+
+
+def publish_rendered(rendered, store=None):
+    store = store or RENDERED_STORE
+    body = json.dumps(dict(rendered)).encode('utf-8')
+    store_backend(store).put(rendered_key(rendered.zone_id), body, 'application/json')
+    LOG.info('event=published_rendered_forecast, zone_id=%s, store=%s',
+             rendered.zone_id, store)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-z", "--zone-id", type=int, default=9)
+    parser.add_argument("-s", "--store", default=RENDERED_STORE)
+    args = parser.parse_args()
+    print(read_rendered(args.zone_id, args.store))
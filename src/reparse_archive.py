@@ -0,0 +1,230 @@
+#! /usr/bin/env python3
+
+import argparse
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from caic_html_to_forecast import parse_forecast
+from forecast import ELEVATION_NAMES, ASPECT_NAMES
+from forecast_archive import open_archive
+from interpreter import CAIC_ZONES_IDS_TO_ZONES
+from utils import logger
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet parts are optional, csv parts need nothing beyond the stdlib
+    pyarrow = None
+
+LOG = logger(__name__)
+
+COLUMNS = ['zone_id', 'zone', 'snapshot', 'forecast_date', 'problem', 'problem_type',
+           'likelihood', 'size', 'elevation', 'aspect', 'problematic']
+
+CHECKPOINT_NAME = 'checkpoint.jsonl'
+
+DEFAULT_PART_SIZE = 200
+
+OUTPUT_FORMATS = ('parquet', 'csv')
+
+# Columns that are not strings in parquet parts
+INTEGER_COLUMNS = ('zone_id', 'problem')
+
+
+def legacy_snapshots(root):
+    """Lists (key, zone_id, snapshot, 'file', path) for the CAIC/<zone>/<timestamp> layout the
+    cacher used to write, given either the CAIC directory or its parent"""
+    if os.path.isdir(os.path.join(root, 'CAIC')):
+        root = os.path.join(root, 'CAIC')
+    snapshots = []
+    for zone_name in os.listdir(root):
+        zone_dir = os.path.join(root, zone_name)
+        if not zone_name.isdigit() or not os.path.isdir(zone_dir):
+            continue
+        for snapshot in os.listdir(zone_dir):
+            key = "legacy/{}/{}".format(zone_name, snapshot)
+            snapshots.append((key, int(zone_name), snapshot, 'file',
+                              os.path.join(zone_dir, snapshot)))
+    return sorted(snapshots)
+
+
+def archive_snapshots(archive, zone_ids):
+    """Lists (key, zone_id, snapshot, 'archive', digest) for every version in the archive index"""
+    snapshots = []
+    for zone_id in zone_ids:
+        for timestamp, digest in archive.index(zone_id):
+            key = "archive/{}/{}".format(zone_id, timestamp)
+            snapshots.append((key, zone_id, str(timestamp), 'archive', digest))
+    return sorted(snapshots)
+
+
+WORKER_ARCHIVE = None
+
+
+def init_worker(archive_store):
+    global WORKER_ARCHIVE
+    WORKER_ARCHIVE = open_archive(archive_store) if archive_store is not None else None
+
+
+def read_snapshot(kind, source):
+    if kind == 'archive':
+        return WORKER_ARCHIVE.load(source)
+    with open(source, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+def problematic_text(problematic):
+    return "" if problematic is None else str(problematic).lower()
+
+
+def forecast_rows(zone_id, snapshot, forecast):
+    rows = []
+    for problem_number, problem in enumerate(forecast.problems):
+        for elevation in ELEVATION_NAMES:
+            for aspect in ASPECT_NAMES:
+                rows.append([zone_id, forecast.zone, snapshot, forecast.date, problem_number,
+                             problem.problem_type, problem.likelyhood, problem.size, elevation,
+                             aspect, problematic_text(problem.is_problematic(elevation, aspect))])
+    return rows
+
+
+def parse_snapshot(snapshot):
+    """Runs in a worker process. Returns (key, rows, error)"""
+    key, zone_id, timestamp, kind, source = snapshot
+    try:
+        html = read_snapshot(kind, source)
+        forecast = parse_forecast(html, CAIC_ZONES_IDS_TO_ZONES.get(zone_id, None))
+        return key, forecast_rows(zone_id, timestamp, forecast), None
+    except Exception as e:
+        return key, [], repr(e)
+
+
+class Checkpoint(object):
+    """Records which snapshots are in which finished part file. A part is only checkpointed after
+    it has been renamed into place, so a resumed run rewrites at most the part that was open.
+    Snapshots that failed to parse are never checkpointed, so the next run retries them"""
+
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, CHECKPOINT_NAME)
+        self.done = set()
+        self.parts = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    self.done.update(json.loads(line)['keys'])
+                    self.parts += 1
+
+    def record(self, part, keys):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'part': part, 'keys': keys}) + "\n")
+        self.done.update(keys)
+        self.parts += 1
+
+
+def default_output_format():
+    return 'parquet' if pyarrow is not None else 'csv'
+
+
+def parquet_schema():
+    return pyarrow.schema([(column, pyarrow.int32() if column in INTEGER_COLUMNS
+                            else pyarrow.string()) for column in COLUMNS])
+
+
+def write_part(out_dir, part, rows, output_format='csv'):
+    # Write then rename so a part file is either complete or missing
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir)
+    if output_format == 'parquet':
+        os.close(fd)
+        columns = {column: [row[i] for row in rows] for i, column in enumerate(COLUMNS)}
+        table = pyarrow.table(columns, schema=parquet_schema())
+        pyarrow.parquet.write_table(table, tmp_path)
+    else:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(buffer.getvalue())
+    os.replace(tmp_path, os.path.join(out_dir, part))
+
+
+def reparse(snapshots, out_dir, workers=None, part_size=DEFAULT_PART_SIZE, archive_store=None,
+            output_format=None):
+    """Parses the snapshots on a process pool into part-NNNNN.parquet files in out_dir, or .csv
+    files when pyarrow is not installed or output_format is 'csv', skipping those a previous run
+    checkpointed. Returns a dict of run statistics"""
+    output_format = output_format or default_output_format()
+    if output_format == 'parquet' and pyarrow is None:
+        raise ImportError("parquet parts need pyarrow, pip install pyarrow")
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint = Checkpoint(out_dir)
+    pending = [snapshot for snapshot in snapshots if snapshot[0] not in checkpoint.done]
+    workers = workers or os.cpu_count()
+    LOG.info('event=reparse_started, snapshots=%d, pending=%d, workers=%d',
+             len(snapshots), len(pending), workers)
+
+    start = time.perf_counter()
+    stats = {'snapshots': 0, 'rows': 0, 'errors': 0, 'parts': 0}
+    keys, rows = [], []
+
+    def flush():
+        part = "part-{:05d}.{}".format(checkpoint.parts, output_format)
+        write_part(out_dir, part, rows, output_format)
+        checkpoint.record(part, keys)
+        stats['parts'] += 1
+        keys.clear()
+        rows.clear()
+
+    chunksize = max(1, min(16, len(pending) // (workers * 4)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(archive_store,)) as executor:
+        # map yields in submission order, so parts and checkpoints follow the snapshot order
+        for key, snapshot_rows, error in executor.map(parse_snapshot, pending,
+                                                      chunksize=chunksize):
+            stats['snapshots'] += 1
+            if error is not None:
+                LOG.error('event=reparse_snapshot_failed, key=%s, error=%s', key, error)
+                stats['errors'] += 1
+                continue
+            keys.append(key)
+            rows.extend(snapshot_rows)
+            stats['rows'] += len(snapshot_rows)
+            if len(keys) >= part_size:
+                flush()
+    if len(keys) > 0:
+        flush()
+
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    stats['snapshots_per_second'] = round(stats['snapshots'] / max(stats['seconds'], 1e-9), 1)
+    LOG.info('event=reparse_complete, %s', ", ".join(
+        "{}={}".format(name, value) for name, value in sorted(stats.items())))
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parses archived CAIC pages into parquet or csv "
+                                                 "parts")
+    parser.add_argument("-l", "--legacy", help="directory holding the CAIC/<zone>/<timestamp> "
+                                               "snapshots, e.g. from aws s3 sync")
+    parser.add_argument("-a", "--archive", help="forecast archive store, s3://... or directory")
+    parser.add_argument("-o", "--out-dir", required=True)
+    parser.add_argument("-w", "--workers", type=int, default=None)
+    parser.add_argument("-p", "--part-size", type=int, default=DEFAULT_PART_SIZE)
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default=None,
+                        help="parquet when pyarrow is installed, otherwise csv")
+    args = parser.parse_args()
+
+    snapshots = []
+    if args.legacy:
+        snapshots.extend(legacy_snapshots(args.legacy))
+    if args.archive:
+        snapshots.extend(archive_snapshots(open_archive(args.archive), CAIC_ZONES_IDS_TO_ZONES))
+    if len(snapshots) == 0:
+        parser.error("nothing to parse, give --legacy and/or --archive")
+    print(json.dumps(reparse(snapshots, args.out_dir, args.workers, args.part_size,
+                             args.archive, args.format)))
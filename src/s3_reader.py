@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+
+import argparse
+import datetime
+import hashlib
+import hmac
+import os
+from urllib.parse import quote, urlparse
+
+from transport import request
+from utils import logger, Data
+
+LOG = logger(__name__)
+
+EMPTY_PAYLOAD_SHA256 = hashlib.sha256(b"").hexdigest()
+
+
+class Credentials(Data):
+    def __init__(self, access_key_id, secret_access_key, session_token=None):
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.session_token = session_token
+
+
+def environment_credentials(environ=os.environ):
+    """The credentials Lambda puts in the function's environment, or None when there are none"""
+    if not environ.get('AWS_ACCESS_KEY_ID') or not environ.get('AWS_SECRET_ACCESS_KEY'):
+        return None
+    return Credentials(environ['AWS_ACCESS_KEY_ID'], environ['AWS_SECRET_ACCESS_KEY'],
+                       environ.get('AWS_SESSION_TOKEN') or None)
+
+
+def environment_region(environ=os.environ):
+    return environ.get('AWS_REGION') or environ.get('AWS_DEFAULT_REGION') or 'us-east-1'
+
+
+def sha256_hex(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def signing_key(secret_access_key, date, region, service='s3'):
+    key = ('AWS4' + secret_access_key).encode('utf-8')
+    for part in (date, region, service, 'aws4_request'):
+        key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+    return key
+
+
+def sign_request(method, host, path, headers, credentials, region, now,
+                 payload_sha256=EMPTY_PAYLOAD_SHA256):
+    """Signs an S3 request without a query string with AWS Signature Version 4. Returns the headers
+    to send: the given ones, lower cased, plus host, the x-amz ones and Authorization"""
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    signed = {name.lower(): value.strip() for name, value in headers.items()}
+    signed.update({'host': host, 'x-amz-date': amz_date, 'x-amz-content-sha256': payload_sha256})
+    if credentials.session_token:
+        signed['x-amz-security-token'] = credentials.session_token
+    names = sorted(signed)
+    canonical_request = "\n".join([
+        method, quote(path, safe='/~'), "",
+        "".join("{}:{}\n".format(name, signed[name]) for name in names),
+        ";".join(names), payload_sha256])
+    scope = "{}/{}/s3/aws4_request".format(amz_date[:8], region)
+    string_to_sign = "\n".join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                sha256_hex(canonical_request)])
+    signature = hmac.new(signing_key(credentials.secret_access_key, amz_date[:8], region),
+                         string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    signed['authorization'] = "AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, " \
+                              "Signature={}".format(credentials.access_key_id, scope,
+                                                    ";".join(names), signature)
+    return signed
+
+
+class SignedS3Reader(object):
+    """Reads objects from a private bucket with signed GETs through transport, so a reader on the
+    sms path never loads boto3. endpoint_url, for a local stub, is addressed path style"""
+
+    def __init__(self, bucket, prefix, credentials, region, endpoint_url=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.credentials = credentials
+        self.region = region
+        self.endpoint_url = endpoint_url
+
+    def location(self, key):
+        """Returns (base url, host, path) of key"""
+        key = os.path.join(self.prefix, key)
+        if self.endpoint_url is not None:
+            return self.endpoint_url, urlparse(self.endpoint_url).netloc, \
+                "/{}/{}".format(self.bucket, key)
+        host = "{}.s3.{}.amazonaws.com".format(self.bucket, self.region)
+        return "https://" + host, host, "/" + key
+
+    def get(self, key):
+        base_url, host, path = self.location(key)
+        headers = sign_request('GET', host, path, {}, self.credentials, self.region,
+                               datetime.datetime.now(datetime.timezone.utc))
+        response = request('s3', 'GET', base_url + quote(path, safe='/~'), headers=headers)
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise Exception("GET s3://{}/{} returned {}: {}".format(
+                self.bucket, os.path.join(self.prefix, key), response.status_code, response.text))
+        return response.content
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reads an object with the environment's "
+                                                 "credentials and prints its size")
+    parser.add_argument("location", help="s3://bucket/key")
+    args = parser.parse_args()
+
+    bucket, _, key = args.location[len('s3://'):].partition('/')
+    reader = SignedS3Reader(bucket, "", environment_credentials(), environment_region())
+    body = reader.get(key)
+    print("not found" if body is None else "{} bytes".format(len(body)))
@@ -0,0 +1,217 @@
+#! /usr/bin/env python3
+
+import argparse
+import json
+import struct
+import sys
+import timeit
+
+from forecast import Forecast, Danger, Problem, Warning, ELEVATION_NAMES, DANGER_NAMES, \
+    PROBLEM_TYPE_NAMES, SIZE_NAMES, LIKELIHOOD_NAMES
+from utils import logger, to_plain, from_plain
+
+LOG = logger(__name__)
+
+COMPACT_VERSION = 1
+
+BINARY_MAGIC = b'AVY'
+
+NONE_CODE = 0xff
+
+NONE_LENGTH = 0xffffffff
+
+# Field order of each class in the compact forms. Code fields hold the position of the name in
+# the listed names and the rose is the pair of 24 bit masks
+SCHEMAS = {
+    Danger: [('elevation_code', 'code', ELEVATION_NAMES), ('danger_code', 'code', DANGER_NAMES)],
+    Problem: [('problem_type_code', 'code', PROBLEM_TYPE_NAMES), ('size_code', 'code', SIZE_NAMES),
+              ('likelyhood_code', 'code', LIKELIHOOD_NAMES), ('rose_mask', 'mask', None),
+              ('rose_unknown_mask', 'mask', None)],
+    Warning: [('issued', 'str', None), ('expires', 'str', None), ('title', 'str', None),
+              ('description', 'str', None)],
+    Forecast: [('zone', 'str', None), ('date', 'str', None), ('description', 'str', None),
+               ('dangers', 'list', Danger), ('problems', 'list', Problem),
+               ('warnings', 'list', Warning)]
+}
+
+
+def encode_compact_object(obj):
+    return [[encode_compact_object(item) for item in getattr(obj, name)] if kind == 'list'
+            else getattr(obj, name)
+            for name, kind, _ in SCHEMAS[type(obj)]]
+
+
+def decode_compact_object(cls, values):
+    obj = cls.__new__(cls)
+    for (name, kind, item_cls), value in zip(SCHEMAS[cls], values):
+        if kind == 'list':
+            value = [decode_compact_object(item_cls, item) for item in value]
+        elif kind == 'code' and value is not None and not 0 <= value < len(item_cls):
+            raise ValueError("Invalid {} code: {}".format(name, value))
+        setattr(obj, name, value)
+    return obj
+
+
+def to_compact(forecast):
+    return {"v": COMPACT_VERSION, "forecast": encode_compact_object(forecast)}
+
+
+def to_compact_json(forecast):
+    return json.dumps(to_compact(forecast), separators=(',', ':'))
+
+
+def from_compact_json(json_str):
+    compact = json.loads(json_str) if isinstance(json_str, str) else json_str
+    if compact.get("v") != COMPACT_VERSION:
+        raise ValueError("Unsupported compact forecast version: {}".format(compact.get("v")))
+    return decode_compact_object(Forecast, compact["forecast"])
+
+
+def to_legacy_json(forecast):
+    """The py/object tagged json written by jsonpickle, which the test fixtures use"""
+    return json.dumps(to_plain(forecast, tagged=True))
+
+
+def from_legacy_json(json_str):
+    return from_plain(json.loads(json_str) if isinstance(json_str, str) else json_str)
+
+
+class BinaryWriter(object):
+    def __init__(self):
+        self.parts = [BINARY_MAGIC, struct.pack('<B', COMPACT_VERSION)]
+
+    def write_str(self, value):
+        if value is None:
+            self.parts.append(struct.pack('<I', NONE_LENGTH))
+        else:
+            encoded = value.encode('utf-8')
+            self.parts.append(struct.pack('<I', len(encoded)))
+            self.parts.append(encoded)
+
+    def write_code(self, value):
+        self.parts.append(struct.pack('<B', NONE_CODE if value is None else value))
+
+    def write_mask(self, value):
+        self.parts.append(struct.pack('<i', -1 if value is None else value))
+
+    def write_object(self, obj):
+        for name, kind, _ in SCHEMAS[type(obj)]:
+            value = getattr(obj, name)
+            if kind == 'list':
+                self.parts.append(struct.pack('<H', len(value)))
+                for item in value:
+                    self.write_object(item)
+            else:
+                getattr(self, 'write_' + kind)(value)
+
+    def bytes(self):
+        return b''.join(self.parts)
+
+
+class BinaryReader(object):
+    def __init__(self, data):
+        if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            raise ValueError("Not a binary forecast")
+        self.data = data
+        self.offset = len(BINARY_MAGIC)
+        version = self.unpack('<B')
+        if version != COMPACT_VERSION:
+            raise ValueError("Unsupported binary forecast version: {}".format(version))
+
+    def unpack(self, fmt):
+        value, = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def read_str(self):
+        length = self.unpack('<I')
+        if length == NONE_LENGTH:
+            return None
+        self.offset += length
+        return self.data[self.offset - length:self.offset].decode('utf-8')
+
+    def read_code(self):
+        code = self.unpack('<B')
+        return None if code == NONE_CODE else code
+
+    def read_mask(self):
+        mask = self.unpack('<i')
+        return None if mask < 0 else mask
+
+    def read_values(self, cls):
+        values = []
+        for _, kind, item_cls in SCHEMAS[cls]:
+            if kind == 'list':
+                values.append([self.read_values(item_cls) for _ in range(self.unpack('<H'))])
+            else:
+                values.append(getattr(self, 'read_' + kind)())
+        return values
+
+
+def to_binary(forecast):
+    writer = BinaryWriter()
+    writer.write_object(forecast)
+    return writer.bytes()
+
+
+def from_binary(data):
+    return decode_compact_object(Forecast, BinaryReader(data).read_values(Forecast))
+
+
+def loads(data):
+    """Decodes a forecast from any of the binary, compact json or legacy json forms"""
+    if isinstance(data, bytes) and data.startswith(BINARY_MAGIC):
+        return from_binary(data)
+    decoded = json.loads(data)
+    return from_compact_json(decoded) if "v" in decoded else from_legacy_json(decoded)
+
+
+FORMATS = {
+    'legacy': to_legacy_json,
+    'compact': to_compact_json,
+    'binary': to_binary,
+}
+
+
+def benchmark(forecasts, number=200):
+    """Times encoding and decoding of each format against jsonpickle, in microseconds"""
+    import jsonpickle
+    candidates = [
+        ('jsonpickle', jsonpickle.encode, jsonpickle.decode),
+        ('legacy', to_legacy_json, from_legacy_json),
+        ('compact', to_compact_json, from_compact_json),
+        ('binary', to_binary, from_binary),
+    ]
+    results = []
+    for name, encode, decode in candidates:
+        encoded = [encode(f) for f in forecasts]
+        encode_seconds = timeit.timeit(lambda: [encode(f) for f in forecasts], number=number)
+        decode_seconds = timeit.timeit(lambda: [decode(e) for e in encoded], number=number)
+        size = sum(len(e) for e in encoded)
+        count = number * len(forecasts)
+        results.append((name, encode_seconds / count * 1e6, decode_seconds / count * 1e6, size))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--to", choices=sorted(FORMATS), default='compact',
+                        help="convert a forecast in any form on stdin to this form")
+    parser.add_argument("-b", "--benchmark", nargs='+', metavar="FORECAST_JSON",
+                        help="compare encode/decode throughput against jsonpickle instead")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        forecasts = []
+        for path in args.benchmark:
+            with open(path, 'r') as f:
+                forecasts.append(loads(f.read()))
+        print("{:<12} {:>10} {:>10} {:>8}".format("format", "encode us", "decode us", "bytes"))
+        for name, encode_us, decode_us, size in benchmark(forecasts):
+            print("{:<12} {:>10.1f} {:>10.1f} {:>8}".format(name, encode_us, decode_us, size))
+    else:
+        encoded = FORMATS[args.to](loads(sys.stdin.buffer.read()))
+        if isinstance(encoded, bytes):
+            sys.stdout.buffer.write(encoded)
+        else:
+            print(encoded, end='')
@@ -0,0 +1,239 @@
+#! /usr/bin/env python3
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from http import HTTPStatus
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+from wsgiref.util import request_uri
+
+from aws_lambda import entrypoint
+from utils import logger
+
+LOG = logger(__name__)
+
+SERVER_HOST = os.environ.get('AVYSMS_SERVER_HOST', '127.0.0.1')
+
+SERVER_PORT = int(os.environ.get('AVYSMS_SERVER_PORT', 8080))
+
+# Requests handled at once. Further requests wait up to SERVER_QUEUE_SECONDS for a slot and are
+# then answered with a 503. Nothing retries it: Twilio calls the number's fallback url if one is
+# set, otherwise that sms goes unanswered
+SERVER_MAX_CONCURRENT = int(os.environ.get('AVYSMS_SERVER_MAX_CONCURRENT', 32))
+
+SERVER_QUEUE_SECONDS = float(os.environ.get('AVYSMS_SERVER_QUEUE_SECONDS', 5))
+
+# Signs every Twilio webhook in X-Twilio-Signature. /sms is refused while it is not set
+TWILIO_AUTH_TOKEN = os.environ.get('AVYSMS_TWILIO_AUTH_TOKEN', '')
+
+# The url Twilio is configured with, e.g. https://sms.avysms.com, when a proxy in front of the
+# server changes the scheme or host Twilio signed
+SERVER_PUBLIC_URL = os.environ.get('AVYSMS_SERVER_PUBLIC_URL', '')
+
+# Whatever relays SES events to /ses sends this in X-Avysms-Token. /ses is refused while it is not
+# set
+SES_TOKEN = os.environ.get('AVYSMS_SERVER_SES_TOKEN', '')
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def sms_event(environ, body):
+    """Builds the API Gateway event entrypoint expects from a Twilio webhook, which is a GET with
+    the message in the query string or a form encoded POST"""
+    parameters = dict(parse_qsl(environ.get('QUERY_STRING', '')))
+    if environ['REQUEST_METHOD'] == 'POST':
+        parameters.update(parse_qsl(body.decode('utf-8')))
+    if 'Body' not in parameters:
+        raise ValueError("Twilio webhook without a Body")
+    return {"queryStringParameters": parameters}
+
+
+def twilio_signature(auth_token, url, form=()):
+    """Signs a webhook the way Twilio does: the url it called followed by each POST parameter's
+    name and value, sorted by name, as a base64 HMAC-SHA1 keyed by the account's auth token"""
+    payload = url + "".join(name + value for name, value in sorted(form))
+    digest = hmac.new(auth_token.encode('utf-8'), payload.encode('utf-8'), hashlib.sha1).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def request_url(environ, public_url=None):
+    if not public_url:
+        return request_uri(environ, include_query=True)
+    query = environ.get('QUERY_STRING', '')
+    return public_url.rstrip('/') + environ.get('PATH_INFO', '/') + ('?' + query if query else '')
+
+
+def reason(status):
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return 'Unknown'
+
+
+def read_body(environ):
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    return environ['wsgi.input'].read(length) if length > 0 else b""
+
+
+class Server(object):
+    """A WSGI app serving the Lambda routes from one long lived process, so the module level
+    caches, sessions and breakers stay warm between requests:
+
+    GET|POST /sms     Twilio webhook, answered with the TwiML entrypoint returns
+    POST /ses         an SES event as json, e.g. {"Records": [{"eventSource": "aws:ses", ...}]}
+    GET /health       liveness and request counters
+
+    /sms only answers requests signed with twilio_auth_token and /ses only those carrying ses_token,
+    with a 403 otherwise"""
+
+    def __init__(self, max_concurrent=SERVER_MAX_CONCURRENT, queue_seconds=SERVER_QUEUE_SECONDS,
+                 sources=None, email_s3_client=None, twilio_auth_token=TWILIO_AUTH_TOKEN,
+                 ses_token=SES_TOKEN, public_url=SERVER_PUBLIC_URL):
+        self.sources = sources
+        self.email_s3_client = email_s3_client
+        self.twilio_auth_token = twilio_auth_token
+        self.ses_token = ses_token
+        self.public_url = public_url
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.queue_seconds = queue_seconds
+        self.started = time.time()
+        self.counters = {'requests': 0, 'errors': 0, 'rejected': 0, 'forbidden': 0,
+                         'in_flight': 0}
+        self.lock = threading.Lock()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def __call__(self, environ, start_response):
+        method, path = environ['REQUEST_METHOD'], environ.get('PATH_INFO', '/')
+        if path == '/health':
+            return self.respond(start_response, 200, self.health(), 'application/json')
+
+        routes = {'/sms': ('GET', 'POST'), '/ses': ('POST',)}
+        if path not in routes:
+            return self.respond(start_response, 404, "")
+        if method not in routes[path]:
+            return self.respond(start_response, 405, "")
+        request_body = read_body(environ)
+        if not self.authorized(path, environ, request_body):
+            self.count('forbidden')
+            LOG.warning('event=server_forbidden, path=%s', path)
+            return self.respond(start_response, 403, "")
+
+        if not self.slots.acquire(timeout=self.queue_seconds):
+            self.count('rejected')
+            LOG.warning('event=server_overloaded, path=%s', path)
+            return self.respond(start_response, 503, "")
+        self.count('requests')
+        self.count('in_flight')
+        start = time.perf_counter()
+        try:
+            status, body, content_type = self.dispatch(path, environ, request_body)
+        finally:
+            self.count('in_flight', -1)
+            self.slots.release()
+        LOG.info('event=server_request, path=%s, status=%d, ms=%.1f',
+                 path, status, (time.perf_counter() - start) * 1000)
+        return self.respond(start_response, status, body, content_type)
+
+    def authorized(self, path, environ, body):
+        if path == '/sms':
+            if not self.twilio_auth_token:
+                return False
+            form = parse_qsl(body.decode('utf-8', 'replace'), keep_blank_values=True) \
+                if environ['REQUEST_METHOD'] == 'POST' else ()
+            expected = twilio_signature(self.twilio_auth_token,
+                                        request_url(environ, self.public_url), form)
+            signature = environ.get('HTTP_X_TWILIO_SIGNATURE', '')
+        else:
+            expected, signature = self.ses_token, environ.get('HTTP_X_AVYSMS_TOKEN', '')
+        return bool(expected) and hmac.compare_digest(expected.encode('utf-8'),
+                                                      signature.encode('utf-8'))
+
+    def dispatch(self, path, environ, body):
+        """Returns (status, body, content type)"""
+        try:
+            if path == '/sms':
+                event = sms_event(environ, body)
+            else:
+                event = json.loads(body.decode('utf-8'))
+        except ValueError as e:
+            LOG.warning('event=server_bad_request, path=%s, error=%s', path, repr(e))
+            return 400, "", 'text/plain'
+
+        try:
+            result = entrypoint(event, None, self.sources, self.email_s3_client)
+        except Exception as e:
+            self.count('errors')
+            LOG.error('event=server_request_failed, path=%s, error=%s', path, repr(e))
+            return 500, "", 'text/plain'
+        if result is None:
+            return 200, "", 'text/plain'
+        return result['statusCode'], result['body'], result['headers']['Content-Type']
+
+    def health(self):
+        with self.lock:
+            health = dict(self.counters)
+        health['status'] = 'ok'
+        health['uptime_seconds'] = round(time.time() - self.started, 1)
+        return json.dumps(health, sort_keys=True)
+
+    @staticmethod
+    def respond(start_response, status, body, content_type='text/plain'):
+        body = body.encode('utf-8')
+        start_response("{} {}".format(status, reason(status)), [
+            ('Content-Type', content_type), ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def warm_up():
+    """Imports both routes' handlers and the parser up front so the first requests do not pay for
+    it"""
+    import aws_lambda_sms
+    import aws_lambda_email
+    import forecast_cache
+
+
+def make_app_server(host=SERVER_HOST, port=SERVER_PORT, app=None):
+    return make_server(host, port, app or Server(), server_class=ThreadingWSGIServer,
+                       handler_class=QuietRequestHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves the sms and ses routes over http")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("-p", "--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--max-concurrent", type=int, default=SERVER_MAX_CONCURRENT)
+    parser.add_argument("--no-warm-up", action="store_true")
+    args = parser.parse_args()
+
+    if not args.no_warm_up:
+        warm_up()
+    if not TWILIO_AUTH_TOKEN:
+        LOG.warning('event=server_route_disabled, path=/sms, missing=AVYSMS_TWILIO_AUTH_TOKEN')
+    if not SES_TOKEN:
+        LOG.warning('event=server_route_disabled, path=/ses, missing=AVYSMS_SERVER_SES_TOKEN')
+    httpd = make_app_server(args.host, args.port, Server(args.max_concurrent))
+    LOG.info('event=server_started, host=%s, port=%d', args.host, httpd.server_port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+
+import argparse
+import sys
+import unicodedata
+
+# https://en.wikipedia.org/wiki/GSM_03.38 basic character set, without the escape character
+GSM_BASIC_CHARSET = ("@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+                     "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà")
+
+# Extended table characters are sent as an escape plus a character, so they cost two septets
+GSM_EXTENDED_CHARSET = "^{}\\[~]|€\f"
+
+GSM_CHARSET = frozenset(GSM_BASIC_CHARSET + GSM_EXTENDED_CHARSET)
+
+# Septets per part of a single and of a concatenated GSM-7 message
+GSM_SINGLE_SEPTETS = 160
+GSM_PART_SEPTETS = 153
+
+# UTF-16 code units per part of a single and of a concatenated UCS-2 message
+UCS2_SINGLE_UNITS = 70
+UCS2_PART_UNITS = 67
+
+TRANSLITERATIONS = {
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'", "\u2032": "'", "`": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u2033": '"', "\u00ab": '"', "\u00bb": '"',
+    "\u2010": "-", "\u2011": "-", "\u2012": "-", "\u2013": "-", "\u2014": "-", "\u2212": "-",
+    "\u2026": "...", "\u2022": "-", "\u00b7": "-", "\u00b0": " deg",
+    "\u00a0": " ", "\u2009": " ", "\u202f": " ", "\u00ad": "", "\u200b": "", "\t": " ",
+    "\u00bd": "1/2", "\u00bc": "1/4", "\u00be": "3/4",
+}
+
+
+class GsmTable(dict):
+    """str.translate table that maps each character to its GSM-7 form the first time it is seen.
+    Characters with no GSM-7 form are dropped"""
+
+    def __missing__(self, ordinal):
+        char = chr(ordinal)
+        if char in GSM_CHARSET:
+            replacement = char
+        elif char in TRANSLITERATIONS:
+            replacement = TRANSLITERATIONS[char]
+        else:
+            # Strip accents that GSM-7 has no letter for, like á -> a
+            decomposed = unicodedata.normalize('NFKD', char)
+            replacement = "".join(c for c in decomposed if c in GSM_CHARSET
+                                  and not unicodedata.combining(c))
+        self[ordinal] = replacement if replacement else None
+        return self[ordinal]
+
+
+GSM_TABLE = GsmTable()
+
+
+def to_gsm7(text):
+    return text.translate(GSM_TABLE)
+
+
+def has_gsm7_form(text):
+    """Whether transliterating text only drops characters that carry nothing, like soft hyphens"""
+    return all(GSM_TABLE[ord(c)] is not None or c in TRANSLITERATIONS for c in set(text))
+
+
+def to_sms_text(text):
+    """Transliterates text to GSM-7 when every character has a GSM-7 form. Otherwise the text is
+    kept as it is and sent as UCS-2, so letters like Cyrillic are not silently dropped"""
+    return to_gsm7(text) if has_gsm7_form(text) else text
+
+
+def is_gsm7(text):
+    return GSM_CHARSET.issuperset(text)
+
+
+def septet_count(text):
+    return len(text) + sum(text.count(c) for c in GSM_EXTENDED_CHARSET if c in text)
+
+
+def ucs2_units(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def message_size(text):
+    """Returns (encoding, size, single_capacity, part_capacity) of a message body"""
+    if is_gsm7(text):
+        return 'GSM-7', septet_count(text), GSM_SINGLE_SEPTETS, GSM_PART_SEPTETS
+    return 'UCS-2', ucs2_units(text), UCS2_SINGLE_UNITS, UCS2_PART_UNITS
+
+
+def part_capacity(text):
+    """Size budget of one part of a concatenated message in text's encoding"""
+    return message_size(text)[3]
+
+
+def fits_in_part(text):
+    _, size, _, capacity = message_size(text)
+    return size <= capacity
+
+
+def fits_in_one_sms(text):
+    _, size, capacity, _ = message_size(text)
+    return size <= capacity
+
+
+def character_size(char, encoding):
+    if encoding == 'GSM-7':
+        return 2 if char in GSM_EXTENDED_CHARSET else 1
+    return 2 if ord(char) > 0xffff else 1
+
+
+def count_sms(text):
+    """Number of sms a message body is billed as. An escaped GSM-7 character or a UTF-16
+    surrogate pair is never split between parts, so a part may hold one unit less"""
+    encoding, size, single_capacity, capacity = message_size(text)
+    if size <= single_capacity:
+        return 1 if text else 0
+    parts, used = 1, 0
+    for char in text:
+        char_size = character_size(char, encoding)
+        if used + char_size > capacity:
+            parts, used = parts + 1, 0
+        used += char_size
+    return parts
+
+
+def truncate(text, size, pad="..."):
+    """Shortens text to at most size units of its encoding, ending with pad"""
+    encoding, text_size, _, _ = message_size(text)
+    if text_size <= size:
+        return text
+    budget = size - sum(character_size(c, encoding) for c in pad)
+    used = 0
+    for index, char in enumerate(text):
+        used += character_size(char, encoding)
+        if used > budget:
+            return text[:index] + pad
+    return text
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.parse_args()
+
+    text = sys.stdin.read()
+    encoding, size, _, _ = message_size(text)
+    sms_text = to_sms_text(text)
+    sms_encoding, sms_size, _, _ = message_size(sms_text)
+    print("original:     {} {} units, {} sms".format(encoding, size, count_sms(text)))
+    print("sent as:      {} {} units, {} sms".format(sms_encoding, sms_size, count_sms(sms_text)))
@@ -0,0 +1,346 @@
+#! /usr/bin/env python3
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from forecast_archive import archive_backend
+from inreach import DeliveryLog, backoff_seconds, send_inreach_response_segment, \
+    extract_base_url_from_reply_url, extract_guuid_from_reply_url, \
+    extract_reply_address_from_reply_url
+from interpreter import changes_segments
+from tracing import span, annotate
+from transport import request
+from utils import logger, Data
+
+LOG = logger(__name__)
+
+# Either s3://bucket/prefix or a local directory, holding <zone_id>.json per zone
+SUBSCRIPTION_STORE = os.environ.get('AVYSMS_SUBSCRIPTION_STORE',
+                                    's3://avysms-forecast/subscriptions')
+
+# Either s3://bucket/prefix or a local directory, holding an empty object per segment pushed
+PUSH_LOG_STORE = os.environ.get('AVYSMS_PUSH_LOG_STORE', 's3://avysms-forecast/pushed')
+
+FANOUT_BATCH_SIZE = int(os.environ.get('AVYSMS_FANOUT_BATCH_SIZE', 500))
+
+FANOUT_MAX_IN_FLIGHT = int(os.environ.get('AVYSMS_FANOUT_MAX_IN_FLIGHT', 16))
+
+FANOUT_MAX_ATTEMPTS = int(os.environ.get('AVYSMS_FANOUT_MAX_ATTEMPTS', 3))
+
+TWILIO_API_URL = os.environ.get('AVYSMS_TWILIO_API_URL', 'https://api.twilio.com')
+
+# Messages per second allowed by the sending number or messaging service, with a burst of the same
+TWILIO_MESSAGES_PER_SECOND = float(os.environ.get('AVYSMS_TWILIO_MESSAGES_PER_SECOND', 30))
+
+INREACH_MESSAGES_PER_SECOND = float(os.environ.get('AVYSMS_INREACH_MESSAGES_PER_SECOND', 5))
+
+
+class Subscription(Data):
+    """A subscriber of a zone. address is the phone number for sms and the reply url of the
+    subscriber's conversation for inreach. With changes only what changed since the previous
+    forecast is pushed"""
+
+    def __init__(self, subscriber_id, zone_id, channel, address, joined=True, changes=False):
+        self.subscriber_id = subscriber_id
+        self.zone_id = zone_id
+        self.channel = channel
+        self.address = address
+        self.joined = joined
+        self.changes = changes
+
+
+class SubscriptionStore(object):
+    """Keeps each zone's subscriptions in one json object. Updates read, modify and write the whole
+    object, so they must not run concurrently for a zone"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def key(zone_id):
+        return "{}.json".format(zone_id)
+
+    def subscriptions(self, zone_id):
+        body = self.backend.get(self.key(zone_id))
+        if body is None:
+            return []
+        return [Subscription(**s) for s in json.loads(body.decode('utf-8'))['subscriptions']]
+
+    def write(self, zone_id, subscriptions):
+        body = json.dumps({'zone_id': zone_id, 'subscriptions': [dict(s) for s in subscriptions]},
+                          separators=(',', ':'))
+        self.backend.put(self.key(zone_id), body.encode('utf-8'), 'application/json')
+
+    def subscribe(self, subscription):
+        subscriptions = [s for s in self.subscriptions(subscription.zone_id)
+                         if s.subscriber_id != subscription.subscriber_id]
+        self.write(subscription.zone_id, subscriptions + [subscription])
+        LOG.info('event=subscribed, zone_id=%s, subscriber_id=%s, channel=%s',
+                 subscription.zone_id, subscription.subscriber_id, subscription.channel)
+
+    def unsubscribe(self, zone_id, subscriber_id):
+        subscriptions = self.subscriptions(zone_id)
+        remaining = [s for s in subscriptions if s.subscriber_id != subscriber_id]
+        if len(remaining) != len(subscriptions):
+            self.write(zone_id, remaining)
+            LOG.info('event=unsubscribed, zone_id=%s, subscriber_id=%s', zone_id, subscriber_id)
+        return len(remaining) != len(subscriptions)
+
+
+def open_subscriptions(store=None):
+    return SubscriptionStore(archive_backend(store or SUBSCRIPTION_STORE))
+
+
+class TokenBucket(object):
+    """Lets rate calls a second through on average, and up to burst at once after a quiet period.
+    acquire blocks until a token is available. A rate of None does not limit"""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, returning the seconds spent waiting for it"""
+        if not self.rate:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+
+class TwilioProvider(object):
+    """Sends sms through the Twilio messages api"""
+
+    def __init__(self, account_sid, auth_token, from_number, api_url=TWILIO_API_URL,
+                 rate_limiter=None):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.url = "{}/2010-04-01/Accounts/{}/Messages.json".format(api_url, account_sid)
+        self.rate_limiter = rate_limiter or TokenBucket(TWILIO_MESSAGES_PER_SECOND)
+
+    def send(self, address, segment):
+        """Returns (success, status, retryable) like inreach.send_inreach_response_segment"""
+        payload = {'To': address, 'From': self.from_number, 'Body': segment}
+        try:
+            response = request('twilio', 'POST', self.url, data=payload,
+                               auth=(self.account_sid, self.auth_token))
+        except Exception as e:
+            LOG.warning('event=twilio_send_error, error=%s', repr(e))
+            return False, None, True
+
+        if response.status_code in (200, 201):
+            return True, response.status_code, False
+        LOG.error('event=twilio_send_failed, status=%s, response=%s',
+                  response.status_code, response.text)
+        is_client_error = 400 <= response.status_code < 500 and response.status_code != 429
+        return False, response.status_code, not is_client_error
+
+
+class InReachProvider(object):
+    """Replies into the inreach conversation the subscriber signed up from"""
+
+    def __init__(self, rate_limiter=None):
+        self.rate_limiter = rate_limiter or TokenBucket(INREACH_MESSAGES_PER_SECOND)
+
+    def send(self, address, segment):
+        return send_inreach_response_segment(
+            extract_base_url_from_reply_url(address), extract_reply_address_from_reply_url(address),
+            extract_guuid_from_reply_url(address), segment)
+
+
+PROVIDERS = None
+
+PROVIDERS_LOCK = threading.Lock()
+
+
+def providers():
+    """Returns the providers by channel, created once so every zone shares their rate limits"""
+    global PROVIDERS
+    with PROVIDERS_LOCK:
+        if PROVIDERS is None:
+            PROVIDERS = {
+                'sms': TwilioProvider(os.environ.get('AVYSMS_TWILIO_ACCOUNT_SID', ''),
+                                      os.environ.get('AVYSMS_TWILIO_AUTH_TOKEN', ''),
+                                      os.environ.get('AVYSMS_TWILIO_FROM_NUMBER', '')),
+                'inreach': InReachProvider(),
+            }
+        return PROVIDERS
+
+
+class FanOutResult(Data):
+    def __init__(self, zone_id, forecast_date, subscribers=0, delivered=0, failed=0, skipped=0,
+                 messages=0, attempts=0, seconds=0.0):
+        self.zone_id = zone_id
+        self.forecast_date = forecast_date
+        self.subscribers = subscribers
+        self.delivered = delivered
+        self.failed = failed
+        self.skipped = skipped
+        self.messages = messages
+        self.attempts = attempts
+        self.seconds = seconds
+
+
+PUSH_LOG = None
+
+
+def open_push_log():
+    """Returns the log of pushes already accepted by a provider. It is kept in PUSH_LOG_STORE, so a
+    re-run of the cacher after a partial failure, in this container or a new one, does not send a
+    message twice"""
+    global PUSH_LOG
+    with PROVIDERS_LOCK:
+        if PUSH_LOG is None:
+            PUSH_LOG = DeliveryLog(archive_backend(PUSH_LOG_STORE))
+        return PUSH_LOG
+
+
+class RenderedMessages(object):
+    """The messages of one rendered forecast for each kind of subscription, each formatted once no
+    matter how many subscribers share it"""
+
+    def __init__(self, rendered):
+        self.rendered = rendered
+        self.messages = {}
+        self.lock = threading.Lock()
+
+    def for_subscription(self, subscription):
+        changes = subscription.changes and self.rendered.forecast is not None and \
+            self.rendered.previous_forecast is not None
+        variant = (bool(subscription.joined), changes)
+        with self.lock:
+            if variant not in self.messages:
+                segments = changes_segments(self.rendered, variant[0]) if changes \
+                    else self.rendered.segments(variant[0])
+                digest = hashlib.sha1("\n\n".join(segments).encode('utf-8')).hexdigest()
+                self.messages[variant] = (segments, digest)
+            return self.messages[variant]
+
+
+def push_to_subscriber(subscription, segments, digest, provider, max_attempts=FANOUT_MAX_ATTEMPTS,
+                       push_log=None, backoff=backoff_seconds, sleep=time.sleep):
+    """Sends the segments in order, stopping at the first that cannot be delivered so a subscriber
+    never gets a later part without the earlier ones. Returns (status, messages, attempts) where
+    status is 'delivered', 'skipped' or 'failed'"""
+    push_log = push_log or open_push_log()
+    guid = "{}:{}".format(subscription.subscriber_id, digest)
+    messages = attempts = 0
+    for index, segment in enumerate(segments):
+        if push_log.was_delivered(guid, index, segment):
+            continue
+        for attempt in range(1, max_attempts + 1):
+            provider.rate_limiter.acquire()
+            attempts += 1
+            success, status, retryable = provider.send(subscription.address, segment)
+            if success or not retryable:
+                break
+            if attempt < max_attempts:
+                sleep(backoff(attempt))
+        if not success:
+            LOG.error('event=push_failed, subscriber_id=%s, zone_id=%s, index=%d, status=%s',
+                      subscription.subscriber_id, subscription.zone_id, index, status)
+            return 'failed', messages, attempts
+        push_log.record(guid, index, segment)
+        messages += 1
+    return ('delivered' if messages > 0 else 'skipped'), messages, attempts
+
+
+def fan_out(rendered, subscriptions, channel_providers=None, batch_size=FANOUT_BATCH_SIZE,
+            max_in_flight=FANOUT_MAX_IN_FLIGHT, **kwargs):
+    """Pushes the rendered forecast to every subscription, batch by batch, with at most
+    max_in_flight subscribers being sent to at once. The providers' token buckets keep the send
+    rate under their limits. Extra keyword arguments go to push_to_subscriber"""
+    channel_providers = channel_providers or providers()
+    messages = RenderedMessages(rendered)
+    result = FanOutResult(rendered.zone_id, rendered.forecast_date, len(subscriptions))
+
+    def push(subscription):
+        provider = channel_providers.get(subscription.channel, None)
+        if provider is None:
+            LOG.error('event=push_unknown_channel, subscriber_id=%s, channel=%s',
+                      subscription.subscriber_id, subscription.channel)
+            return 'failed', 0, 0
+        try:
+            segments, digest = messages.for_subscription(subscription)
+            return push_to_subscriber(subscription, segments, digest, provider, **kwargs)
+        except Exception as e:
+            LOG.error('event=push_error, subscriber_id=%s, error=%s',
+                      subscription.subscriber_id, repr(e))
+            return 'failed', 0, 0
+
+    start = time.perf_counter()
+    with span('fan_out', rendered.zone_id), \
+            ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        for batch_start in range(0, len(subscriptions), batch_size):
+            batch = subscriptions[batch_start:batch_start + batch_size]
+            for status, sent, attempts in executor.map(push, batch):
+                setattr(result, status, getattr(result, status) + 1)
+                result.messages += sent
+                result.attempts += attempts
+            LOG.info('event=fan_out_batch, zone_id=%s, pushed=%d, subscribers=%d, failed=%d',
+                     rendered.zone_id, batch_start + len(batch), len(subscriptions),
+                     result.failed)
+        annotate(subscribers=len(subscriptions), segments=result.messages)
+    result.seconds = round(time.perf_counter() - start, 3)
+    LOG.info('event=fan_out_complete, %s', ", ".join(
+        "{}={}".format(name, value) for name, value in sorted(dict(result).items())))
+    return result
+
+
+def push_forecast(rendered, store=None, **kwargs):
+    """Pushes a newly published forecast to the zone's subscribers"""
+    subscriptions = open_subscriptions(store).subscriptions(rendered.zone_id)
+    if len(subscriptions) == 0:
+        return None
+    return fan_out(rendered, subscriptions, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manages zone subscriptions")
+    parser.add_argument("-s", "--store", default=SUBSCRIPTION_STORE)
+    subparsers = parser.add_subparsers(dest="command")
+    add = subparsers.add_parser("add")
+    add.add_argument("zone_id", type=int)
+    add.add_argument("channel", choices=('sms', 'inreach'))
+    add.add_argument("address")
+    add.add_argument("--subscriber-id")
+    add.add_argument("--unjoined", action="store_true")
+    add.add_argument("--changes", action="store_true")
+    remove = subparsers.add_parser("remove")
+    remove.add_argument("zone_id", type=int)
+    remove.add_argument("subscriber_id")
+    listing = subparsers.add_parser("list")
+    listing.add_argument("zone_id", type=int)
+    args = parser.parse_args()
+
+    store = open_subscriptions(args.store)
+    if args.command == "add":
+        store.subscribe(Subscription(args.subscriber_id or args.address, args.zone_id,
+                                     args.channel, args.address, not args.unjoined, args.changes))
+    elif args.command == "remove":
+        print(store.unsubscribe(args.zone_id, args.subscriber_id))
+    elif args.command == "list":
+        for subscription in store.subscriptions(args.zone_id):
+            print(subscription)
+    else:
+        parser.print_help()
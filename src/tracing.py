@@ -0,0 +1,210 @@
+#! /usr/bin/env python3
+
+import argparse
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from utils import logger, Data
+
+LOG = logger(__name__)
+
+EMF_NAMESPACE = os.environ.get('AVYSMS_EMF_NAMESPACE', 'avysms')
+
+# Records are printed to stdout, where the Lambda runtime hands them to CloudWatch. Off by default
+# outside Lambda so the command line tools keep their output clean
+EMIT_EMF = os.environ.get('AVYSMS_EMIT_EMF', '1' if 'AWS_LAMBDA_FUNCTION_NAME' in os.environ
+                          else '0') == '1'
+
+# Numeric span attributes published as metrics, with their CloudWatch units
+METRIC_UNITS = {
+    'duration_ms': 'Milliseconds',
+    'html_bytes': 'Bytes',
+    'segments': 'Count',
+    'zones': 'Count',
+    'subscribers': 'Count',
+    'degraded_fields': 'Count',
+}
+
+CURRENT_TRACE = contextvars.ContextVar('avysms_trace', default=None)
+
+CURRENT_SPAN = contextvars.ContextVar('avysms_span', default=None)
+
+
+class Span(Data):
+    def __init__(self, stage, zone_id=None, start_ms=0.0, duration_ms=0.0, attributes=None):
+        self.stage = stage
+        self.zone_id = zone_id
+        self.start_ms = start_ms
+        self.duration_ms = duration_ms
+        self.attributes = attributes if attributes is not None else {}
+
+
+class Trace(object):
+    """The spans of one request. Spans are appended from the worker threads of the request too"""
+
+    def __init__(self, route):
+        self.route = route
+        self.trace_id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def records(self, timestamp_ms=None):
+        timestamp_ms = timestamp_ms if timestamp_ms is not None else int(time.time() * 1000)
+        with self.lock:
+            return [emf_record(self, span, timestamp_ms) for span in self.spans]
+
+
+def emf_record(trace, span, timestamp_ms):
+    """Formats a span as a CloudWatch embedded metric format record, dimensioned by stage and by
+    stage and zone"""
+    record = {'route': trace.route, 'trace_id': trace.trace_id, 'stage': span.stage,
+              'duration_ms': round(span.duration_ms, 3)}
+    record.update(span.attributes)
+    dimensions = [['route', 'stage']]
+    if span.zone_id is not None:
+        record['zone_id'] = str(span.zone_id)
+        dimensions.append(['route', 'stage', 'zone_id'])
+    metrics = [{'Name': name, 'Unit': unit} for name, unit in METRIC_UNITS.items()
+               if name in record]
+    record['_aws'] = {
+        'Timestamp': timestamp_ms,
+        'CloudWatchMetrics': [{'Namespace': EMF_NAMESPACE, 'Dimensions': dimensions,
+                               'Metrics': metrics}]
+    }
+    return record
+
+
+def emit(records, stream=None):
+    stream = stream or sys.stdout
+    for record in records:
+        stream.write(json.dumps(record, sort_keys=True) + "\n")
+    stream.flush()
+
+
+@contextmanager
+def trace(route, sink=None):
+    """Collects the spans of everything run inside it. Nested calls join the outer trace. On exit
+    the records go to sink, a callable taking the list of records, or to stdout when EMF is on"""
+    current = CURRENT_TRACE.get()
+    if current is not None:
+        yield current
+        return
+
+    new_trace = Trace(route)
+    token = CURRENT_TRACE.set(new_trace)
+    try:
+        yield new_trace
+    finally:
+        CURRENT_TRACE.reset(token)
+        if sink is not None:
+            sink(new_trace.records())
+        elif EMIT_EMF:
+            emit(new_trace.records())
+
+
+@contextmanager
+def span(stage, zone_id=None, **attributes):
+    """Times the block as a stage of the current trace. Does nothing outside of a trace"""
+    current = CURRENT_TRACE.get()
+    if current is None:
+        yield None
+        return
+
+    new_span = Span(stage, zone_id, attributes=dict(attributes))
+    token = CURRENT_SPAN.set(new_span)
+    start = time.perf_counter()
+    try:
+        yield new_span
+    except Exception:
+        new_span.attributes['error'] = True
+        raise
+    finally:
+        new_span.start_ms = (start - current.started) * 1000
+        new_span.duration_ms = (time.perf_counter() - start) * 1000
+        CURRENT_SPAN.reset(token)
+        current.add(new_span)
+
+
+def annotate(**attributes):
+    """Adds attributes, e.g. cache_hit or html_bytes, to the innermost open span"""
+    current = CURRENT_SPAN.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def bind(function):
+    """Wraps function so it runs in the calling thread's trace, for handing work to a pool"""
+    context = contextvars.copy_context()
+
+    def internal(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return internal
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def aggregate(records, keys=('stage',)):
+    """Groups records by the given keys and returns {key tuple: {count, p50_ms, p95_ms, p99_ms}}"""
+    durations = {}
+    for record in records:
+        if all(key in record for key in keys):
+            group = tuple(record[key] for key in keys)
+            durations.setdefault(group, []).append(record['duration_ms'])
+    return {group: {'count': len(values),
+                    'p50_ms': round(percentile(values, 0.5), 3),
+                    'p95_ms': round(percentile(values, 0.95), 3),
+                    'p99_ms': round(percentile(values, 0.99), 3)}
+            for group, values in durations.items()}
+
+
+def read_records(lines):
+    """Picks the EMF records out of log lines, skipping everything else"""
+    records = []
+    for line in lines:
+        line = line.strip()
+        if not line.startswith('{'):
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if '_aws' in record and 'stage' in record:
+            records.append(record)
+    return records
+
+
+def format_aggregate(aggregated, keys):
+    lines = ["{:<40} {:>7} {:>10} {:>10} {:>10}".format(
+        "/".join(keys), "count", "p50_ms", "p95_ms", "p99_ms")]
+    for group, stats in sorted(aggregated.items()):
+        lines.append("{:<40} {:>7} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            "/".join(group), stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregates EMF span records from log files")
+    parser.add_argument("-z", "--by-zone", action="store_true")
+    parser.add_argument("logs", nargs='*')
+    args = parser.parse_args()
+
+    lines = []
+    for path in args.logs or ['-']:
+        with (sys.stdin if path == '-' else open(path, 'r')) as f:
+            lines.extend(f.readlines())
+    keys = ('stage', 'zone_id') if args.by_zone else ('stage',)
+    print(format_aggregate(aggregate(read_records(lines), keys), keys))
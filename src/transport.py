@@ -0,0 +1,198 @@
+#! /usr/bin/env python3
+
+import argparse
+import atexit
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from utils import logger, Data
+
+LOG = logger(__name__)
+
+USER_AGENT = 'avysms.com 1.0'
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('AVYSMS_BREAKER_FAILURE_THRESHOLD', 3))
+
+BREAKER_RESET_SECONDS = float(os.environ.get('AVYSMS_BREAKER_RESET_SECONDS', 30))
+
+
+class TransportPolicy(Data):
+    """How one call site talks http: connection pool size per host, default (connect, read)
+    timeout and the urllib3 retry settings applied inside the adapter"""
+
+    def __init__(self, pool_maxsize, timeout, retries=0, backoff_factor=0.0,
+                 status_forcelist=(), allowed_methods=('GET', 'HEAD')):
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = list(status_forcelist)
+        self.allowed_methods = list(allowed_methods)
+
+
+POLICIES = {
+    # Every zone may be downloaded at once by the cacher. CAIC GETs are idempotent, so transient
+    # gateway errors are retried once here before the breaker counts a failure
+    'caic': TransportPolicy(pool_maxsize=int(os.environ.get('AVYSMS_MAX_CONCURRENT_ZONES', 10)),
+                            timeout=(3.05, 10), retries=1, backoff_factor=0.2,
+                            status_forcelist=(502, 503, 504)),
+    # Replies are POSTs retried by the inreach sender itself, so the adapter never retries them
+    'inreach': TransportPolicy(pool_maxsize=4, timeout=(3.05, 15), allowed_methods=()),
+    # Subscription pushes, sent by up to AVYSMS_FANOUT_MAX_IN_FLIGHT threads and retried by the
+    # fan-out itself
+    'twilio': TransportPolicy(pool_maxsize=int(os.environ.get('AVYSMS_FANOUT_MAX_IN_FLIGHT', 16)),
+                              timeout=(3.05, 10), allowed_methods=()),
+    # Rendered forecast reads are on the request path, so they give up quickly and fall back to
+    # the live pipeline. GETs are retried once on a throttle or a transient error, like boto3 does
+    's3': TransportPolicy(pool_maxsize=10, timeout=(1, 1.5), retries=1, backoff_factor=0.05,
+                          status_forcelist=(500, 503)),
+    'default': TransportPolicy(pool_maxsize=10, timeout=(3.05, 10)),
+}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """Opens after failure_threshold consecutive failures so callers fail fast instead of waiting
+    on timeouts. After reset_seconds one trial request is let through; its outcome closes the
+    breaker again or restarts the wait"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds=BREAKER_RESET_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if self.clock() - self.opened_at >= self.reset_seconds else 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self.trial_in_flight = False
+
+
+SESSIONS = {}
+
+BREAKERS = {}
+
+REGISTRY_LOCK = threading.Lock()
+
+
+def build_session(policy):
+    # Deferred so code paths that never make a request skip loading requests
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    class TimeoutAdapter(HTTPAdapter):
+        def send(self, request, timeout=None, **kwargs):
+            return super().send(request, timeout=timeout or policy.timeout, **kwargs)
+
+    retry_settings = dict(total=policy.retries, connect=policy.retries, read=policy.retries,
+                          status=policy.retries, backoff_factor=policy.backoff_factor,
+                          status_forcelist=policy.status_forcelist, raise_on_status=False)
+    try:
+        retry = Retry(allowed_methods=frozenset(policy.allowed_methods), **retry_settings)
+    except TypeError:
+        # urllib3 before 1.26 calls it method_whitelist
+        retry = Retry(method_whitelist=frozenset(policy.allowed_methods), **retry_settings)
+    adapter = TimeoutAdapter(pool_connections=4, pool_maxsize=policy.pool_maxsize,
+                             max_retries=retry)
+
+    session = requests.Session()
+    session.headers.update({'User-Agent': USER_AGENT})
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def session(call_site='default'):
+    """Returns the shared session for call_site, creating it on first use"""
+    with REGISTRY_LOCK:
+        if call_site not in SESSIONS:
+            if len(SESSIONS) == 0:
+                atexit.register(close_sessions)
+            SESSIONS[call_site] = build_session(POLICIES[call_site])
+        return SESSIONS[call_site]
+
+
+def breaker(url):
+    host = urlparse(url).netloc
+    with REGISTRY_LOCK:
+        if host not in BREAKERS:
+            BREAKERS[host] = CircuitBreaker()
+        return BREAKERS[host]
+
+
+def close_sessions():
+    with REGISTRY_LOCK:
+        for open_session in SESSIONS.values():
+            open_session.close()
+        SESSIONS.clear()
+
+
+def reset_breakers():
+    with REGISTRY_LOCK:
+        BREAKERS.clear()
+
+
+def request(call_site, method, url, **kwargs):
+    """Sends a request through the call site's session and the host's circuit breaker. Raises
+    CircuitOpenError without touching the network while the host's breaker is open. Connection
+    errors, timeouts and 5xx responses count as failures"""
+    host_breaker = breaker(url)
+    if not host_breaker.allow():
+        LOG.warning('event=circuit_open, call_site=%s, url=%s', call_site, url)
+        raise CircuitOpenError(urlparse(url).netloc)
+
+    try:
+        response = session(call_site).request(method, url, **kwargs)
+    except Exception:
+        host_breaker.record_failure()
+        raise
+
+    if response.status_code >= 500:
+        host_breaker.record_failure()
+    else:
+        host_breaker.record_success()
+    return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--call-site", default='default', choices=sorted(POLICIES))
+    parser.add_argument("url")
+    args = parser.parse_args()
+
+    response = request(args.call_site, 'GET', args.url)
+    print(response.status_code, len(response.content))
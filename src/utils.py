@@ -1,8 +1,5 @@
-import atexit
 import json
-import jsonpickle
 import logging
-import requests
 import sys
 import traceback
 
@@ -20,26 +17,6 @@ def logger(name):
 
 LOG = logger(__name__)
 
-REQUESTS_SESSION = None
-
-
-def close_requests_session():
-    global REQUESTS_SESSION
-    if REQUESTS_SESSION is not None:
-        REQUESTS_SESSION.close()
-        REQUESTS_SESSION = None
-
-
-def requests_session():
-    global REQUESTS_SESSION
-    if REQUESTS_SESSION is None:
-        atexit.register(close_requests_session)
-        REQUESTS_SESSION = requests.Session()
-        REQUESTS_SESSION.headers.update({
-            'User-Agent': 'avysms.com 1.0'
-        })
-    return REQUESTS_SESSION
-
 
 def is_not_None(obj):
     return obj is not None
@@ -58,16 +35,108 @@ def safe(safe_return_value=None, log=LOG):
     return wrap
 
 
+class ErrorReport(object):
+    """Collects the failures of one request instead of logging each where it happens. Only the
+    first failure at each site has its traceback formatted, later ones are just counted"""
+
+    def __init__(self):
+        self.sites = {}
+        self.degraded_fields = 0
+
+    def record(self, site, error):
+        self.degraded_fields += 1
+        entry = self.sites.get(site, None)
+        if entry is None:
+            entry = self.sites[site] = {
+                'count': 0,
+                'error': repr(error),
+                'traceback': traceback.format_exc().replace('\n', '->')
+            }
+        entry['count'] += 1
+
+    def log(self, log, event, **context):
+        context = "".join(", {}={}".format(key, value) for key, value in context.items())
+        for site, entry in self.sites.items():
+            log.error('event=%s_failed, site=%s, count=%d, error=%s, traceback=%s%s',
+                      event, site, entry['count'], entry['error'], entry['traceback'], context)
+        if self.degraded_fields > 0:
+            log.warning('event=%s_degraded, degraded_fields=%d, sites=%d%s',
+                        event, self.degraded_fields, len(self.sites), context)
+
+
+def attempt(report, site, default, function, *args):
+    """Calls function and returns default if it raises, recording the failure against site in
+    report. Without a report the failure is raised"""
+    if report is None:
+        return function(*args)
+    try:
+        return function(*args)
+    except Exception as e:
+        report.record(site, e)
+        return default
+
+
+def to_plain(value, tagged=False):
+    """Converts Data objects to dicts with sorted keys, tagging each with its py/object class name
+    like jsonpickle does when tagged is True"""
+    if isinstance(value, Data):
+        plain = {"py/object": type(value).__module__ + "." + type(value).__name__} if tagged else {}
+        state = value.state()
+        for name in sorted(state):
+            plain[name] = to_plain(state[name], tagged)
+        return plain
+    elif isinstance(value, dict):
+        return {str(k): to_plain(value[k], tagged) for k in sorted(value, key=str)}
+    elif isinstance(value, (list, tuple)):
+        return [to_plain(v, tagged) for v in value]
+    return value
+
+
+DATA_CLASSES = {}
+
+
+def from_plain(value):
+    """Inverse of to_plain with tagged=True. Tagged dicts are restored by setting each field on a
+    new instance of the registered class"""
+    if isinstance(value, dict):
+        cls = DATA_CLASSES.get(value.get("py/object"), None)
+        fields = {k: from_plain(v) for k, v in value.items() if k != "py/object"}
+        if cls is None:
+            return fields
+        obj = cls.__new__(cls)
+        for name, field in fields.items():
+            setattr(obj, name, field)
+        return obj
+    elif isinstance(value, list):
+        return [from_plain(v) for v in value]
+    return value
+
+
 class Data(object):
+    __slots__ = ()
+
+    # Slotted subclasses list the public attributes that make up their json here
+    FIELDS = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        DATA_CLASSES[cls.__module__ + "." + cls.__name__] = cls
+
+    def state(self):
+        if self.FIELDS is None:
+            return dict(vars(self))
+        return {name: getattr(self, name) for name in self.FIELDS}
+
     def __str__(self):
         return str(dict(self))
 
     def __iter__(self):
-        return iter(json.loads(jsonpickle.encode(self, unpicklable=False)).items())
+        return iter(to_plain(self).items())
 
     def to_json(self):
-        return jsonpickle.encode(self)
+        return json.dumps(to_plain(self, tagged=True))
 
     @staticmethod
     def from_json(json_str):
-        return jsonpickle.decode(json_str if not hasattr(json_str, 'read') else json_str.read())
+        json_str = json_str if not hasattr(json_str, 'read') else json_str.read()
+        return from_plain(json.loads(json_str))
@@ -0,0 +1,201 @@
+#! /usr/bin/env python3
+
+import argparse
+import re
+import sys
+from functools import lru_cache
+
+from utils import Data, logger
+
+LOG = logger(__name__)
+
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+
+# Tokens shorter than this are never spelling corrected, so words like "de" or "is" can't turn
+# into zone names
+MIN_FUZZY_TOKEN_LENGTH = 4
+
+# A corrected token shorter than this only counts as part of a zone name of several words whose
+# other words are spelled right, so "jaun" is a zone in "south san jaun" but "vial" is not Vail
+MIN_FUZZY_ALONE_LENGTH = 5
+
+# Tokens this long may be two edits from an alias token and may have any kind of typo
+LONG_TOKEN_LENGTH = 8
+
+# Endings a request token may add to an alias token: plurals, and "northern" or "southern". Any
+# other ending makes another word, like "frontier" or "flatter"
+ALIAS_TOKEN_ENDINGS = ("s", "ern")
+
+
+def max_edit_distance(token):
+    return 1 if len(token) < LONG_TOKEN_LENGTH else 2
+
+
+def is_likely_typo(token, word, distance):
+    """Whether token is word mistyped rather than another word. Short tokens only count when a
+    letter was left out or two were swapped, like "frnt" or "fornt". A changed or added letter
+    mostly makes an ordinary word instead, like "frost" or "stream", so those are left alone"""
+    if len(token) >= LONG_TOKEN_LENGTH:
+        return True
+    return distance == 1 and (len(token) < len(word) or sorted(token) == sorted(word))
+
+
+def is_alias_form(token, alias_token):
+    return token == alias_token or (token.startswith(alias_token)
+                                    and token[len(alias_token):] in ALIAS_TOKEN_ENDINGS)
+
+
+def tokenize(text):
+    return TOKEN_REGEX.findall(text.lower())
+
+
+def edit_distance(a, b):
+    """Levenshtein distance that also counts swapping two adjacent letters as one edit (optimal
+    string alignment), since "fornt" is a more common typo than a two letter substitution"""
+    before_previous, previous = None, list(range(len(b) + 1))
+    for i, a_char in enumerate(a, 1):
+        current = [i]
+        for j, b_char in enumerate(b, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1,
+                           previous[j - 1] + (a_char != b_char))
+            if i > 1 and j > 1 and a_char == b[j - 2] and a[i - 2] == b_char:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current.append(distance)
+        before_previous, previous = previous, current
+    return previous[-1]
+
+
+class BKTree(object):
+    """Burkhard-Keller tree of words for finding the words within an edit distance of a query"""
+
+    def __init__(self, words):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (word, {})
+                return
+            node = node[1][distance]
+
+    def search(self, word, max_distance):
+        """Returns (distance, word) pairs within max_distance of word, closest first"""
+        matches = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_word, children = nodes.pop()
+            distance = edit_distance(word, node_word)
+            if distance <= max_distance:
+                matches.append((distance, node_word))
+            nodes.extend(child for d, child in children.items()
+                         if distance - max_distance <= d <= distance + max_distance)
+        return sorted(matches)
+
+
+class ZoneMatch(Data):
+    def __init__(self, zone_id, alias, position, length, distance):
+        self.zone_id = zone_id
+        self.alias = alias
+        self.position = position
+        self.length = length
+        self.distance = distance
+
+    def rank(self):
+        return (self.distance, self.position, -self.length)
+
+
+class ZoneMatcher(object):
+    """Matches requests to zones with a trie over alias tokens. An alias token matches a request
+    token that is the alias token or its plural, and an alias of several words also matches them
+    run together, like "frontrange". Request tokens that match no alias token are spelling
+    corrected to the closest alias token before matching"""
+
+    def __init__(self, aliases):
+        aliases = list(aliases) + [("".join(tokenize(alias)), zone_id) for alias, zone_id in aliases
+                                   if len(tokenize(alias)) > 1]
+        self.trie = {}
+        for alias, zone_id in aliases:
+            node = self.trie
+            for token in tokenize(alias):
+                node = node.setdefault(token, {})
+            node.setdefault(None, (alias, zone_id))
+        self.vocabulary = sorted({t for alias, _ in aliases for t in tokenize(alias)})
+        self.bk_tree = BKTree(self.vocabulary)
+        self.correct = lru_cache(maxsize=4096)(self.correct_token)
+
+    def matches_vocabulary(self, token):
+        return any(is_alias_form(token, word) for word in self.vocabulary)
+
+    def correct_token(self, token):
+        """Returns (corrected_token, distance) for a request token. Corrections keep the first
+        letter, since typos rarely change it and words like "sail" or "danger" would otherwise
+        become zones"""
+        if len(token) < MIN_FUZZY_TOKEN_LENGTH or self.matches_vocabulary(token):
+            return token, 0
+        corrections = [(distance, word) for distance, word in
+                       self.bk_tree.search(token, max_edit_distance(token))
+                       if word[0] == token[0] and is_likely_typo(token, word, distance)]
+        return (corrections[0][1], corrections[0][0]) if corrections else (token, 0)
+
+    def matches_at(self, tokens, distances, position):
+        """Yields the aliases whose tokens match the request tokens starting at position. An alias
+        matched through a short corrected token needs another of its tokens spelled right"""
+        pending = [(self.trie, position, 0, 0, False)]
+        while pending:
+            node, end, distance, exact, short_correction = pending.pop()
+            if None in node and (exact > 0 or not short_correction):
+                alias, zone_id = node[None]
+                yield ZoneMatch(zone_id, alias, position, end - position, distance)
+            if end == len(tokens):
+                continue
+            token, original = tokens[end]
+            for alias_token, child in node.items():
+                if alias_token is not None and is_alias_form(token, alias_token):
+                    corrected = distances[end] > 0
+                    pending.append((child, end + 1, distance + distances[end],
+                                    exact + (not corrected), short_correction or (
+                                        corrected and len(original) < MIN_FUZZY_ALONE_LENGTH)))
+
+    def rank(self, request):
+        """Returns every zone mentioned in the request, best match first. Matches are taken left to
+        right, longest first, so "south san juan" does not also match "san juan"."""
+        originals = tokenize(request)
+        corrected = [self.correct(token) for token in originals]
+        tokens = [(token, original) for (token, _), original in zip(corrected, originals)]
+        distances = [distance for _, distance in corrected]
+        best = {}
+        position = 0
+        while position < len(tokens):
+            matches = sorted(self.matches_at(tokens, distances, position),
+                             key=lambda m: (-m.length, m.distance))
+            if not matches:
+                position += 1
+                continue
+            match = matches[0]
+            if match.zone_id not in best or match.rank() < best[match.zone_id].rank():
+                best[match.zone_id] = match
+            position += match.length
+        return sorted(best.values(), key=lambda m: m.rank())
+
+    def match(self, request):
+        return next(iter(self.rank(request)), None)
+
+
+if __name__ == "__main__":
+    from interpreter import CAIC_ZONE_MATCHES_TO_IDS
+
+    parser = argparse.ArgumentParser()
+    parser.parse_args()
+
+    matcher = ZoneMatcher(CAIC_ZONE_MATCHES_TO_IDS)
+    for line in sys.stdin:
+        print([dict(m) for m in matcher.rank(line)])
@@ -2,6 +2,7 @@ import unittest
 
 from aws_lambda import entrypoint
 from aws_lambda_email import email_handler
+from importtime_report import measure_imports, ROUTES
 
 
 class TestForecastToText(unittest.TestCase):
@@ -19,6 +20,13 @@ class TestForecastToText(unittest.TestCase):
         self.assertIn('This is an automated service', response["body"])
         self.assertIn('Sangre de Cristo', response["body"])
 
+    def test_sms___help_text_cold_start__skips_heavy_imports(self):
+        imports = measure_imports(ROUTES['sms_help'])
+
+        self.assertIn('aws_lambda_sms', imports)
+        for module in ['boto3', 'botocore', 'bs4', 'aws_lambda_email']:
+            self.assertNotIn(module, imports)
+
     def test_sms___request_has_zone__returns_forecast(self):
         event = {
             "queryStringParameters": {
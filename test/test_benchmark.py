@@ -0,0 +1,30 @@
+import unittest
+
+from benchmark import find_regressions, percentile, run_benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(95, percentile(values, 0.95))
+        self.assertEqual(100, percentile(values, 1))
+        self.assertEqual(1, percentile([1], 0.95))
+
+    def test_find_regressions__stage_slower_than_threshold__reported(self):
+        baseline = {"parse_forecast": {"mean_ms": 10.0}, "format_segments": {"mean_ms": 0.02}}
+        results = {"parse_forecast": {"mean_ms": 16.0}, "format_segments": {"mean_ms": 0.05},
+                   "interpret": {"mean_ms": 100.0}}
+
+        self.assertEqual([("parse_forecast", 16.0, 10.0)], find_regressions(results, baseline))
+        self.assertEqual([], find_regressions(results, baseline, threshold=2))
+
+    def test_run_benchmark__fixture__measures_every_stage_offline(self):
+        results = run_benchmark(['./test/fixtures/sangre.html'], iterations=1)
+
+        self.assertEqual(['parse_forecast', 'forecast_to_segments', 'format_segments',
+                          'interpret'], list(results))
+        self.assertTrue(all(r["samples"] == 1 and r["peak_kib"] > 0 for r in results.values()))
@@ -0,0 +1,95 @@
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import caic_cacher
+import rendered_store
+from caic_cacher import update_cache, cache_html
+from forecast_archive import open_archive
+from rendered_store import RenderedForecast
+
+
+class TestCaicCacher(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.store = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store.cleanup)
+        self.archive = open_archive(self.store.name)
+        patcher = mock.patch.object(caic_cacher, 'forecast_archive', return_value=self.archive)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(rendered_store, 'RENDERED_STORE', self.store.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.publish_rendered = mock.Mock(wraps=rendered_store.publish_rendered)
+        patcher = mock.patch.object(caic_cacher, 'publish_rendered', self.publish_rendered)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.push_forecast = mock.Mock()
+        patcher = mock.patch.object(caic_cacher, 'push_forecast', self.push_forecast)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def slow_download_html(zone_id):
+        time.sleep(0.2)
+        if zone_id == 3:
+            raise Exception("CAIC is down for zone 3")
+        return "html for {}".format(zone_id)
+
+    def test_update_cache__slow_zones__downloaded_concurrently_with_failures_isolated(self):
+        start = time.perf_counter()
+        with mock.patch.object(caic_cacher, 'download_html', self.slow_download_html):
+            results = update_cache(range(0, 10), max_workers=10)
+
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(["html for {}".format(z) if z != 3 else None for z in range(0, 10)],
+                         results)
+        self.assertEqual(9, len([z for z in range(0, 10) if self.archive.index(z)]))
+        self.assertEqual(9, self.publish_rendered.call_count)
+
+    def test_cache_html__unchanged_page__archived_once(self):
+        pages = iter(["page one", "page one", "page two", "page one"])
+        with mock.patch.object(caic_cacher, 'download_html', lambda zone_id: next(pages)):
+            for _ in range(4):
+                cache_html(9)
+
+        digests = [digest for _, digest in open_archive(self.store.name).index(9)]
+        self.assertEqual(3, len(digests))
+        self.assertEqual(digests[0], digests[2])
+        self.assertEqual(["page one", "page two"], [self.archive.load(d) for d in digests[:2]])
+
+    def test_cache_html__page_changed__pushed_to_subscribers_once(self):
+        pages = iter(["page one", "page one", "page two"])
+        with mock.patch.object(caic_cacher, 'download_html', lambda zone_id: next(pages)):
+            for _ in range(3):
+                cache_html(9)
+
+        self.assertEqual(2, self.push_forecast.call_count)
+        self.assertEqual(9, self.push_forecast.call_args[0][0].zone_id)
+
+    def test_cache_html__only_ads_and_timestamps_changed__not_pushed(self):
+        pages = iter(["page one<!-- rendered 10:00 -->", "page one<!-- rendered 10:05 -->",
+                      "page one<script>ad(2)</script>"])
+        with mock.patch.object(caic_cacher, 'download_html', lambda zone_id: next(pages)):
+            for _ in range(3):
+                cache_html(9)
+
+        # Archived and pushed once
+        self.assertEqual(1, len(open_archive(self.store.name).index(9)))
+        self.assertEqual(1, self.push_forecast.call_count)
+
+    def test_cache_html__same_html_new_forecast_date__pushed(self):
+        forecasts = iter(["Sat, Mar 16, 2019 at 6:00 AM", "Sat, Mar 16, 2019 at 4:10 PM"])
+
+        def render_zone(zone_id, html):
+            return RenderedForecast(zone_id, time.time(), next(forecasts), [], [],
+                                    html_key="same")
+        with mock.patch.object(caic_cacher, 'download_html', lambda zone_id: "page"), \
+                mock.patch.object(caic_cacher, 'render_zone', render_zone):
+            cache_html(9)
+            cache_html(9)
+
+        self.assertEqual(2, self.push_forecast.call_count)
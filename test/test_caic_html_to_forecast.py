@@ -1,11 +1,15 @@
 import json
+import traceback
 import unittest
+from unittest import mock
 
 from bs4 import BeautifulSoup
 
 from test.utils import read_file
-from caic_html_to_forecast import parse_forecast, parse_problem_type, PROBLEM_TYPE_ID_TO_TYPE
+from caic_html_to_forecast import parse_forecast, parse_problem_type, PROBLEM_TYPE_ID_TO_TYPE, \
+    available_parser_backends, extract_forecast_regions, HtmlIndex
 from forecast import Forecast
+from utils import ErrorReport
 
 
 class TestCaicHtmlToForecast(unittest.TestCase):
@@ -25,6 +29,78 @@ class TestCaicHtmlToForecast(unittest.TestCase):
             read_file('./test/fixtures/unknownrating.json')))
         self.assertEqual(expected_forecast, actual_forecast)
 
+    def test_parse_forecast__every_parser_backend__parses_identical_forecasts(self):
+        for fixture in ['sangre', 'unknownrating', 'deeppersistentslab']:
+            html = read_file('./test/fixtures/{}.html'.format(fixture))
+            expected_forecast = dict(Forecast.from_json(
+                read_file('./test/fixtures/{}.json'.format(fixture))))
+            for parser_backend in available_parser_backends():
+                with self.subTest(fixture=fixture, parser_backend=parser_backend):
+                    actual_forecast = dict(parse_forecast(html, parser_backend=parser_backend))
+                    self.assertEqual(expected_forecast, actual_forecast)
+
+    def test_parse_forecast__broken_roses__one_traceback_per_failure_site(self):
+        html = read_file('./test/fixtures/deeppersistentslab.html') \
+            .replace('class="ProblemRose"', 'class="ChangedRose"')
+        report = ErrorReport()
+
+        with mock.patch('traceback.format_exc', wraps=traceback.format_exc) as format_exc:
+            forecast = parse_forecast(html, report=report)
+
+        problem_count = len(forecast.problems)
+        self.assertGreater(problem_count, 0)
+        self.assertEqual(['problem.rose'], list(report.sites))
+        self.assertEqual(problem_count, report.degraded_fields)
+        self.assertEqual(1, format_exc.call_count)
+        for problem in forecast.problems:
+            self.assertEqual(set(a for e in problem.rose.values() for a in e.values()), {None})
+
+    def test_parse_forecast__broken_page__logs_each_site_once(self):
+        html = read_file('./test/fixtures/deeppersistentslab.html') \
+            .replace('class="ProblemRose"', 'class="ChangedRose"') \
+            .replace('size-graphic', 'changed-graphic')
+
+        with self.assertLogs('caic_html_to_forecast', level='WARNING') as logs:
+            parse_forecast(html)
+
+        self.assertEqual(2, len([line for line in logs.output if 'parse_forecast_failed' in line]))
+        degraded, = [line for line in logs.output if 'parse_forecast_degraded' in line]
+        self.assertIn('sites=2', degraded)
+
+    def test_extract_forecast_regions__unknown_layout__returns_None(self):
+        self.assertIsNone(extract_forecast_regions('<div class="avalanche-warning"></div>'))
+        self.assertIsNone(extract_forecast_regions('<div id="avalanche-forecast"><div></div>'))
+
+    def test_html_index__nested_lookup__only_returns_descendants(self):
+        html_root = BeautifulSoup(
+            '<div id="a" class="on"><div id="b"><p class="on">1</p></div></div>'
+            '<p class="on">2</p>', 'html.parser')
+        index = HtmlIndex(html_root)
+
+        self.assertEqual(['div', 'p', 'p'],
+                         [t.name for t in index.find_all_class('on', html_root)])
+        self.assertEqual(['1'], [t.string for t in index.find_all_class('on', index.find_id('b'))])
+        self.assertEqual(['1'], [t.string for t in index.find_all_class('on', index.find_id('a'))])
+        self.assertIsNone(index.find_class('on', index.find_id('b'), name='div'))
+        with self.assertRaises(LookupError):
+            index.find_all_class('on', index.find_id('missing'))
+
+    def test_parse_forecast__no_forecast_container__nothing_taken_from_other_markup(self):
+        html = '<html><body><h2>Ad Header</h2>' \
+            '<table class="table-treeline"><tbody><tr>' \
+            '<td class="today-text above_danger_high">High</td></tr></tbody></table>' \
+            '<table class="table-persistent-slab"></table></body></html>'
+
+        for parser_backend in available_parser_backends():
+            with self.subTest(parser_backend=parser_backend):
+                forecast = parse_forecast(html, parser_backend=parser_backend,
+                                          report=ErrorReport())
+
+                self.assertIsNone(forecast.date)
+                self.assertIsNone(forecast.description)
+                self.assertEqual([], forecast.dangers)
+                self.assertEqual([], forecast.problems)
+
     def test_parse_problem_type__html_has_all_problem_types__all_parsed(self):
         problem_type_html_template = \
             '<div>' + \
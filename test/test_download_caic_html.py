@@ -0,0 +1,115 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from test.utils import read_file
+import download_caic_html
+from download_caic_html import download_html, HttpCache
+from local_stubs import CaicStubServer
+
+
+class TestDownloadCaicHtml(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.html = read_file('./test/fixtures/sangre.html')
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.http_cache = HttpCache(self.cache_dir.name)
+        self.server = CaicStubServer({9: self.html}).start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.cache_dir.cleanup()
+
+    def download(self, zone_id=9):
+        return download_html(zone_id, self.server.url_template, self.http_cache, timeout=(1, 1))
+
+    def test_download_html__repeated_download__sends_validators_and_serves_304_from_cache(self):
+        first = self.download()
+        second = self.download()
+
+        self.assertEqual(self.html, first)
+        self.assertEqual(self.html, second)
+        first_headers, second_headers = [r[2] for r in self.server.requests]
+        self.assertNotIn('If-None-Match', first_headers)
+        self.assertIn('If-None-Match', second_headers)
+        self.assertIn('If-Modified-Since', second_headers)
+        self.assertEqual([200, 304], self.server.statuses)
+
+    def test_download_html__page_changes__returns_new_page(self):
+        self.download()
+        self.server.set_page(9, "<html>new forecast</html>")
+
+        self.assertEqual("<html>new forecast</html>", self.download())
+        self.assertEqual("<html>new forecast</html>", self.download())
+
+    def test_download_html__no_cache__sends_unconditional_requests(self):
+        download_html(9, self.server.url_template, None)
+        download_html(9, self.server.url_template, None)
+
+        self.assertTrue(all('If-None-Match' not in r[2] for r in self.server.requests))
+
+    def test_download_html__no_validators__cached_page_served_when_caic_is_down(self):
+        with CaicStubServer({9: self.html}, validators=False) as server:
+            first = download_html(9, server.url_template, self.http_cache, timeout=(1, 1))
+            second = download_html(9, server.url_template, self.http_cache, timeout=(1, 1))
+        down = download_html(9, server.url_template, self.http_cache, timeout=(1, 1))
+
+        self.assertEqual([self.html] * 3, [first, second, down])
+        self.assertTrue(all('If-None-Match' not in r[2] and 'If-Modified-Since' not in r[2]
+                            for r in server.requests))
+        self.assertEqual([200, 200], server.statuses)
+
+    def age_cache(self, zone_id, seconds):
+        path = self.http_cache.path(zone_id)
+        with open(path) as f:
+            entry = json.load(f)
+        entry['fetched_at'] -= seconds
+        with open(path, 'w') as f:
+            json.dump(entry, f)
+
+    def test_download_html__caic_down__stale_page_served_until_max_stale_age(self):
+        self.download()
+        self.server.stop()
+        self.age_cache(9, 60 * 60)
+
+        with self.assertLogs(download_caic_html.LOG, 'WARNING') as logs:
+            stale = download_html(9, self.server.url_template, self.http_cache, timeout=(1, 1),
+                                  max_stale_seconds=2 * 60 * 60)
+        self.assertEqual(self.html, stale)
+        self.assertIn('age_seconds=3600', logs.output[0])
+
+        self.age_cache(9, 2 * 60 * 60)
+        with self.assertRaises(Exception):
+            download_html(9, self.server.url_template, self.http_cache, timeout=(1, 1),
+                          max_stale_seconds=2 * 60 * 60)
+
+    def test_download_html__not_modified__cached_page_confirmed_fresh(self):
+        self.download()
+        self.age_cache(9, 60 * 60)
+
+        self.download()
+
+        validators, _ = self.http_cache.load(9, self.server.url_template.format(9))
+        self.assertLess(time.time() - validators['fetched_at'], 60)
+
+    def test_store__concurrent_writers__body_always_paired_with_its_validators(self):
+        url = self.server.url_template.format(9)
+
+        def store_and_load(i):
+            response = mock.Mock(text="<html>{}</html>".format(i), headers={'ETag': str(i)})
+            self.http_cache.store(9, url, response)
+            validators, html = self.http_cache.load(9, url)
+            return "<html>{}</html>".format(validators['etag']) == html
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            self.assertTrue(all(executor.map(store_and_load, range(200))))
+        self.assertEqual(['9.json'], os.listdir(self.cache_dir.name))
+
+    def test_download_html__unknown_zone__raises(self):
+        with self.assertRaises(Exception):
+            self.download(zone_id=3)
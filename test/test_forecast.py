@@ -0,0 +1,44 @@
+import copy
+import unittest
+
+from test.utils import read_file
+from forecast import Forecast, Problem, ElevationType, AspectType
+
+
+class TestForecast(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+
+    def test_to_json__fixture_forecasts__round_trip_byte_for_byte(self):
+        for fixture in ['sangre', 'unknownrating', 'deeppersistentslab']:
+            with self.subTest(fixture=fixture):
+                expected_json = read_file('./test/fixtures/{}.json'.format(fixture)).strip()
+                self.assertEqual(expected_json, Forecast.from_json(expected_json).to_json())
+
+    def test_problem__rose__stored_as_24_bit_masks(self):
+        rose = {e.name: {a.name: False for a in AspectType} for e in ElevationType}
+        rose[ElevationType.AboveTreeline.name][AspectType.NE.name] = True
+        rose[ElevationType.BelowTreeline.name][AspectType.N.name] = True
+        rose[ElevationType.Treeline.name][AspectType.W.name] = None
+        problem = Problem(rose, 'WindSlab', 'Large', 'Likely')
+
+        self.assertEqual(1 << 17 | 1 << 0, problem.rose_mask)
+        self.assertEqual(1 << 14, problem.rose_unknown_mask)
+        self.assertEqual(rose, problem.rose)
+        self.assertFalse(hasattr(problem, '__dict__'))
+
+    def test_problem__accessors__match_rose(self):
+        forecast = Forecast.from_json(read_file('./test/fixtures/sangre.json'))
+        for problem in forecast.problems:
+            for elevation, aspects in problem.rose.items():
+                self.assertEqual([a for a in aspects if aspects[a]], problem.aspects(elevation))
+                for aspect, problematic in aspects.items():
+                    self.assertEqual(problematic, problem.is_problematic(elevation, aspect))
+
+    def test_problem__unparsed_fields__stay_None(self):
+        problem = copy.deepcopy(Problem(None, None, None, None))
+
+        self.assertEqual({'rose': None, 'problem_type': None, 'size': None, 'likelyhood': None},
+                         dict(problem))
+        self.assertEqual([], problem.aspects(ElevationType.Treeline.name))
@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from test.utils import read_file
+from forecast_archive import ForecastArchive, LocalArchiveBackend, S3ArchiveBackend, blob_key, \
+    index_key
+
+
+class TestForecastArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.store = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store.cleanup)
+        self.backend = LocalArchiveBackend(self.store.name)
+        self.archive = ForecastArchive(self.backend)
+        self.html = read_file('./test/fixtures/sangre.html')
+
+    def test_store__identical_page__not_written_again(self):
+        digest, changed = self.archive.store(9, self.html, timestamp=100)
+        with mock.patch.object(self.backend, 'put') as put:
+            same_digest, same_changed = self.archive.store(9, self.html, timestamp=200)
+
+        self.assertTrue(changed)
+        self.assertEqual((digest, False), (same_digest, same_changed))
+        put.assert_not_called()
+        self.assertEqual([[100, digest]], self.archive.index(9))
+
+    def test_store__only_ads_and_timestamps_changed__not_archived_again(self):
+        digest, _ = self.archive.store(9, self.html, timestamp=100)
+        page_with_ad = self.html.replace('<div id="avalanche-forecast">',
+                                         '<div id="avalanche-forecast"><!-- ad 2 -->', 1)
+        self.assertNotEqual(self.html, page_with_ad)
+
+        same_digest, changed = self.archive.store(9, page_with_ad, timestamp=200)
+
+        self.assertEqual((digest, False), (same_digest, changed))
+        self.assertEqual(self.html, self.archive.load(digest))
+
+    def test_store__blob__compressed_and_shared_between_zones(self):
+        digest, _ = self.archive.store(9, self.html, timestamp=100)
+        self.archive.store(1, self.html, timestamp=100)
+
+        blob_path = os.path.join(self.store.name, blob_key(digest))
+        self.assertLess(os.path.getsize(blob_path), len(self.html) / 3)
+        self.assertEqual(1, len(os.listdir(os.path.dirname(blob_path))))
+        self.assertEqual(self.html, self.archive.load(digest))
+
+    def test_index__reopened_archive__reads_index_not_blobs(self):
+        first, _ = self.archive.store(9, "first", timestamp=100)
+        second, _ = self.archive.store(9, "second", timestamp=200)
+
+        reopened = ForecastArchive(LocalArchiveBackend(self.store.name))
+
+        self.assertEqual([[100, first], [200, second]], reopened.index(9))
+        self.assertIsNone(reopened.digest_at(9, 99))
+        self.assertEqual(first, reopened.digest_at(9, 199))
+        self.assertEqual(second, reopened.digest_at(9, 200))
+        self.assertEqual("second", reopened.latest(9))
+        self.assertIsNone(reopened.latest(3))
+
+    def test_s3_backend__stores_under_prefix_without_list_calls(self):
+        client = mock.Mock()
+        client.get_object.return_value = {'Body': mock.Mock(read=lambda: b'{"entries":[]}')}
+        client.head_object.return_value = {}
+        archive = ForecastArchive(S3ArchiveBackend('bucket', 'archive', client))
+
+        digest, changed = archive.store(9, self.html, timestamp=100)
+
+        self.assertTrue(changed)
+        client.get_object.assert_called_once_with(Bucket='bucket', Key='archive/' + index_key(9))
+        client.head_object.assert_called_once_with(Bucket='bucket',
+                                                   Key='archive/' + blob_key(digest))
+        put_keys = [c[1]['Key'] for c in client.put_object.call_args_list]
+        self.assertEqual(['archive/' + index_key(9)], put_keys)
+        client.list_objects_v2.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from test.utils import read_file
+from forecast import Forecast, Zone
+from forecast_cache import ForecastCache, forecast_html_key
+
+
+class TestForecastCache(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.html = read_file('./test/fixtures/sangre.html')
+
+    def test_parse__repeated_html__parses_once(self):
+        cache = ForecastCache()
+        first = cache.parse(self.html)
+        second = cache.parse(self.html)
+
+        self.assertEqual(dict(Forecast.from_json(read_file('./test/fixtures/sangre.json'))),
+                         dict(second))
+        self.assertEqual(dict(first), dict(second))
+        self.assertIsNot(first, second)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_forecast_html_key__ads_and_timestamps_change__same_key(self):
+        changed_html = self.html.replace('</head>', '<script>var ad = 12345;</script></head>')
+        changed_html = changed_html.replace(
+            '<div id="avalanche-forecast">',
+            '<div id="avalanche-forecast"><!-- rendered at 07:41:02 -->')
+
+        self.assertNotEqual(self.html, changed_html)
+        self.assertEqual(forecast_html_key(self.html), forecast_html_key(changed_html))
+
+    def test_forecast_html_key__forecast_or_zone_changes__different_key(self):
+        changed_html = self.html.replace('Mon, Feb 18, 2019', 'Tue, Feb 19, 2019')
+
+        self.assertNotEqual(forecast_html_key(self.html), forecast_html_key(changed_html))
+        self.assertNotEqual(forecast_html_key(self.html),
+                            forecast_html_key(self.html, Zone.SangreDeCristo))
+
+    def test_parse__more_forecasts_than_max_entries__evicts_least_recently_used(self):
+        cache = ForecastCache(max_entries=2)
+        zones = [Zone.Aspen, Zone.Vail, Zone.Aspen, Zone.Sawatch, Zone.Aspen, Zone.Vail]
+        for zone in zones:
+            cache.parse(self.html, zone)
+
+        self.assertEqual(2, len(cache.forecasts))
+        self.assertEqual((2, 4), (cache.hits, cache.misses))
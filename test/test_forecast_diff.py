@@ -0,0 +1,130 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import caic_cacher
+import rendered_store
+from test.utils import read_file
+from forecast import Forecast
+from forecast_diff import diff_forecasts
+from forecast_to_segments import diff_to_segments
+from interpreter import interpret, render_zone
+from rendered_store import publish_rendered, read_rendered
+from serialization import to_compact, from_compact_json
+from sms_encoding import count_sms
+
+
+def fixture_forecast(name):
+    return Forecast.from_json(read_file('./test/fixtures/{}.json'.format(name)))
+
+
+class TestForecastDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+
+    def test_diff_forecasts__same_forecast__empty(self):
+        diff = diff_forecasts(fixture_forecast('sangre'), fixture_forecast('sangre'))
+
+        self.assertTrue(diff.is_empty())
+        self.assertEqual(["Mon, Feb 18, 2019 at 7:38 AM\nNo changes since Mon, Feb 18, 2019"],
+                         diff_to_segments(diff))
+
+    def test_diff_forecasts__dangers_problems_and_roses(self):
+        diff = diff_forecasts(fixture_forecast('sangre'), fixture_forecast('unknownrating'))
+
+        self.assertEqual([{'elevation': 'AboveTreeline', 'before': 'Considerable',
+                           'after': 'NoRating'}], diff.danger_changes)
+        self.assertEqual([], diff.problems_added)
+        self.assertEqual(['WindSlab'], diff.problems_removed)
+        self.assertEqual({'problem_type': 'PersistentSlab', 'elevation': 'AboveTreeline',
+                          'gained': [], 'lost': ['N', 'NE', 'E', 'SE', 'NW']},
+                         diff.rose_changes[-1])
+
+    def test_diff_forecasts__likelihood_and_size_of_a_continuing_problem(self):
+        before, after = fixture_forecast('sangre'), fixture_forecast('sangre')
+        after.problems[0].likelyhood = 'VeryLikely'
+        after.problems[1].size = 'LargeToVeryLarge'
+
+        diff = diff_forecasts(before, after)
+
+        self.assertEqual([{'problem_type': 'WindSlab', 'field': 'likelihood',
+                           'before': 'Likely', 'after': 'VeryLikely'},
+                          {'problem_type': 'PersistentSlab', 'field': 'size',
+                           'before': 'Large', 'after': 'LargeToVeryLarge'}], diff.problem_changes)
+        self.assertFalse(diff.is_empty())
+        self.assertEqual(["Wind slab: likely -> very likely",
+                          "Persistent slab: large -> large to very large"],
+                         diff_to_segments(diff)[1:])
+
+    def test_diff_to_segments__new_problems(self):
+        diff = diff_forecasts(fixture_forecast('unknownrating'),
+                              fixture_forecast('deeppersistentslab'))
+        segments = diff_to_segments(diff)
+
+        self.assertEqual("Changes since Sat, Mar 16, 2019", segments[0].splitlines()[1])
+        self.assertEqual("Danger changes\n  Near  TL: Considerable -> Moderate\n"
+                         "  Above TL: No rating -> Moderate", segments[1])
+        self.assertTrue(segments[2].startswith("New: Possible historic deep persistent slab"))
+        self.assertEqual("Ended: persistent slab", segments[-1])
+
+
+class TestInterpretChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.store = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store.cleanup)
+        patcher = mock.patch.object(rendered_store, 'RENDERED_STORE', self.store.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def publish(self, fixture, date=None):
+        html = read_file('./test/fixtures/{}.html'.format(fixture))
+        if date is not None:
+            html = html.replace(fixture_forecast(fixture).date, date)
+        caic_cacher.publish_rendered_zone(1, html, read_rendered(1))
+
+    def test_interpret__changes_keyword__only_the_delta_in_one_sms(self):
+        rendered = render_zone(1, read_file('./test/fixtures/unknownrating.html'))
+        previous = from_compact_json(rendered.forecast)
+        previous.date = "Fri, Mar 15, 2019 at 7:45 AM"
+        previous.dangers[1].danger_type = 'Moderate'
+        rendered.previous_forecast = to_compact(previous)
+        publish_rendered(rendered)
+
+        full = interpret("front", joined=False)
+        changes = interpret("Front changes", joined=False)
+
+        self.assertGreater(len(full), 1)
+        self.assertEqual(["Front Range - Sat, Mar 16, 2019 at 7:53 AM\n"
+                          "Changes since Fri, Mar 15, 2019\n\n"
+                          "Danger changes\n  Near  TL: Moderate -> Considerable"], changes)
+        self.assertEqual(1, count_sms(changes[0]))
+
+    def test_interpret__month_of_changes__delta_shorter_than_forecast(self):
+        self.publish('sangre')
+        self.publish('unknownrating')
+
+        changes = interpret("front changes", joined=False)
+
+        full = interpret("front", joined=False)
+        self.assertLess(sum(map(len, changes)), sum(map(len, full)))
+        self.assertIn("Ended: wind slab", "\n\n".join(changes))
+
+    def test_interpret__same_day_update__still_compared_to_previous_day(self):
+        self.publish('sangre')
+        self.publish('unknownrating')
+        self.publish('unknownrating', date="Sat, Mar 16, 2019 at 4:10 PM")
+
+        changes = interpret("front changes", True)[0]
+        self.assertIn("Front Range - Sat, Mar 16, 2019 at 4:10 PM", changes)
+        self.assertIn("Changes since Mon, Feb 18, 2019", changes)
+
+    def test_interpret__no_previous_forecast__full_forecast(self):
+        self.publish('sangre')
+
+        self.assertEqual(interpret("front", joined=True), interpret("front changes", joined=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from test.utils import read_file
+from forecast import Forecast
+from forecast_history import ForecastHistory, forecast_day
+
+
+def fixture_forecast(name, zone):
+    forecast = Forecast.from_json(read_file('./test/fixtures/{}.json'.format(name)))
+    forecast.zone = zone
+    return forecast
+
+
+class TestForecastHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = ForecastHistory.from_forecasts([
+            fixture_forecast('sangre', 'FrontRange'),
+            fixture_forecast('unknownrating', 'FrontRange'),
+            fixture_forecast('deeppersistentslab', 'FrontRange'),
+            fixture_forecast('sangre', 'Aspen'),
+        ])
+
+    def test_forecast_day(self):
+        self.assertEqual("2019-03-17", forecast_day("Sun, Mar 17, 2019 at 7:39 AM").isoformat())
+
+    def test_days_at_or_above(self):
+        self.assertEqual(1, self.history.days_at_or_above(
+            'FrontRange', 'AboveTreeline', 'Considerable'))
+        self.assertEqual(2, self.history.days_at_or_above(
+            'FrontRange', 'Treeline', 'Considerable'))
+        self.assertEqual(1, self.history.days_at_or_above(
+            'FrontRange', 'Treeline', 'Considerable', start='2019-03-01'))
+        self.assertEqual(0, self.history.days_at_or_above('Vail', 'Treeline', 'Low'))
+
+    def test_problem_days(self):
+        days = self.history.problem_days('PersistentSlab')
+
+        self.assertEqual(2, days['FrontRange'])
+        self.assertEqual(1, days['Aspen'])
+        self.assertEqual(0, days['Vail'])
+
+    def test_persistent_aspects__every_forecast_day_in_range(self):
+        aspects = self.history.persistent_aspects('FrontRange', 'PersistentSlab',
+                                                  end='2019-03-16')
+
+        self.assertEqual(['N', 'NE', 'E', 'SE', 'NW'], aspects['Treeline'])
+        self.assertEqual([], aspects['BelowTreeline'])
+        self.assertEqual({'BelowTreeline': [], 'Treeline': [], 'AboveTreeline': []},
+                         self.history.persistent_aspects('FrontRange', 'PersistentSlab'))
+
+    def test_save_and_load__memory_mapped__same_answers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.history.save(directory)
+            loaded = ForecastHistory.load(directory)
+
+            self.assertIsInstance(loaded.problems, np.memmap)
+            self.assertEqual(self.history.danger_series('FrontRange', 'AboveTreeline'),
+                             loaded.danger_series('FrontRange', 'AboveTreeline'))
+            self.assertEqual(self.history.problem_days('WindSlab'),
+                             loaded.problem_days('WindSlab'))
+
+    def test_queries__ten_seasons__answered_in_milliseconds(self):
+        days = np.arange('2010-01-01', '2020-01-01', dtype='datetime64[D]')
+        rng = np.random.default_rng(0)
+        history = ForecastHistory(
+            days, np.ones((10, len(days)), dtype=bool),
+            rng.integers(0, 3, size=(10, len(days), 7, 3, 8), dtype=np.uint8),
+            rng.integers(-1, 6, size=(10, len(days), 3), dtype=np.int8))
+
+        start = time.perf_counter()
+        history.days_at_or_above('FrontRange', 'AboveTreeline', 'Considerable', '2019-01-01')
+        history.problem_days('PersistentSlab', '2019-01-01', '2019-04-30')
+        history.persistent_aspects('FrontRange', 'PersistentSlab', '2019-02-01', '2019-02-28')
+
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,13 @@
 import jsonpickle
 import unittest
+from unittest import mock
+
+import forecast_to_segments as forecast_to_segments_module
 
 from test.utils import read_file
 from forecast import Forecast
 from forecast_to_segments import forecast_to_segments
+from utils import ErrorReport
 
 
 class TestForecastToSegments(unittest.TestCase):
@@ -24,3 +28,15 @@ class TestForecastToSegments(unittest.TestCase):
         self.assertEqual(
             jsonpickle.encode(expected_segments),
             jsonpickle.encode(actual_segments))
+
+    def test_forecast_to_segments__missing_elevation_names__degrades_with_placeholders(self):
+        forecast = Forecast.from_json(read_file('./test/fixtures/sangre.json'))
+        report = ErrorReport()
+
+        with mock.patch.dict(forecast_to_segments_module.ELEVATIONS_TO_TEXT, clear=True):
+            segments = forecast_to_segments(forecast, report)
+
+        self.assertEqual("Avalanche dangers", segments[1])
+        self.assertIn("  Error: ", segments[2])
+        self.assertEqual(['danger', 'rose.elevation_name'], sorted(report.sites))
+        self.assertEqual(3 + 3 * len(forecast.problems), report.degraded_fields)
@@ -3,7 +3,8 @@ import unittest
 
 from test.utils import read_file
 from forecast import Forecast
-from format_segments import format_segments
+from format_segments import format_segments, pack_segments, reduce_segments
+from sms_encoding import count_sms, fits_in_one_sms
 
 
 class TestFormatSegments(unittest.TestCase):
@@ -25,3 +26,31 @@ class TestFormatSegments(unittest.TestCase):
 
         self.assertEqual(1, len(segments))
         self.assertLess(len(segments[0]), len(segment_text))
+
+    def test_format_segments__oversized_block__split_into_single_sms_messages(self):
+        warning = " ".join("word{}".format(i) for i in range(100))
+        segments = format_segments(["Header", warning, "Footer"], joined=False)
+
+        self.assertTrue(all(count_sms(s) == 1 for s in segments))
+        self.assertTrue(segments[0].startswith("Header\n\nword0 "))
+        self.assertTrue(segments[-1].endswith("word99\n\nFooter"))
+        words = " ".join(segments).replace("\n\n", " ").split()
+        self.assertEqual(["Header"] + warning.split() + ["Footer"], words)
+
+    def test_pack_segments__fewer_messages_than_greedy(self):
+        blocks = ["a" * 100, "b" * 170, "c" * 100]
+
+        greedy = reduce_segments(blocks, fits_in_one_sms)
+        packed = pack_segments(blocks, fits_in_one_sms)
+
+        self.assertEqual(4, sum(map(count_sms, greedy)))
+        self.assertEqual(3, len(packed))
+        self.assertTrue(all(count_sms(s) == 1 for s in packed))
+        self.assertEqual("a" * 100 + "b" * 170 + "c" * 100,
+                         "".join(packed).replace("\n", ""))
+
+    def test_pack_segments__blocks_that_fit__never_split(self):
+        blocks = ["a" * 90, "b" * 90, "c" * 60]
+
+        self.assertEqual(["a" * 90, "b" * 90 + "\n\n" + "c" * 60],
+                         pack_segments(blocks, fits_in_one_sms))
@@ -0,0 +1,14 @@
+import unittest
+
+from importtime_report import ROUTES, DEFAULT_FORBIDDEN_MODULES, route_environment, \
+    measure_imports
+
+
+class TestImporttimeReport(unittest.TestCase):
+
+    def test_sms_forecast__answered_from_the_rendered_store__no_forbidden_imports(self):
+        with route_environment() as env:
+            imports = measure_imports(ROUTES['sms_forecast'], env)
+
+        self.assertIn('s3_reader', imports)
+        self.assertEqual([], [m for m in DEFAULT_FORBIDDEN_MODULES if m in imports])
@@ -0,0 +1,125 @@
+import tempfile
+import time
+import unittest
+
+from forecast_archive import LocalArchiveBackend
+from inreach import InReachResponse, DeliveryLog, send_inreach_response, backoff_seconds, \
+    INREACH_MAX_IN_FLIGHT
+from local_stubs import InReachStubServer
+from transport import reset_breakers
+
+
+def no_backoff(attempt):
+    return 0
+
+
+class TestInReach(unittest.TestCase):
+
+    def setUp(self):
+        self.segments = ["segment {}".format(i) for i in range(6)]
+        self.delivery_log = DeliveryLog()
+        reset_breakers()
+
+    def send(self, server, **kwargs):
+        response = InReachResponse(server.reply_url, "guid-1", "test@avysms.com", self.segments)
+        return send_inreach_response(response, delivery_log=self.delivery_log,
+                                     backoff=no_backoff, sleep=lambda s: None, **kwargs)
+
+    def test_send_inreach_response__all_segments_delivered_in_order(self):
+        with InReachStubServer() as server:
+            deliveries = self.send(server, max_in_flight=1)
+
+        self.assertEqual([("guid-1", s) for s in self.segments], server.messages)
+        self.assertTrue(all(d.delivered and d.attempts == 1 for d in deliveries))
+        self.assertEqual(list(range(6)), [d.index for d in deliveries])
+
+    def test_send_inreach_response__default__one_post_at_a_time(self):
+        self.assertEqual(1, INREACH_MAX_IN_FLIGHT)
+
+    def test_send_inreach_response__refused_before_processing__retried_until_delivered(self):
+        with InReachStubServer(failures=[503, 429, 503]) as server:
+            deliveries = self.send(server, max_in_flight=1)
+
+        self.assertEqual(self.segments, [m for _, m in server.messages])
+        self.assertEqual(4, deliveries[0].attempts)
+        self.assertEqual(9, len(server.requests))
+
+    def test_send_inreach_response__error_that_may_have_sent__not_retried(self):
+        with InReachStubServer(failures=[500]) as server:
+            deliveries = self.send(server, max_in_flight=1)
+
+        self.assertEqual((False, 1, 500), (deliveries[0].delivered, deliveries[0].attempts,
+                                           deliveries[0].status))
+        self.assertEqual(6, len(server.requests))
+
+    def test_send_inreach_response__read_timeout__not_retried(self):
+        self.segments = self.segments[:1]
+        with InReachStubServer(delay_seconds=0.3) as server:
+            deliveries = self.send(server, timeout=(1, 0.05))
+            time.sleep(0.4)
+
+        self.assertEqual((False, 1), (deliveries[0].delivered, deliveries[0].attempts))
+        self.assertEqual(1, len(server.requests))
+
+    def test_send_inreach_response__connection_refused__retried(self):
+        with InReachStubServer() as server:
+            pass
+        deliveries = self.send(server, max_attempts=2)
+
+        self.assertEqual((False, 2), (deliveries[0].delivered, deliveries[0].attempts))
+
+    def test_send_inreach_response__client_error__not_retried(self):
+        with InReachStubServer(failures=[400]) as server:
+            deliveries = self.send(server, max_in_flight=1)
+
+        self.assertFalse(deliveries[0].delivered)
+        self.assertEqual(1, deliveries[0].attempts)
+        self.assertEqual(400, deliveries[0].status)
+        self.assertEqual(self.segments[1:], [m for _, m in server.messages])
+
+    def test_send_inreach_response__attempts_exhausted__reports_failure(self):
+        with InReachStubServer(failures=[503] * 2) as server:
+            deliveries = self.send(server, max_in_flight=1, max_attempts=2)
+
+        self.assertFalse(deliveries[0].delivered)
+        self.assertEqual(2, deliveries[0].attempts)
+        self.assertEqual(self.segments[1:], [m for _, m in server.messages])
+
+    def test_send_inreach_response__resent__skips_delivered_segments(self):
+        with InReachStubServer(failures=[400]) as server:
+            self.send(server, max_in_flight=1)
+            deliveries = self.send(server, max_in_flight=1)
+
+        self.assertEqual(self.segments[1:] + self.segments[:1], [m for _, m in server.messages])
+        self.assertFalse(deliveries[0].skipped)
+        self.assertTrue(all(d.skipped and d.attempts == 0 for d in deliveries[1:]))
+
+    def test_send_inreach_response__durable_log__new_process_skips_delivered_segments(self):
+        with tempfile.TemporaryDirectory() as store, InReachStubServer(failures=[400]) as server:
+            self.delivery_log = DeliveryLog(LocalArchiveBackend(store))
+            self.send(server)
+            self.delivery_log = DeliveryLog(LocalArchiveBackend(store))
+            deliveries = self.send(server)
+
+        self.assertEqual(self.segments[1:] + self.segments[:1], [m for _, m in server.messages])
+        self.assertEqual([False] + [True] * 5, [d.skipped for d in deliveries])
+
+    def test_send_inreach_response__slow_endpoint__posts_overlap(self):
+        with InReachStubServer(delay_seconds=0.1) as server:
+            start = time.perf_counter()
+            deliveries = self.send(server, max_in_flight=3)
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(sorted(self.segments), sorted(m for _, m in server.messages))
+        self.assertTrue(all(d.latency_ms >= 100 for d in deliveries))
+        self.assertLess(elapsed, 0.5)
+
+    def test_backoff_seconds__grows_and_is_capped(self):
+        for attempt in range(1, 10):
+            delay = backoff_seconds(attempt, base=0.5, cap=4)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(4, 0.5 * 2 ** (attempt - 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
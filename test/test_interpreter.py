@@ -0,0 +1,107 @@
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import interpreter
+import rendered_store
+from test.utils import read_file
+from interpreter import interpret, render_zone
+from rendered_store import publish_rendered
+from format_segments import MAX_SEGMENTS
+from sms_encoding import count_sms
+
+
+class TestInterpreter(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.store = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store.cleanup)
+        patcher = mock.patch.object(rendered_store, 'RENDERED_STORE', self.store.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for zone_id in [1, 2, 9]:
+            publish_rendered(render_zone(zone_id, read_file('./test/fixtures/sangre.html')))
+
+    def test_interpret__several_zones__answered_in_request_order(self):
+        segments = interpret("vail front", joined=True)
+
+        self.assertEqual(1, len(segments))
+        self.assertLess(segments[0].index("Vail & Summit County - "),
+                        segments[0].index("Front Range - "))
+
+    def test_interpret__several_zones__share_one_segment_budget(self):
+        unjoined = interpret("front vail sangre", joined=False)
+        text = "\n\n".join(unjoined)
+
+        self.assertLessEqual(len(unjoined), MAX_SEGMENTS)
+        self.assertTrue(all(count_sms(s) == 1 for s in unjoined))
+        for name in ["Front Range", "Vail & Summit County", "Sangre De Cristo"]:
+            self.assertIn(name + " - ", text)
+        self.assertLess(text.index("Front Range - "), text.index("Vail & Summit County - "))
+        self.assertLess(text.index("Vail & Summit County - "), text.index("Sangre De Cristo - "))
+        self.assertIn("Sangre de Cristo forecast shortened", text)
+
+    def test_interpret__several_zones_joined__every_zone_in_the_message(self):
+        joined = interpret("front vail sangre", joined=True)
+
+        self.assertEqual(1, len(joined))
+        self.assertLessEqual(count_sms(joined[0]), MAX_SEGMENTS)
+        for name in ["Front Range", "Vail & Summit County", "Sangre De Cristo"]:
+            self.assertIn(name + " - ", joined[0])
+
+    def test_interpret__first_segments_alone_over_budget__last_zones_left_out_with_notice(self):
+        def long_interpret_zone(zone_id, joined, changes=False, sources=None):
+            return ["{} {}".format(zone_id, "x" * 150), "{} {}".format(zone_id, "y" * 150)]
+
+        with mock.patch.object(interpreter, 'interpret_zone', long_interpret_zone), \
+                mock.patch.object(interpreter, 'MAX_SEGMENTS', 3):
+            segments = interpret("front vail sangre", joined=False)
+
+        self.assertEqual(3, len(segments))
+        self.assertEqual("1 " + "x" * 150, segments[0])
+        self.assertEqual(["Front Range forecast shortened, request it alone for the rest",
+                          "Vail & Summit County forecast left out, request it alone",
+                          "Sangre de Cristo forecast left out, request it alone"],
+                         "\n\n".join(segments[1:]).split("\n\n"))
+
+    def test_interpret__misspelled_second_zone__only_exact_zones_answered(self):
+        requested = []
+
+        def record_interpret_zone(zone_id, joined, changes=False, sources=None):
+            requested.append(zone_id)
+            return ["zone {}".format(zone_id)]
+
+        with mock.patch.object(interpreter, 'interpret_zone', record_interpret_zone):
+            self.assertEqual(["zone 4"], interpret("gunisson or aspen", joined=False))
+            self.assertEqual(["zone 5"], interpret("gunisson", joined=False))
+
+        self.assertEqual([4, 5], requested)
+
+    def test_interpret__several_zones__fetched_concurrently(self):
+        def slow_interpret_zone(zone_id, joined, changes=False, sources=None):
+            time.sleep(0.3)
+            return ["zone {}".format(zone_id)]
+
+        start = time.perf_counter()
+        with mock.patch.object(interpreter, 'interpret_zone', slow_interpret_zone):
+            segments = interpret("front vail sangre", joined=False)
+
+        self.assertLess(time.perf_counter() - start, 0.6)
+        self.assertEqual(["zone 1\n\nzone 2\n\nzone 9"], segments)
+
+    def test_interpret__one_zone_fails__other_zones_answered(self):
+        rendered_store_read = rendered_store.read_rendered
+
+        def read_rendered(zone_id, store=None):
+            if zone_id == 2:
+                raise Exception("store unavailable")
+            return rendered_store_read(zone_id, store)
+
+        with mock.patch.object(interpreter, 'read_rendered', read_rendered), \
+                mock.patch.object(interpreter, 'download_html', side_effect=Exception("down")):
+            segments = interpret("front vail", joined=True)
+
+        self.assertIn("Front Range - ", segments[0])
+        self.assertIn("Unable to retrieve the Vail & Summit County forecast", segments[0])
@@ -0,0 +1,57 @@
+import glob
+import time
+import unittest
+
+from loadgen import Recorder, run_load, load_test, summarize
+from transport import reset_breakers
+
+FIXTURES = sorted(glob.glob('./test/fixtures/*.html'))
+
+
+class TestLoadGen(unittest.TestCase):
+
+    def setUp(self):
+        reset_breakers()
+
+    def test_run_load__slow_requests__started_at_the_rate_and_queueing_counted(self):
+        recorder = Recorder()
+        events = [('sms', {}) for _ in range(10)]
+
+        seconds = run_load(lambda route, event: time.sleep(0.1) or True, events, rate=100,
+                           max_in_flight=1, recorder=recorder)
+        report = summarize(recorder, seconds, 100)
+
+        self.assertEqual((10, 0), (report['requests'], report['errors']))
+        # One worker at a time, so the last request waited for the nine before it
+        self.assertGreater(report['p99_ms'], 800)
+
+    def test_run_load__failed_requests__counted_as_errors(self):
+        recorder = Recorder()
+
+        def send(route, event):
+            if event['fail']:
+                raise Exception("failed")
+            return route == 'sms'
+        events = [('sms', {'fail': False}), ('sms', {'fail': True}), ('email', {'fail': False})]
+        report = summarize(recorder, run_load(send, events, 1000, 2, recorder), 1000)
+
+        self.assertEqual(2, report['errors'])
+        self.assertEqual({'sms': 1, 'email': 1},
+                         {route: stats['errors'] for route, stats in report['routes'].items()})
+
+    def test_load_test__entrypoint__sms_and_email_answered_from_stubs(self):
+        report = load_test(FIXTURES, 20, rate=200, email_fraction=0.5, seed=1)
+
+        self.assertEqual((20, 0), (report['requests'], report['errors']))
+        self.assertEqual(['email', 'sms'], sorted(report['routes']))
+        self.assertIn('sms/interpret', report['stages'])
+        self.assertIn('email/send_inreach_response', report['stages'])
+        self.assertNotIn('sms/download_html', report['stages'])
+
+    def test_load_test__server_cold__zones_downloaded_from_the_caic_stub(self):
+        report = load_test(FIXTURES, 10, rate=200, target='server', email_fraction=0.0,
+                           cold=True)
+
+        self.assertEqual((10, 0), (report['requests'], report['errors']))
+        self.assertIn('sms/download_html', report['stages'])
+        self.assertEqual(0, report['failed_spans'])
@@ -0,0 +1,75 @@
+import io
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import interpreter
+import rendered_store
+from test.utils import read_file
+from interpreter import interpret, render_zone
+from rendered_store import read_rendered, publish_rendered
+
+
+class TestRenderedStore(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.store = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store.cleanup)
+        patcher = mock.patch.object(rendered_store, 'RENDERED_STORE', self.store.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_publish_rendered__read_back__has_joined_and_unjoined_segments(self):
+        publish_rendered(render_zone(9, read_file('./test/fixtures/sangre.html')))
+        rendered = read_rendered(9)
+
+        self.assertEqual("Mon, Feb 18, 2019 at 7:38 AM", rendered.forecast_date)
+        self.assertEqual(1, len(rendered.segments(joined=True)))
+        self.assertEqual("Sangre De Cristo - " + read_file('./test/fixtures/sangre.txt').strip(),
+                         rendered.segments(joined=True)[0].strip())
+        self.assertGreater(len(rendered.segments(joined=False)), 1)
+
+    def test_read_rendered__nothing_published__returns_None(self):
+        self.assertIsNone(read_rendered(9))
+
+    def test_interpret__fresh_rendered_forecast__served_without_download(self):
+        publish_rendered(render_zone(9, read_file('./test/fixtures/sangre.html')))
+
+        with mock.patch.object(interpreter, 'download_html') as download_html:
+            segments = interpret("sangre", joined=False)
+
+        download_html.assert_not_called()
+        self.assertEqual(read_rendered(9).segments(joined=False), segments)
+
+    def test_interpret__stale_rendered_forecast__falls_back_to_download(self):
+        rendered = render_zone(9, read_file('./test/fixtures/sangre.html'))
+        rendered.rendered_at = time.time() - rendered_store.MAX_RENDERED_AGE_SECONDS - 1
+        publish_rendered(rendered)
+
+        with mock.patch.object(interpreter, 'download_html',
+                               return_value=read_file('./test/fixtures/sangre.html')) as download:
+            segments = interpret("sangre", joined=False)
+
+        download.assert_called_once_with(9, None, interpreter.HTTP_CACHE)
+        self.assertEqual(rendered.segments(joined=False), segments)
+
+    def test_publish_rendered__s3_store__private_object_read_with_the_client(self):
+        objects = {}
+        client = mock.Mock()
+        client.put_object.side_effect = lambda **kwargs: objects.update({
+            (kwargs['Bucket'], kwargs['Key']): kwargs})
+        client.get_object.side_effect = lambda Bucket, Key: {
+            'Body': io.BytesIO(objects[(Bucket, Key)]['Body'])}
+        store = 's3://bucket/rendered'
+
+        with mock.patch.dict(rendered_store.BACKENDS, clear=True), \
+                mock.patch.object(rendered_store, 'rendered_s3_client', return_value=client):
+            publish_rendered(render_zone(9, read_file('./test/fixtures/sangre.html')), store)
+            rendered = read_rendered(9, store)
+
+        put, = objects.values()
+        self.assertEqual(('bucket', 'rendered/9.json'), (put['Bucket'], put['Key']))
+        self.assertNotIn('ACL', put)
+        self.assertEqual("Mon, Feb 18, 2019 at 7:38 AM", rendered.forecast_date)
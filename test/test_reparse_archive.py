@@ -0,0 +1,119 @@
+import csv
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import pyarrow
+import pyarrow.parquet
+
+from forecast_archive import open_archive
+from reparse_archive import legacy_snapshots, archive_snapshots, reparse, COLUMNS, \
+    CHECKPOINT_NAME
+from test.utils import read_file
+
+FIXTURES = ['sangre', 'unknownrating', 'deeppersistentslab']
+
+
+class TestReparseArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.out_dir = os.path.join(self.root.name, 'out')
+        for zone_id in [1, 9]:
+            zone_dir = os.path.join(self.root.name, 'CAIC', str(zone_id))
+            os.makedirs(zone_dir)
+            for number, fixture in enumerate(FIXTURES):
+                shutil.copy('./test/fixtures/{}.html'.format(fixture),
+                            os.path.join(zone_dir, '2019-03-0{} 06:00:00.000000'.format(number)))
+
+    def read_rows(self):
+        rows = []
+        for path in sorted(glob.glob(os.path.join(self.out_dir, 'part-*.csv'))):
+            with open(path, 'r', newline='') as f:
+                reader = csv.reader(f)
+                self.assertEqual(COLUMNS, next(reader))
+                rows.extend(reader)
+        return rows
+
+    def test_reparse__legacy_layout__one_row_per_problem_elevation_aspect(self):
+        snapshots = legacy_snapshots(self.root.name)
+        stats = reparse(snapshots, self.out_dir, workers=2, part_size=4, output_format='csv')
+
+        rows = self.read_rows()
+        self.assertEqual(6, len(snapshots))
+        self.assertEqual({'snapshots': 6, 'errors': 0, 'parts': 2},
+                         {k: stats[k] for k in ['snapshots', 'errors', 'parts']})
+        self.assertEqual(stats['rows'], len(rows))
+        self.assertEqual(0, len(rows) % 24)
+        self.assertEqual({'1', '9'}, set(row[0] for row in rows))
+        self.assertEqual({'true', 'false'}, set(row[-1] for row in rows))
+        self.assertIn(['9', 'SangreDeCristo', '2019-03-00 06:00:00.000000'], [r[:3] for r in rows])
+
+    def test_reparse__interrupted_run__resumes_from_checkpoint(self):
+        snapshots = legacy_snapshots(self.root.name)
+        reparse(snapshots, self.out_dir, workers=2, part_size=4, output_format='csv')
+        expected_rows = self.read_rows()
+
+        checkpoint_path = os.path.join(self.out_dir, CHECKPOINT_NAME)
+        with open(checkpoint_path, 'r') as f:
+            first_part = f.readlines()[0]
+        with open(checkpoint_path, 'w') as f:
+            f.write(first_part)
+        os.remove(os.path.join(self.out_dir, 'part-00001.csv'))
+
+        stats = reparse(snapshots, self.out_dir, workers=2, part_size=4, output_format='csv')
+
+        self.assertEqual(2, stats['snapshots'])
+        self.assertEqual(expected_rows, self.read_rows())
+        rerun = reparse(snapshots, self.out_dir, workers=2, output_format='csv')
+        self.assertEqual(0, rerun['snapshots'])
+
+    def test_reparse__forecast_archive__parses_each_indexed_version(self):
+        store = os.path.join(self.root.name, 'archive')
+        archive = open_archive(store)
+        for timestamp, fixture in enumerate(FIXTURES):
+            archive.store(9, read_file('./test/fixtures/{}.html'.format(fixture)), timestamp)
+
+        snapshots = archive_snapshots(open_archive(store), range(0, 10))
+        stats = reparse(snapshots, self.out_dir, workers=2, archive_store=store,
+                        output_format='csv')
+
+        self.assertEqual(3, stats['snapshots'])
+        self.assertEqual(0, stats['errors'])
+        self.assertEqual({'0', '1', '2'}, set(row[2] for row in self.read_rows()))
+
+    def test_reparse__failed_snapshot__not_checkpointed_and_retried(self):
+        broken = os.path.join(self.root.name, 'CAIC', '9', '2019-03-09 06:00:00.000000')
+        os.makedirs(broken)
+        snapshots = legacy_snapshots(self.root.name)
+
+        first = reparse(snapshots, self.out_dir, workers=2, output_format='csv')
+        os.rmdir(broken)
+        shutil.copy('./test/fixtures/sangre.html', broken)
+        second = reparse(snapshots, self.out_dir, workers=2, output_format='csv')
+
+        self.assertEqual((7, 1), (first['snapshots'], first['errors']))
+        self.assertEqual((1, 0), (second['snapshots'], second['errors']))
+        self.assertIn('2019-03-09 06:00:00.000000', set(row[2] for row in self.read_rows()))
+
+    def test_reparse__parquet__same_rows_as_csv(self):
+        snapshots = legacy_snapshots(self.root.name)
+        reparse(snapshots, self.out_dir, workers=2, part_size=4, output_format='csv')
+        csv_rows = self.read_rows()
+        parquet_dir = os.path.join(self.root.name, 'parquet')
+
+        stats = reparse(snapshots, parquet_dir, workers=2, part_size=4, output_format='parquet')
+
+        paths = sorted(glob.glob(os.path.join(parquet_dir, 'part-*.parquet')))
+        table = pyarrow.concat_tables([pyarrow.parquet.read_table(path) for path in paths])
+        self.assertEqual(2, stats['parts'])
+        self.assertEqual(COLUMNS, table.column_names)
+        self.assertEqual(len(csv_rows), table.num_rows)
+        self.assertEqual([int(row[0]) for row in csv_rows], table.column('zone_id').to_pylist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from test.utils import read_file
+from forecast import Forecast, Problem
+from serialization import loads, to_compact_json, to_legacy_json, to_binary, from_compact_json
+
+
+class TestSerialization(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.fixtures = [read_file('./test/fixtures/{}.json'.format(f)).strip()
+                         for f in ['sangre', 'unknownrating', 'deeppersistentslab']]
+
+    def test_loads__every_form__round_trips_to_the_legacy_fixture(self):
+        for legacy_json in self.fixtures:
+            forecast = loads(legacy_json)
+            for encoded in [to_legacy_json(forecast), to_compact_json(forecast),
+                            to_binary(forecast)]:
+                self.assertEqual(legacy_json, to_legacy_json(loads(encoded)))
+
+    def test_to_compact_json__legacy_fixture__is_smaller_and_versioned(self):
+        compact_json = to_compact_json(loads(self.fixtures[0]))
+
+        self.assertTrue(compact_json.startswith('{"v":1,'))
+        self.assertLess(len(compact_json), len(self.fixtures[0]))
+
+    def test_to_binary__unparsed_fields__round_trip_as_None(self):
+        forecast = Forecast(zone="Aspen")
+        forecast.problems = [Problem(None, None, None, None)]
+
+        self.assertEqual(dict(forecast), dict(loads(to_binary(forecast))))
+
+    def test_from_compact_json__unknown_version__raises(self):
+        with self.assertRaises(ValueError):
+            from_compact_json('{"v":99,"forecast":[]}')
+        with self.assertRaises(ValueError):
+            from_compact_json('{"v":1,"forecast":[null,null,null,[[7,1]],[],[]]}')
@@ -0,0 +1,175 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+
+import server
+from server import Server, make_app_server, twilio_signature
+
+TOKEN = "twilio-token"
+
+SES_TOKEN = "ses-token"
+
+
+class EchoEntrypoint(object):
+    """Answers sms events with their Body, after wait_for, if set, returns. Raises for events that
+    are neither sms nor ses"""
+
+    def __init__(self, wait_for=None):
+        self.wait_for = wait_for
+        self.entered = threading.Event()
+
+    def __call__(self, event, context, sources=None, email_s3_client=None):
+        if "queryStringParameters" in event:
+            self.entered.set()
+            if self.wait_for is not None:
+                self.wait_for()
+            body = event["queryStringParameters"]["Body"]
+            return {"statusCode": 200, "headers": {"Content-Type": "application/xml"},
+                    "body": "<Response>{}</Response>".format(body)}
+        if event.get("Records", [{}])[0].get("eventSource") == "aws:ses":
+            return None
+        raise Exception("Unknown lambda event")
+
+
+class TestServer(unittest.TestCase):
+
+    def serve(self, app):
+        httpd = make_app_server('127.0.0.1', 0, app)
+        thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+
+        def stop():
+            httpd.shutdown()
+            httpd.server_close()
+        self.addCleanup(stop)
+        return "http://127.0.0.1:{}".format(httpd.server_port)
+
+    def use_entrypoint(self, entrypoint):
+        patcher = mock.patch.object(server, 'entrypoint', entrypoint)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return entrypoint
+
+    def setUp(self):
+        self.use_entrypoint(EchoEntrypoint())
+
+    def server(self, **kwargs):
+        return Server(twilio_auth_token=TOKEN, ses_token=SES_TOKEN, **kwargs)
+
+    @staticmethod
+    def get_sms(url, body, token=TOKEN):
+        prepared = requests.Request('GET', url + "/sms", params={"Body": body}).prepare()
+        prepared.headers['X-Twilio-Signature'] = twilio_signature(token, prepared.url)
+        return requests.Session().send(prepared)
+
+    @staticmethod
+    def post_sms(url, form, token=TOKEN):
+        signature = twilio_signature(token, url + "/sms", form.items())
+        return requests.post(url + "/sms", data=form, headers={'X-Twilio-Signature': signature})
+
+    @staticmethod
+    def post_ses(url, token=SES_TOKEN, **kwargs):
+        return requests.post(url + "/ses", headers={'X-Avysms-Token': token}, **kwargs)
+
+    def test_sms__get_and_form_post__answered_with_twiml(self):
+        url = self.serve(self.server())
+
+        get = self.get_sms(url, "sangre")
+        post = self.post_sms(url, {"Body": "vail", "From": "+15550000000", "MediaUrl0": ""})
+
+        self.assertEqual((200, "<Response>sangre</Response>"), (get.status_code, get.text))
+        self.assertEqual("application/xml", get.headers['Content-Type'])
+        self.assertEqual((200, "<Response>vail</Response>"), (post.status_code, post.text))
+
+    def test_sms__signature_missing_or_wrong__forbidden(self):
+        url = self.serve(self.server())
+
+        unsigned = requests.post(url + "/sms", data={"Body": "vail"})
+        wrong_token = self.post_sms(url, {"Body": "vail"}, token="other")
+        signature = twilio_signature(TOKEN, url + "/sms", [("Body", "vail")])
+        altered = requests.post(url + "/sms", data={"Body": "aspen"},
+                                headers={'X-Twilio-Signature': signature})
+        health = requests.get(url + "/health").json()
+
+        self.assertEqual([403, 403, 403], [unsigned.status_code, wrong_token.status_code,
+                                           altered.status_code])
+        self.assertEqual((0, 3), (health['requests'], health['forbidden']))
+
+    def test_routes__no_tokens_configured__sms_and_ses_forbidden(self):
+        url = self.serve(Server(twilio_auth_token='', ses_token=''))
+
+        self.assertEqual(403, self.get_sms(url, "sangre", token='').status_code)
+        self.assertEqual(403, self.post_ses(url, token='', json={"Records": []}).status_code)
+
+    def test_sms__behind_a_proxy__signed_with_the_public_url(self):
+        url = self.serve(self.server(public_url="https://sms.avysms.com"))
+        signature = twilio_signature(TOKEN, "https://sms.avysms.com/sms", [("Body", "vail")])
+
+        response = requests.post(url + "/sms", data={"Body": "vail"},
+                                 headers={'X-Twilio-Signature': signature})
+
+        self.assertEqual((200, "<Response>vail</Response>"), (response.status_code, response.text))
+
+    def test_ses__event_posted_as_json__accepted(self):
+        url = self.serve(self.server())
+
+        ok = self.post_ses(url, json={"Records": [{"eventSource": "aws:ses"}]})
+        unknown = self.post_ses(url, json={"Records": [{"eventSource": "aws:s3"}]})
+        not_json = self.post_ses(url, data="not json")
+        no_token = self.post_ses(url, token="", json={"Records": [{"eventSource": "aws:ses"}]})
+
+        self.assertEqual((200, 500, 400, 403), (ok.status_code, unknown.status_code,
+                                                not_json.status_code, no_token.status_code))
+
+    def test_routes__unknown_path_or_method__rejected(self):
+        url = self.serve(self.server())
+        prepared = requests.Request('GET', url + "/sms").prepare()
+        prepared.headers['X-Twilio-Signature'] = twilio_signature(TOKEN, prepared.url)
+
+        self.assertEqual(404, requests.get(url + "/other").status_code)
+        self.assertEqual(405, requests.get(url + "/ses").status_code)
+        self.assertEqual(400, requests.Session().send(prepared).status_code)
+
+    def test_respond__status_without_a_known_reason__still_answered(self):
+        self.use_entrypoint(lambda event, *args: {
+            "statusCode": 299, "headers": {"Content-Type": "text/plain"}, "body": "odd"})
+        url = self.serve(self.server())
+
+        response = self.get_sms(url, "sangre")
+
+        self.assertEqual((299, "odd"), (response.status_code, response.text))
+
+    def test_sms__concurrent_requests__handled_in_parallel(self):
+        # Every request waits for all 8 to be inside entrypoint, so this only passes when they run
+        # at the same time
+        barrier = threading.Barrier(8, timeout=10)
+        self.use_entrypoint(EchoEntrypoint(wait_for=barrier.wait))
+        url = self.serve(self.server(max_concurrent=8))
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(lambda i: self.get_sms(url, str(i)), range(8)))
+
+        self.assertFalse(barrier.broken)
+        self.assertEqual(["<Response>{}</Response>".format(i) for i in range(8)],
+                         [response.text for response in responses])
+
+    def test_sms__no_free_slot__answered_with_503(self):
+        release = threading.Event()
+        entrypoint = self.use_entrypoint(EchoEntrypoint(wait_for=lambda: release.wait(10)))
+        url = self.serve(self.server(max_concurrent=1, queue_seconds=0.05))
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            first = executor.submit(self.get_sms, url, "x")
+            self.assertTrue(entrypoint.entered.wait(10))
+            # The first request holds the only slot until released
+            second = self.get_sms(url, "y")
+            release.set()
+            statuses = [first.result().status_code, second.status_code]
+        health = requests.get(url + "/health").json()
+
+        self.assertEqual([200, 503], statuses)
+        self.assertEqual((1, 1, 0, 'ok'), (health['requests'], health['rejected'],
+                                           health['in_flight'], health['status']))
@@ -0,0 +1,71 @@
+import unittest
+
+from sms_encoding import to_gsm7, to_sms_text, septet_count, count_sms, message_size, truncate, \
+    is_gsm7
+from format_segments import format_segments
+
+
+class TestSmsEncoding(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+
+    def test_to_gsm7__unicode_punctuation_and_accents__transliterated(self):
+        self.assertEqual("It's \"Considerable\" - 30 deg slopes... a e", to_gsm7(
+            "It’s “Considerable” – 30° slopes… á ê"))
+        self.assertEqual("no emoji ", to_gsm7("no emoji \U0001F3C2"))
+        self.assertEqual("[1] {a} ~ €", to_gsm7("[1] {a} ~ €"))
+
+    def test_to_sms_text__characters_without_gsm7_form__kept_for_ucs2(self):
+        self.assertEqual("It's 30 deg", to_sms_text("It’s 30°"))
+        self.assertEqual("soft hyphen", to_sms_text("soft\u00ad hyphen"))
+        self.assertEqual("Лавина – danger", to_sms_text("Лавина – danger"))
+
+    def test_septet_count__extended_characters__cost_two_septets(self):
+        self.assertEqual(5, septet_count("abcde"))
+        self.assertEqual(7, septet_count("[abc]"))
+        self.assertEqual(2, septet_count("€"))
+
+    def test_count_sms__gsm7_boundaries(self):
+        self.assertEqual(1, count_sms("a" * 160))
+        self.assertEqual(2, count_sms("a" * 161))
+        self.assertEqual(2, count_sms("a" * 306))
+        self.assertEqual(3, count_sms("a" * 307))
+        self.assertEqual(2, count_sms("[" * 80 + "a"))
+        # An escape sequence is not split, so the first part only holds 152 septets
+        self.assertEqual(3, count_sms("a" * 152 + "[" + "a" * 152))
+
+    def test_count_sms__ucs2_boundaries(self):
+        self.assertEqual(('UCS-2', 70, 70, 67), message_size("Ж" * 70))
+        self.assertEqual(1, count_sms("Ж" * 70))
+        self.assertEqual(2, count_sms("Ж" * 71))
+        self.assertEqual(3, count_sms("Ж" * 135))
+        self.assertFalse(is_gsm7("Ж"))
+
+    def test_truncate__counts_septets(self):
+        self.assertEqual("[[...", truncate("[[[[[", 7))
+        self.assertEqual("abc", truncate("abc", 3))
+
+    def test_format_segments__extended_characters__kept_and_budgeted_as_two_septets(self):
+        blocks = ["[" * 45, "a" * 75]
+
+        self.assertEqual(["[" * 45, "a" * 75], format_segments(blocks, joined=False))
+        self.assertEqual(["[" * 30 + "\n\n" + "a" * 75],
+                         format_segments(["[" * 30, "a" * 75], joined=False))
+
+    def test_format_segments__joined_escape_on_a_part_boundary__still_within_ten_sms(self):
+        # The euro sign would straddle the first and second part, so it starts the second
+        text = "a" * 152 + "€" + "b" * 2000
+
+        segments = format_segments([text], joined=True)
+
+        self.assertEqual(10, count_sms(segments[0]))
+        self.assertTrue(segments[0].startswith("a" * 152 + "€b"))
+        self.assertTrue(segments[0].endswith("b..."))
+
+    def test_format_segments__non_gsm7_text__sent_as_ucs2_within_70_units(self):
+        segments = format_segments(["Лавина " * 10, "Header"], joined=False)
+
+        self.assertEqual(["UCS-2", "GSM-7"], [message_size(s)[0] for s in segments])
+        self.assertTrue(all(count_sms(s) == 1 for s in segments))
+        self.assertEqual(("Лавина " * 10).split(), segments[0].split())
@@ -0,0 +1,163 @@
+import tempfile
+import unittest
+
+from forecast_archive import archive_backend
+from inreach import DeliveryLog
+from local_stubs import TwilioStubServer, InReachStubServer
+from rendered_store import RenderedForecast
+from subscriptions import Subscription, TokenBucket, TwilioProvider, InReachProvider, fan_out, \
+    push_forecast, open_subscriptions
+from transport import reset_breakers
+
+
+def no_backoff(attempt):
+    return 0
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_acquire__burst_spent__waits_for_the_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, burst=3, clock=clock, sleep=clock.sleep)
+
+        waits = [bucket.acquire() for _ in range(5)]
+
+        self.assertEqual([0.0, 0.0, 0.0], waits[:3])
+        self.assertAlmostEqual(0.1, waits[3])
+        self.assertAlmostEqual(0.1, waits[4])
+        self.assertAlmostEqual(0.2, clock.now)
+
+    def test_acquire__no_rate__never_waits(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=None, clock=clock, sleep=clock.sleep)
+
+        self.assertEqual([0.0] * 100, [bucket.acquire() for _ in range(100)])
+        self.assertEqual([], clock.sleeps)
+
+
+class TestSubscriptionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = tempfile.TemporaryDirectory()
+        self.addCleanup(self.store.cleanup)
+
+    def test_subscribe__resubscribed__replaces_the_subscription(self):
+        store = open_subscriptions(self.store.name)
+        store.subscribe(Subscription("a", 9, 'sms', "+15550000001"))
+        store.subscribe(Subscription("b", 9, 'sms', "+15550000002"))
+        store.subscribe(Subscription("a", 9, 'sms', "+15550000003", joined=False))
+
+        subscriptions = open_subscriptions(self.store.name).subscriptions(9)
+        self.assertEqual([("b", "+15550000002", True), ("a", "+15550000003", False)],
+                         [(s.subscriber_id, s.address, s.joined) for s in subscriptions])
+        self.assertEqual([], store.subscriptions(1))
+
+    def test_unsubscribe__removes_only_that_subscriber(self):
+        store = open_subscriptions(self.store.name)
+        store.subscribe(Subscription("a", 9, 'sms', "+15550000001"))
+        store.subscribe(Subscription("b", 9, 'sms', "+15550000002"))
+
+        self.assertTrue(store.unsubscribe(9, "a"))
+        self.assertFalse(store.unsubscribe(9, "a"))
+        self.assertEqual(["b"], [s.subscriber_id for s in store.subscriptions(9)])
+
+
+class TestFanOut(unittest.TestCase):
+
+    def setUp(self):
+        reset_breakers()
+        self.rendered = RenderedForecast(9, 0, "Sun, Mar 17, 2019", ["joined one"],
+                                         ["unjoined one", "unjoined two"])
+        self.push_log = DeliveryLog()
+
+    def subscriptions(self, count):
+        return [Subscription(str(i), 9, 'sms', "+1555{:07d}".format(i), joined=i % 2 == 0)
+                for i in range(count)]
+
+    def fan_out(self, twilio, subscriptions, **kwargs):
+        provider = TwilioProvider('AC0', 'token', '+15550000000', twilio.api_url,
+                                  TokenBucket(None))
+        return fan_out(self.rendered, subscriptions, {'sms': provider}, push_log=self.push_log,
+                       backoff=no_backoff, sleep=lambda s: None, **kwargs)
+
+    def test_fan_out__every_subscriber_gets_their_messages_in_order(self):
+        subscriptions = self.subscriptions(40)
+        with TwilioStubServer(delay_seconds=0.01) as twilio:
+            result = self.fan_out(twilio, subscriptions, batch_size=7, max_in_flight=4)
+
+        self.assertEqual((40, 40, 0, 60), (result.subscribers, result.delivered, result.failed,
+                                           result.messages))
+        for subscription in subscriptions:
+            received = [body for to, body in twilio.messages if to == subscription.address]
+            expected = self.rendered.segments(subscription.joined)
+            self.assertEqual(expected, received)
+        self.assertLessEqual(twilio.max_in_flight, 4)
+
+    def test_fan_out__transient_errors__retried_and_client_errors_fail_the_subscriber(self):
+        subscriptions = self.subscriptions(3)
+        with TwilioStubServer(failures=[503, 429, 400]) as twilio:
+            result = self.fan_out(twilio, subscriptions, max_in_flight=1)
+
+        self.assertEqual((2, 1), (result.delivered, result.failed))
+        self.assertEqual(6, result.attempts)
+        self.assertNotIn("+15550000000", [to for to, _ in twilio.messages])
+        self.assertEqual([("+15550000001", "unjoined one"), ("+15550000001", "unjoined two"),
+                          ("+15550000002", "joined one")], twilio.messages)
+
+    def test_fan_out__rerun__only_sends_what_was_not_delivered(self):
+        subscriptions = self.subscriptions(3)
+        with TwilioStubServer(failures=[400]) as twilio:
+            first = self.fan_out(twilio, subscriptions, max_in_flight=1)
+            second = self.fan_out(twilio, subscriptions, max_in_flight=1)
+
+        self.assertEqual((2, 1), (first.delivered, first.failed))
+        self.assertEqual((1, 2, 1), (second.delivered, second.skipped, second.messages))
+        self.assertEqual(("+15550000000", "joined one"), twilio.messages[-1])
+        self.assertEqual(4, len(twilio.messages))
+
+    def test_fan_out__stored_push_log__new_process_sends_nothing_again(self):
+        subscriptions = self.subscriptions(2)
+        with tempfile.TemporaryDirectory() as store, TwilioStubServer() as twilio:
+            self.push_log = DeliveryLog(archive_backend(store))
+            first = self.fan_out(twilio, subscriptions)
+            self.push_log = DeliveryLog(archive_backend(store))
+            second = self.fan_out(twilio, subscriptions)
+
+        self.assertEqual((2, 3), (first.delivered, first.messages))
+        self.assertEqual((2, 0), (second.skipped, second.messages))
+        self.assertEqual(3, len(twilio.messages))
+
+    def test_fan_out__unknown_channel__counted_as_failed(self):
+        with TwilioStubServer() as twilio:
+            result = self.fan_out(twilio, [Subscription("x", 9, 'pager', "1234")])
+
+        self.assertEqual(1, result.failed)
+        self.assertEqual([], twilio.requests)
+
+    def test_fan_out__inreach_subscriber__replied_in_their_conversation(self):
+        with InReachStubServer() as inreach:
+            subscription = Subscription("i", 9, 'inreach', inreach.reply_url)
+            result = fan_out(self.rendered, [subscription],
+                             {'inreach': InReachProvider(TokenBucket(None))},
+                             push_log=self.push_log)
+
+        self.assertEqual(1, result.delivered)
+        self.assertEqual([("00000000-0000-0000-0000-000000000000", "joined one")],
+                         inreach.messages)
+
+    def test_push_forecast__no_subscribers__sends_nothing(self):
+        with tempfile.TemporaryDirectory() as store:
+            self.assertIsNone(push_forecast(self.rendered, store))
@@ -0,0 +1,123 @@
+import io
+import json
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import download_caic_html
+import rendered_store
+from test.utils import read_file
+from download_caic_html import HttpCache
+from forecast_cache import FORECAST_CACHE
+from interpreter import interpret
+from local_stubs import CaicStubServer
+from tracing import trace, span, annotate, bind, emit, aggregate, read_records
+
+
+class TestTracing(unittest.TestCase):
+
+    def collect(self, route, function):
+        records = []
+        with trace(route, sink=records.extend):
+            function()
+        return records
+
+    def test_span__outside_a_trace__does_nothing(self):
+        with span('stage') as stage:
+            annotate(segments=1)
+
+        self.assertIsNone(stage)
+
+    def test_trace__spans__become_emf_records(self):
+        def run():
+            with span('download_html', zone_id=9):
+                annotate(html_bytes=1024, cache_hit=True)
+
+        record, = self.collect('sms', run)
+
+        self.assertEqual('sms', record['route'])
+        self.assertEqual('download_html', record['stage'])
+        self.assertEqual('9', record['zone_id'])
+        self.assertEqual(1024, record['html_bytes'])
+        self.assertTrue(record['cache_hit'])
+        directive, = record['_aws']['CloudWatchMetrics']
+        self.assertEqual([['route', 'stage'], ['route', 'stage', 'zone_id']],
+                         directive['Dimensions'])
+        self.assertEqual({'duration_ms': 'Milliseconds', 'html_bytes': 'Bytes'},
+                         {m['Name']: m['Unit'] for m in directive['Metrics']})
+
+    def test_trace__nested__joins_outer_trace(self):
+        def run():
+            with trace('interpret'), span('inner'):
+                pass
+
+        records = self.collect('sms', run)
+
+        self.assertEqual(['sms'], [r['route'] for r in records])
+
+    def test_span__error__flagged_and_raised(self):
+        def run():
+            with self.assertRaises(ValueError), span('parse_forecast'):
+                raise ValueError()
+
+        record, = self.collect('sms', run)
+
+        self.assertTrue(record['error'])
+
+    def test_bind__worker_threads__record_into_calling_trace(self):
+        def work(zone_id):
+            with span('read_rendered', zone_id=zone_id):
+                pass
+
+        def run():
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                list(executor.map(bind(work), [1, 2, 3]))
+
+        records = self.collect('sms', run)
+
+        self.assertEqual(['1', '2', '3'], sorted(r['zone_id'] for r in records))
+
+    def test_aggregate__emitted_lines__percentiles_per_stage_and_zone(self):
+        records = []
+        for duration in range(1, 101):
+            records.append({'stage': 'parse_forecast', 'zone_id': '9', 'duration_ms': duration,
+                            '_aws': {}})
+        records.append({'stage': 'match_zones', 'duration_ms': 0.5, '_aws': {}})
+        stream = io.StringIO()
+        emit(records, stream)
+        lines = ["[INFO] not a record"] + stream.getvalue().splitlines()
+
+        by_stage = aggregate(read_records(lines))
+        by_zone = aggregate(read_records(lines), ('stage', 'zone_id'))
+
+        self.assertEqual({'count': 100, 'p50_ms': 51, 'p95_ms': 95, 'p99_ms': 99},
+                         by_stage[('parse_forecast',)])
+        self.assertEqual(1, by_stage[('match_zones',)]['count'])
+        self.assertEqual([('parse_forecast', '9')], list(by_zone))
+
+    def test_interpret__cold_zone__records_every_stage(self):
+        FORECAST_CACHE.clear()
+        html = read_file('./test/fixtures/sangre.html')
+        with tempfile.TemporaryDirectory() as store, CaicStubServer({9: html}) as server, \
+                mock.patch.object(download_caic_html, 'CAIC_URL_TEMPLATE', server.url_template), \
+                mock.patch.object(download_caic_html, 'HTTP_CACHE', HttpCache(store)), \
+                mock.patch.object(rendered_store, 'RENDERED_STORE', store):
+            records = self.collect('sms', lambda: interpret("sangre", joined=True))
+
+        stages = {r['stage']: r for r in records}
+        self.assertEqual({'interpret', 'match_zones', 'read_rendered', 'download_html',
+                          'parse_forecast', 'forecast_to_segments', 'format_segments'},
+                         set(stages))
+        self.assertFalse(stages['read_rendered']['cache_hit'])
+        self.assertFalse(stages['download_html']['cache_hit'])
+        self.assertFalse(stages['parse_forecast']['cache_hit'])
+        self.assertEqual(len(html.encode('utf-8')), stages['parse_forecast']['html_bytes'])
+        self.assertGreater(stages['format_segments']['segments'], 0)
+        self.assertGreaterEqual(stages['interpret']['duration_ms'],
+                                stages['download_html']['duration_ms'])
+        json.dumps(records)
+
+
+if __name__ == '__main__':
+    unittest.main()
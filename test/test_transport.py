@@ -0,0 +1,92 @@
+import tempfile
+import unittest
+
+from test.utils import read_file
+from download_caic_html import download_html, HttpCache
+from local_stubs import CaicStubServer, InReachStubServer
+from transport import CircuitBreaker, CircuitOpenError, request, session, breaker, reset_breakers
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        reset_breakers()
+
+    def tearDown(self):
+        reset_breakers()
+
+    def test_circuit_breaker__consecutive_failures__opens_then_lets_one_trial_through(self):
+        clock = FakeClock()
+        circuit = CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=clock)
+
+        circuit.record_failure()
+        self.assertTrue(circuit.allow())
+        circuit.record_failure()
+        self.assertEqual('open', circuit.state)
+        self.assertFalse(circuit.allow())
+
+        clock.now = 10
+        self.assertTrue(circuit.allow())
+        self.assertFalse(circuit.allow())
+        circuit.record_failure()
+        self.assertEqual('open', circuit.state)
+
+        clock.now = 20
+        self.assertTrue(circuit.allow())
+        circuit.record_success()
+        self.assertEqual('closed', circuit.state)
+        self.assertTrue(circuit.allow())
+
+    def test_circuit_breaker__success__resets_failure_count(self):
+        circuit = CircuitBreaker(failure_threshold=2)
+        circuit.record_failure()
+        circuit.record_success()
+        circuit.record_failure()
+
+        self.assertEqual('closed', circuit.state)
+
+    def test_session__per_call_site__pooled_and_reused(self):
+        caic = session('caic')
+
+        self.assertIs(caic, session('caic'))
+        self.assertIsNot(caic, session('inreach'))
+        self.assertEqual(10, caic.get_adapter('https://x')._pool_maxsize)
+        self.assertEqual(0, session('inreach').get_adapter('https://x').max_retries.total)
+
+    def test_request__server_errors__open_breaker_and_fail_fast(self):
+        with InReachStubServer(failures=[503] * 10) as server:
+            for _ in range(3):
+                self.assertEqual(503, request('inreach', 'POST', server.reply_url,
+                                              data={'Guid': 'g', 'ReplyMessage': 'm'}).status_code)
+            with self.assertRaises(CircuitOpenError):
+                request('inreach', 'POST', server.reply_url)
+
+        self.assertEqual(3, len(server.requests))
+
+    def test_download_html__caic_down__serves_cached_copy_then_fails_fast(self):
+        html = read_file('./test/fixtures/sangre.html')
+        with tempfile.TemporaryDirectory() as cache_dir:
+            http_cache = HttpCache(cache_dir)
+            server = CaicStubServer({9: html}).start()
+            url_template = server.url_template
+            self.assertEqual(html, download_html(9, url_template, http_cache))
+            server.stop()
+
+            for _ in range(4):
+                self.assertEqual(html, download_html(9, url_template, http_cache, timeout=(1, 1)))
+            self.assertEqual('open', breaker(url_template.format(9)).state)
+
+            with self.assertRaises(CircuitOpenError):
+                download_html(9, url_template, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import json
+import timeit
+import unittest
+
+from test.utils import read_file
+from interpreter import CAIC_ZONE_MATCHES_TO_IDS, interpret, HELP_TEXT
+from zone_matcher import ZoneMatcher, BKTree, edit_distance
+
+
+class TestZoneMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.matcher = ZoneMatcher(CAIC_ZONE_MATCHES_TO_IDS)
+
+    def test_match__request_corpus__matches_expected_zones(self):
+        for request, zone_id in json.loads(read_file('./test/fixtures/zone_requests.json')):
+            with self.subTest(request=request):
+                match = self.matcher.match(request)
+                self.assertEqual(zone_id, match.zone_id if match is not None else None)
+
+    def test_rank__exact_match_before_misspelled_match(self):
+        ranked = self.matcher.rank("gunisson or aspen")
+
+        self.assertEqual([4, 5], [m.zone_id for m in ranked])
+        self.assertEqual([0, 2], [m.distance for m in ranked])
+
+    def test_rank__ordinary_words_beside_a_zone__only_the_zone_matched(self):
+        self.assertEqual([2], [m.zone_id for m in self.matcher.rank("vail frost danger")])
+        self.assertEqual([1], [m.zone_id for m in self.matcher.rank("front range summer aspect")])
+        self.assertEqual([], self.matcher.rank("flatirons sail mess"))
+        self.assertEqual([], self.matcher.rank("steady snow by the stream, flatter than vial"))
+
+    def test_rank__short_misspelled_token__only_matched_within_a_longer_name(self):
+        self.assertEqual([], self.matcher.rank("jaun"))
+        self.assertEqual([(8, 1)], [(m.zone_id, m.distance)
+                                    for m in self.matcher.rank("south san jaun")])
+
+    def test_match__runs_in_microseconds(self):
+        seconds = timeit.timeit(lambda: self.matcher.match("forecast frnt range"), number=1000)
+        self.assertLess(seconds / 1000, 0.001)
+
+    def test_bk_tree__search__returns_words_within_distance(self):
+        tree = BKTree(["front", "vail", "aspen", "mesa", "juan"])
+
+        self.assertEqual([(1, "front")], tree.search("frnt", 1))
+        self.assertEqual([(1, "vail")], tree.search("vial", 1))
+        self.assertEqual([(0, "mesa")], tree.search("mesa", 2))
+        self.assertEqual(3, edit_distance("kitten", "sitting"))
+
+    def test_interpret__unknown_request__returns_help_text(self):
+        self.assertEqual([HELP_TEXT], interpret("help", joined=False))